@@ -1,72 +1,40 @@
-import os
-import psutil
-import importlib
-import serial
-import time
-import json
-import sys
-import atexit
-import logging
+"""
+Cultiva Node
 
-from flask import Flask, current_app, send_file, request, jsonify
-from flask_cors import CORS
-from flask_socketio import SocketIO
-from flask_apscheduler import APScheduler
+The application is built by create_app(). Importing this package does not
+import Flask, open ports or start threads, each subsystem is created the
+first time it is used (see app.services).
+ """
 
-app = Flask(__name__, static_folder='../dist/static')
+def create_app(config=None):
+    from flask import Flask
+    from flask_cors import CORS
+    from flask_socketio import SocketIO
 
-from .config import Config
+    from .config import Config
+    from .services import Extensions
+    from .api import api_bp
+    from .routes import routes_bp, register_socket_handlers
 
-from .api import api_bp
-from .client import client_bp
+    app = Flask(__name__, static_folder=None)
+    app.config.from_object(Config)
+    app.config['SECRET_KEY'] = 'vnkdjnfjknfl1232#'
+    app.config.update(config or {})
 
-from app.core.command import run_command
-from app.core.log import Logger
+    app.extensions = Extensions(app, app.extensions)
+    app.extensions['LOG_LEVEL'] = 'info'
 
-CORS(app)
+    CORS(app)
 
-app.register_blueprint(api_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(routes_bp)
 
-app.extensions['IRRIGATION_CONNECTION'] = getattr(importlib.import_module('app.irrigation.module'), 'IrrigationControllerConnectionProvider')()
-app.extensions['LOG_LEVEL'] = 'info'
+    socket = SocketIO(app, cors_allowed_origins="*")
+    register_socket_handlers(socket, app)
 
-app.config['SECRET_KEY'] = 'vnkdjnfjknfl1232#'
+    return app
 
-socket = SocketIO(app, cors_allowed_origins="*")
-    
-scheduler = APScheduler()
-scheduler.init_app(app)
-#scheduler.add_job('sentinel', func=lambda: run_command(app, Logger('Sentinel', app), 'runSentinel', []), trigger="interval", seconds=37)
-#scheduler.add_job('irrigation', func=lambda: run_command(app, Logger('Irrigation', app), 'runIrrigationProgramme'), trigger="interval", seconds=11)
-scheduler.start()
+def start_background_services(app):
+    from .services import start_background_services
 
-atexit.register(lambda: scheduler.shutdown())
-
-if __name__ == '__main__':
-    socket.run(app, debug=True)
-
-@socket.on('command')
-def handle_event(command, methods=['GET', 'POST']):
-    logger = Logger('Terminal', app, [lambda message: socket.emit('log', message)])
-    arguments = command['input'].replace(command['type'], '').strip().split()
-    result = run_command(app, logger, command['type'], [ arguments[0] if len(arguments) > 0 else None ])
-    socket.emit('log', result['result'])
-    socket.emit('result', result['success'])
-    
-@app.route('/run', methods = ['GET','POST'])
-def run():
-    arguments = request.args.getlist('arguments')
-    
-    if request.method == 'POST':
-        arguments = [request.get_json(silent=True)]
-
-    logger = Logger('CommandRunner', app)
-    result = run_command(app, logger, request.args.get('command'), arguments)
-    return jsonify(result)
-
-@app.route('/')
-def index_client():
-    dist_dir = current_app.config['DIST_DIR']
-    entry = os.path.join(dist_dir, 'index.html')
-    return send_file(entry)  
-    
\ No newline at end of file
+    return start_background_services(app)
@@ -9,6 +9,7 @@ from flask_restplus import Resource
 
 from .security import require_auth
 from . import api_rest
+from app.core.timeseries import health, RESOLUTIONS
 
 
 class SecureResource(Resource):
@@ -36,3 +37,31 @@ class SecureResourceOne(SecureResource):
     def get(self, resource_id):
         timestamp = datetime.utcnow().isoformat()
         return {'timestamp': timestamp}
+
+
+@api_rest.route('/health')
+class HealthSeriesList(Resource):
+    """ Names of the recorded node health series """
+
+    def get(self):
+        return {'series': health.names()}
+
+
+@api_rest.route('/health/<string:name>')
+class HealthSeries(Resource):
+    """ One node health series between start and end (epoch seconds), by resolution raw, 1m or 1h """
+
+    def get(self, name):
+        series = health.get(name, create=False)
+
+        if series is None:
+            return {'message': "Series '" + name + "' not found"}, 404
+
+        resolution = request.args.get('resolution', 'raw')
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+
+        if resolution not in [resolution_name for resolution_name, step, capacity in RESOLUTIONS]:
+            return {'message': "Unknown resolution '" + resolution + "'"}, 400
+
+        return series.to_dict(resolution, start, end)
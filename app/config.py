@@ -5,7 +5,7 @@ See `.flaskenv` for default settings.
  """
 
 import os
-from app import app
+import tempfile
 
 
 class Config(object):
@@ -18,12 +18,91 @@ class Config(object):
     ROOT_DIR = os.path.dirname(APP_DIR)
     DIST_DIR = os.path.join(ROOT_DIR, 'dist')
 
-    if not os.path.exists(DIST_DIR):
-        raise Exception(
-            'DIST_DIR not found: {}'.format(DIST_DIR))
+    # Client files smaller than this are served uncompressed, gzip and
+    # brotli headers would outweigh the savings
+    ASSET_MIN_SIZE = int(os.getenv('ASSET_MIN_SIZE', '512'))
             
     HUB_ADDRESS = 'http://localhost:1000'
     #HUB_ADDRESS = 'http://104.248.242.27'
     NODE_ID = 2
 
-app.config.from_object('app.config.Config')
+    # Alerts go to the hub in gzip compressed batches of HUB_BATCH_SIZE,
+    # with at most HUB_PARALLELISM requests in flight over pooled connections
+    HUB_BATCH_SIZE = int(os.getenv('HUB_BATCH_SIZE', '100'))
+    HUB_PARALLELISM = int(os.getenv('HUB_PARALLELISM', '2'))
+    HUB_TIMEOUT = float(os.getenv('HUB_TIMEOUT', '10'))
+
+    # The alert outbox sends at most OUTBOX_MAX_IN_FLIGHT alerts at a time
+    # and OUTBOX_DRAIN_RATE alerts per second, failed alerts are retried
+    # after OUTBOX_BASE_DELAY seconds, doubling up to OUTBOX_MAX_DELAY, a
+    # drain rate of 0 leaves the rate unlimited
+    OUTBOX_MAX_IN_FLIGHT = int(os.getenv('OUTBOX_MAX_IN_FLIGHT', '100'))
+    OUTBOX_DRAIN_RATE = float(os.getenv('OUTBOX_DRAIN_RATE', '50'))
+    OUTBOX_BASE_DELAY = float(os.getenv('OUTBOX_BASE_DELAY', '5'))
+    OUTBOX_MAX_DELAY = float(os.getenv('OUTBOX_MAX_DELAY', '600'))
+
+    # Pipeline controller commands over one reader thread instead of
+    # holding the serial lock for every round trip
+    CONTROLLER_MULTIPLEXING = os.getenv('CONTROLLER_MULTIPLEXING', 'false') == 'true'
+
+    # Seconds a sensor reading is served from memory before the
+    # controller is asked again, 0 disables caching
+    SENSOR_CACHE_TTL = float(os.getenv('SENSOR_CACHE_TTL', '2'))
+
+    # Wire protocol requested from controllers during warmup, 'binary'
+    # falls back to 'json' when the firmware does not support it
+    CONTROLLER_PROTOCOL = os.getenv('CONTROLLER_PROTOCOL', 'json')
+
+    # Seconds a controller link may stay idle before a heartbeat is sent,
+    # links missing two heartbeats are re-established in the background,
+    # 0 disables the keepalive
+    CONTROLLER_KEEPALIVE_INTERVAL = float(os.getenv('CONTROLLER_KEEPALIVE_INTERVAL', '30'))
+
+    # Re-import command modules whose source file changed on disk before
+    # running a command, for development only
+    COMMAND_HOT_RELOAD = os.getenv('COMMAND_HOT_RELOAD', 'false') == 'true'
+
+    # Commands started with /run?async=true or over the socket run on this
+    # many worker threads, the most recent JOB_HISTORY jobs can be polled
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    JOB_HISTORY = int(os.getenv('JOB_HISTORY', '256'))
+
+    # Socket log lines are sent in one batch per interval (seconds) of at most
+    # MAX_BATCH lines, a slow client keeps MAX_PENDING lines before the
+    # oldest are dropped and a new client is replayed the last REPLAY lines
+    LOG_STREAM_INTERVAL = float(os.getenv('LOG_STREAM_INTERVAL', '0.1'))
+    LOG_STREAM_MAX_BATCH = int(os.getenv('LOG_STREAM_MAX_BATCH', '100'))
+    LOG_STREAM_MAX_PENDING = int(os.getenv('LOG_STREAM_MAX_PENDING', '1000'))
+    LOG_STREAM_REPLAY = int(os.getenv('LOG_STREAM_REPLAY', '500'))
+
+    # Log records are written by a background listener thread, 'json'
+    # writes one structured record per line instead of plain text
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+
+    # /run?profile=true and profiled socket commands also write their raw
+    # cProfile dump here when set
+    PROFILE_DIR = os.getenv('PROFILE_DIR') or None
+
+    # Irrigation and sentinel programmes run on their own schedule when
+    # enabled, sentinel runs are skipped while irrigation is running
+    SCHEDULE_PROGRAMMES = os.getenv('SCHEDULE_PROGRAMMES', 'false') == 'true'
+    IRRIGATION_INTERVAL = int(os.getenv('IRRIGATION_INTERVAL', '11'))
+    SENTINEL_INTERVAL = int(os.getenv('SENTINEL_INTERVAL', '37'))
+
+    # Sentinel probes run concurrently and each one is given up on after
+    # this many seconds, connectivity is checked once per run with it
+    SENTINEL_PROBE_TIMEOUT = float(os.getenv('SENTINEL_PROBE_TIMEOUT', '5'))
+
+    # Sentinel state and alerts live in memory, changes made within this many
+    # seconds are written to sentinel.json as one snapshot by the process
+    # that owns the hardware
+    SENTINEL_STORE_FLUSH_INTERVAL = float(os.getenv('SENTINEL_STORE_FLUSH_INTERVAL', '5'))
+
+    SCHEDULER_EXECUTORS = { 'default': { 'type': 'threadpool', 'max_workers': 4 } }
+    SCHEDULER_JOB_DEFAULTS = { 'coalesce': True, 'max_instances': 1 }
+
+    # Only one process owns the controllers and the scheduler, 'auto' lets
+    # the first process to lock OWNER_LOCK_FILE take them, 'true' and
+    # 'false' decide without the lock
+    HARDWARE_OWNER = os.getenv('HARDWARE_OWNER', 'auto')
+    OWNER_LOCK_FILE = os.getenv('OWNER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'cultiva-node.lock'))
@@ -0,0 +1,141 @@
+"""
+Assets
+
+Serves the built client from memory. Each file is read once, compressed once
+per encoding (or taken from a .gz/.br file the build left next to it) and
+kept with a strong ETag per variant. Files whose name carries a content hash
+never change, so they are sent as immutable and cached for a year, everything
+else is revalidated and answered with 304 while it is unchanged.
+ """
+
+import os
+import re
+import io
+import gzip
+import hashlib
+import threading
+import mimetypes
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/x-font-ttf')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+def compress_gzip(data):
+    # A zero mtime keeps the bytes, and so the ETag, the same on every start
+    buffer = io.BytesIO()
+
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as file:
+        file.write(data)
+
+    return buffer.getvalue()
+
+def compress_brotli(data):
+    return brotli.compress(data, quality=11)
+
+ENCODINGS = [('br', '.br', compress_brotli if brotli is not None else None), ('gzip', '.gz', compress_gzip)]
+
+class Asset:
+    def __init__(self, path, data, mimetype, cache_control, min_size=512):
+        self.path = path
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.modified = os.path.getmtime(path)
+        self.variants = { 'identity': self.variant('identity', data) }
+
+        if len(data) < min_size or not mimetype.startswith(COMPRESSIBLE_TYPES):
+            return
+
+        for encoding, suffix, compress in ENCODINGS:
+            compressed = read(path + suffix) if os.path.exists(path + suffix) else None
+
+            if compressed is None and compress is not None:
+                compressed = compress(data)
+
+            if compressed is not None and len(compressed) < len(data):
+                self.variants[encoding] = self.variant(encoding, compressed)
+
+    def variant(self, encoding, data):
+        digest = hashlib.sha1(data).hexdigest()[:20]
+        etag = digest if encoding == 'identity' else digest + '-' + encoding
+
+        return (data, etag)
+
+    def select(self, accept_encodings):
+        """ Returns (encoding, data, etag) for the best variant the client accepts """
+
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return (encoding,) + self.variants[encoding]
+
+        return ('identity',) + self.variants['identity']
+
+class AssetCache:
+    def __init__(self, directory, min_size=512):
+        self.directory = os.path.realpath(directory)
+        self.min_size = min_size
+        self.lock = threading.Lock()
+        self.assets = {}
+
+    def get(self, filename):
+        path = os.path.realpath(os.path.join(self.directory, filename))
+
+        if not path.startswith(self.directory + os.sep) or not os.path.isfile(path):
+            return None
+
+        asset = self.assets.get(path)
+
+        # Hashed files are immutable, the others are checked for a newer
+        # build before they are served from memory again
+        if asset is not None and (asset.cache_control == IMMUTABLE or os.path.getmtime(path) == asset.modified):
+            return asset
+
+        with self.lock:
+            asset = self.load(path)
+            self.assets[path] = asset
+
+        return asset
+
+    def load(self, path):
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        if path.endswith('.map'):
+            mimetype = 'application/json'
+
+        cache_control = IMMUTABLE if HASHED_NAME.search(os.path.basename(path)) else REVALIDATE
+
+        return Asset(path, read(path), mimetype, cache_control, self.min_size)
+
+    def response(self, filename, request):
+        """ Builds the response for filename, or returns None when there is no such asset """
+
+        asset = self.get(filename)
+
+        if asset is None:
+            return None
+
+        encoding, data, etag = asset.select(request.accept_encodings)
+        headers = { 'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding' }
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(data, mimetype=asset.mimetype, headers=headers)
+
+        response.set_etag(etag)
+
+        return response
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
@@ -1,57 +1,182 @@
-import re
+import os
+import time
+import inspect
 import traceback
+import weakref
 import importlib
 import logging
 
+from threading import RLock
+
+from app.core import tracing
+from app.core.metrics import registry as metrics
+
+command_seconds = metrics.histogram('cultiva_command_seconds', 'Duration of commands run through run_command', ['command', 'success'])
+
 class InvalidCommandError(Exception):
     def __init__(self, command):
         self.command = command
         self.message = "Command '" + command + "' is invalid"
         super().__init__(self.message)
 
-def run_command(app, logger, command, arguments=[]): 
+class CommandModule:
+    def __init__(self, name, handler=None):
+        self.name = name
+        self.handler = handler
+        self.module = None
+        self.modified = None
+        self.instances = weakref.WeakKeyDictionary()
+
+    def load(self, reload=False):
+        module = importlib.import_module(self.name)
+
+        if reload:
+            module = importlib.reload(module)
+
+        self.module = module
+        self.modified = self.modification_time()
+        self.instances = weakref.WeakKeyDictionary()
+
+    def modification_time(self):
+        try:
+            return os.path.getmtime(self.module.__file__)
+        except OSError:
+            return None
+
+    def changed(self):
+        return self.modification_time() != self.modified
+
+    def command_names(self):
+        if self.handler is None:
+            members = inspect.getmembers(self.module, lambda member: inspect.isfunction(member) and member.__module__ == self.module.__name__)
+        else:
+            members = inspect.getmembers(getattr(self.module, self.handler), inspect.isfunction)
+
+        return [name for name, member in members if not name.startswith('_')]
+
+    def resolve(self, name, app=None):
+        if self.handler is None:
+            return getattr(self.module, name)
+
+        # Handlers hold on to the extensions of the app they were built in,
+        # every app gets its own, lookups without an app share one
+        key = self if app is None else app
+        instance = self.instances.get(key)
+
+        if instance is None:
+            instance = self.instances[key] = getattr(self.module, self.handler)()
+
+        return getattr(instance, name)
+
+class CommandRegistry:
+    def __init__(self, modules):
+        self.modules = modules
+        self.commands = None
+        self.lock = RLock()
+
+    def load(self):
+        with self.lock:
+            for module in self.modules:
+                module.load()
+
+            self.index()
+
+    def index(self):
+        commands = {}
+
+        for module in self.modules:
+            for name in module.command_names():
+                commands[command_key(name)] = (module, name)
+
+        self.commands = commands
+
+    def reload_changed(self):
+        with self.lock:
+            changed = [module for module in self.modules if module.changed()]
+
+            for module in changed:
+                logging.getLogger('CommandRunner').info("Reloading commands from '" + module.name + "'")
+                module.load(reload=True)
+
+            if changed:
+                self.index()
+
+    def get(self, command, hot_reload=False, app=None):
+        if self.commands is None:
+            self.load()
+        elif hot_reload:
+            self.reload_changed()
+
+        entry = self.commands.get(command_key(command))
+
+        if entry is None:
+            raise InvalidCommandError(str(command))
+
+        with self.lock:
+            return entry[0].resolve(entry[1], app)
+
+registry = CommandRegistry([
+    CommandModule('app.core.commands'),
+    CommandModule('app.irrigation.module', 'IrrigationCommands')
+])
+
+def run_command(app, logger, command, arguments=[], trace=False, profile=False):
+    with tracing.trace('run_command') as command_trace:
+        if profile:
+            with tracing.profile(app.config.get('PROFILE_DIR'), str(command)) as command_profile:
+                response = execute_command(app, logger, command, arguments)
+
+            response['profile'] = command_profile
+        else:
+            response = execute_command(app, logger, command, arguments)
+
+    tracing_logger = logging.getLogger('Tracing')
+
+    if tracing_logger.isEnabledFor(logging.DEBUG):
+        tracing_logger.debug(str(command) + ' ' + str(command_trace.to_dict()))
+
+    if trace:
+        response['trace'] = command_trace.to_dict()
+
+    return response
+
+def execute_command(app, logger, command, arguments):
+    start = time.perf_counter()
+    name = 'invalid'
+
     with app.app_context():
         try:
-            command = re.sub(r'(?<!^)(?=[A-Z])', '_', command).lower()
+            with tracing.span('registry.get'):
+                function = registry.get(command, app.config.get('COMMAND_HOT_RELOAD', False), app)
+
+            name = function.__name__
+
+            with tracing.span('handler:' + name):
+                result = function(arguments, app, logger)
+
+            command_seconds.observe(time.perf_counter() - start, name, 'true')
 
-            function = get_function(command)
-            result = function(arguments, app, logger)
-                   
             return {
                 'success': True,
                 'result': result
             }
         except InvalidCommandError as invalidCommandError:
+            command_seconds.observe(time.perf_counter() - start, name, 'false')
+
             return {
                 'success': False,
                 'result': str(invalidCommandError)
             }
-        except Exception as e: 
+        except Exception as e:
+            command_seconds.observe(time.perf_counter() - start, name, 'false')
             logging.getLogger('CommandRunner').error(traceback.format_exc())
-            
+
             return {
                 'success': False,
                 'result': str(e)
             }
 
-def get_function(command):
-    if 'irrigation' in command:
-        module = importlib.import_module('app.irrigation.module')
-        importlib.reload(module)
-            
-        try:            
-            irrigation_commands = getattr(module, 'IrrigationCommands')()
-            function = getattr(irrigation_commands, command)
-
-            return function
-        except Exception:
-            raise InvalidCommandError('Invalid command')
-
-    else:
-        module = importlib.import_module('app.core.commands')
-        importlib.reload(module)
-
-        try:
-            return getattr(module, command)
-        except Exception:
-            raise InvalidCommandError('Invalid command')
\ No newline at end of file
+def command_key(name):
+    # Commands are looked up regardless of case and underscores, so
+    # snake_case, camelCase and upper case names all find the same command
+    return str(name).replace('_', '').lower()
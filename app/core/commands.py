@@ -1 +1 @@
-import osimport sysimport psutilimport requestsimport jsonimport tracebackimport importlibimport socketfrom flask import current_appfrom app.core.log import Loggerfrom app.core.sentinel import Sentinel    def version(arguments, app, logger):     return 'VERSION'def ping(arguments, app, logger):     return 'pong'        def logs(arguments, app, logger):    file = open('logs.txt', 'r')    return file.read()def set_log_level(arguments, app, logger):    app.extensions['LOG_LEVEL'] = arguments[0]    logger.set_log_level(arguments[0])    return 'Log level changed to ' + arguments[0]def clear_logs(arguments, app, logger):    file = open('logs.txt', 'w')    file.truncate()    file.close()    def run_sentinel(arguments, app, logger):    sentinel = Sentinel(logger)    return sentinel.run_programme()
\ No newline at end of file
+import osimport sysimport psutilimport requestsimport jsonimport tracebackimport importlibimport socketfrom flask import current_appfrom app.core.log import Loggerfrom app.core.sentinel import Sentinel    def version(arguments, app, logger):     return 'VERSION'def ping(arguments, app, logger):     return 'pong'        def logs(arguments, app, logger):    file = open('logs.txt', 'r')    return file.read()def set_log_level(arguments, app, logger):    app.extensions['LOG_LEVEL'] = arguments[0]    logger.set_log_level(arguments[0])    return 'Log level changed to ' + arguments[0]def clear_logs(arguments, app, logger):    file = open('logs.txt', 'w')    file.truncate()    file.close()    def run_sentinel(arguments, app, logger):    sentinel = Sentinel(logger)    return sentinel.run_programme()def get_schedule_statistics(arguments, app, logger):    return app.extensions['PROGRAMMES'].statistics()def get_outbox_status(arguments, app, logger):    return app.extensions['OUTBOX'].status()
\ No newline at end of file
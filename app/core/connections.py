@@ -0,0 +1,289 @@
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread, Event
+
+from app.core import tracing
+from app.core.serial import SerialConnection, ControllerBusyError
+from app.core.controller import open_ports, close_ports, read_sensors, run_command, reset_connection, heartbeat, ControllerTransaction
+
+class ControllerHealth:
+    def __init__(self):
+        self.status = 'unknown'
+        self.consecutive_failures = 0
+        self.last_heartbeat = None
+        self.latency = None
+        self.resets = 0
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'consecutiveFailures': self.consecutive_failures,
+            'lastHeartbeat': self.last_heartbeat,
+            'latency': self.latency,
+            'resets': self.resets
+        }
+
+class ControllerWorker:
+    def __init__(self, controller, multiplexing=False, protocol='json'):
+        self.controller = controller
+        self.multiplexing = multiplexing
+        self.protocol = controller.get('protocol') or protocol
+        self.connection = None
+        self.health = ControllerHealth()
+        self.heartbeat_future = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Controller-' + str(controller['id']))
+
+    def submit(self, function, *arguments):
+        return self.executor.submit(self.call, tracing.current(), function, *arguments)
+
+    def call(self, parent, function, *arguments):
+        logger = arguments[-1]
+
+        with tracing.attach(parent):
+            return function(self.open(logger), *arguments)
+
+    def open(self, logger):
+        if self.connection is not None:
+            return self.connection
+
+        logger.log("Connecting to irrigation controller '" + str(self.controller.get('name', self.controller['id'])) + "' ...")
+
+        self.connection = SerialConnection(self.controller['vendorId'], self.controller['productId'], logger, port=self.controller.get('device'), serial_number=self.controller.get('serialNumber'), protocol=self.protocol)
+
+        if self.multiplexing:
+            self.connection.start_multiplexer()
+
+        return self.connection
+
+    def heartbeat(self, logger, idle_interval, failure_threshold):
+        if self.heartbeat_future is not None and not self.heartbeat_future.done():
+            return
+
+        if self.connection is None:
+            self.health.status = 'connecting'
+            self.heartbeat_future = self.submit(lambda connection, logger: None, logger)
+            return
+
+        if not self.connection.available.is_set():
+            self.health.status = 'reconnecting'
+            return
+
+        if self.connection.idle_time() < idle_interval:
+            if self.health.consecutive_failures == 0:
+                self.health.status = 'healthy'
+            return
+
+        self.heartbeat_future = self.submit(heartbeat, logger)
+        self.heartbeat_future.add_done_callback(lambda future: self.heartbeat_completed(future, logger, failure_threshold))
+
+    def heartbeat_completed(self, future, logger, failure_threshold):
+        self.health.last_heartbeat = time.time()
+
+        if future.exception() is None:
+            self.health.status = 'healthy'
+            self.health.consecutive_failures = 0
+            self.health.latency = round(future.result(), 1)
+            return
+
+        # A link busy with another command is not a missed heartbeat
+        if isinstance(future.exception(), ControllerBusyError):
+            return
+
+        self.health.consecutive_failures += 1
+        self.health.status = 'degraded'
+
+        if self.health.consecutive_failures >= failure_threshold:
+            logger.warning("Irrigation controller '" + str(self.controller.get('name', self.controller['id'])) + "' missed " + str(self.health.consecutive_failures) + ' heartbeats, re-establishing the link in the background ...')
+
+            self.health.status = 'reconnecting'
+            self.health.consecutive_failures = 0
+            self.health.resets += 1
+            self.connection.reset()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+        if self.connection is not None:
+            self.connection.stop_multiplexer()
+            self.connection.close()
+            self.connection = None
+
+class ControllerKeepalive:
+    def __init__(self, manager, logger, interval=30, failure_threshold=2):
+        self.manager = manager
+        self.logger = logger
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, name='ControllerKeepalive', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval / 2.0):
+            try:
+                self.manager.heartbeat(self.logger, self.interval, self.failure_threshold)
+            except:
+                self.logger.error(traceback.format_exc())
+
+class ControllerConnectionManager:
+    def __init__(self, multiplexing=False, protocol='json'):
+        self.multiplexing = multiplexing
+        self.protocol = protocol
+        self.keepalive = None
+        self.workers = {}
+        self.port_map = {}
+        self.default_controller_id = None
+        self.lock = Lock()
+
+    def discover(self, controllers, logger):
+        with self.lock:
+            controllers = { controller['id']: controller for controller in controllers }
+
+            for controller_id in list(self.workers.keys()):
+                if controllers.get(controller_id) != self.workers[controller_id].controller:
+                    logger.log("Releasing irrigation controller '" + str(controller_id) + "' ...")
+                    self.workers.pop(controller_id).close()
+
+            for controller_id, controller in controllers.items():
+                if controller_id not in self.workers:
+                    self.workers[controller_id] = ControllerWorker(controller, self.multiplexing, self.protocol)
+
+            self.port_map = {}
+            self.default_controller_id = None
+
+            for controller_id, controller in controllers.items():
+                for port in controller.get('ports') or []:
+                    self.port_map[str(port)] = controller_id
+
+                if self.default_controller_id is None and not controller.get('ports'):
+                    self.default_controller_id = controller_id
+
+            if self.default_controller_id is None and len(controllers) > 0:
+                self.default_controller_id = next(iter(controllers))
+
+    def has_controllers(self):
+        return len(self.workers) > 0
+
+    def worker(self, controller_id=None):
+        with self.lock:
+            if controller_id is None:
+                controller_id = self.default_controller_id
+
+            if controller_id not in self.workers:
+                raise Exception("Irrigation controller '" + str(controller_id) + "' is not defined")
+
+            return self.workers[controller_id]
+
+    def worker_for_port(self, port):
+        with self.lock:
+            return self.port_map.get(str(port), self.default_controller_id)
+
+    def connection(self, logger, controller_id=None):
+        return self.worker(controller_id).submit(lambda connection, logger: connection, logger).result()
+
+    def open_ports(self, ports, logger):
+        return self.per_controller(ports, lambda port: port, open_ports, logger)
+
+    def close_ports(self, ports, logger):
+        return self.per_controller(ports, lambda port: port, close_ports, logger)
+
+    def read_sensors(self, read_instructions, logger):
+        readings = self.per_controller(read_instructions, self.instruction_port, read_sensors, logger)
+
+        results = [None] * len(read_instructions)
+
+        for indexes, values in readings:
+            for index, value in zip(indexes, values):
+                results[index] = value
+
+        return results
+
+    def run_command(self, command_text, logger, controller_id=None):
+        return self.worker(controller_id).submit(run_command, command_text, logger).result()
+
+    def transaction(self, ports, build, logger):
+        """ Commits what build adds to a transaction for each controller's share of ports as one batch on that controller's worker """
+
+        def commit(serial_connection, ports, logger):
+            results = build(ControllerTransaction(serial_connection, logger), ports).commit()
+            errors = [result['result'] for result in results if not result['success']]
+
+            if len(errors) > 0:
+                raise Exception('Controller transaction failed: ' + '; '.join(map(str, errors)))
+
+            return [result['result'] for result in results]
+
+        return [results for indexes, results in self.per_controller(ports, lambda port: port, commit, logger)]
+
+    def reset(self, logger, controller_id=None):
+        return self.worker(controller_id).submit(reset_connection, logger).result()
+
+    def per_controller(self, items, port_of, function, logger):
+        groups = {}
+
+        for index, item in enumerate(items):
+            groups.setdefault(self.worker_for_port(port_of(item)), []).append(index)
+
+        futures = [(indexes, self.worker(controller_id).submit(function, [items[index] for index in indexes], logger)) for controller_id, indexes in groups.items()]
+
+        results = []
+        error = None
+
+        for indexes, future in futures:
+            try:
+                results.append((indexes, future.result()))
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                error = error or e
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def start_keepalive(self, logger, interval, failure_threshold=2):
+        if self.keepalive is not None or interval <= 0:
+            return
+
+        self.keepalive = ControllerKeepalive(self, logger, interval, failure_threshold)
+        self.keepalive.start()
+
+    def heartbeat(self, logger, idle_interval, failure_threshold=2):
+        with self.lock:
+            workers = list(self.workers.values())
+
+        for worker in workers:
+            worker.heartbeat(logger, idle_interval, failure_threshold)
+
+    def health(self):
+        with self.lock:
+            return { str(controller_id): worker.health.to_dict() for controller_id, worker in self.workers.items() }
+
+    def instruction_port(self, read_instruction):
+        return read_instruction.split(':')[-1].split(',')[0]
+
+    def close(self):
+        if self.keepalive is not None:
+            self.keepalive.stop()
+            self.keepalive = None
+
+        with self.lock:
+            workers = list(self.workers.values())
+            self.workers = {}
+            self.port_map = {}
+
+        for worker in workers:
+            worker.close()
@@ -1,126 +1,346 @@
 import json
+import time
 import uuid
+import threading
 import traceback
 
-from app.core.wrappers import retry
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from app.core.wrappers import retry, RetryPolicy, SingleFlight, TtlCache, remaining_budget
 from app.core.command import InvalidCommandError
+from app.core.serial import ControllerUnavailableError, ControllerBusyError, ControllerResultError, CommandAcknowledgedError, ACK_TIMEOUT, RESULT_TIMEOUT
+from app.core.metrics import registry, timed
+
+controller_policy = RetryPolicy('controller', attempts=3, budget=8, base_delay=0.25, max_delay=1, give_up_on=(InvalidCommandError, ControllerUnavailableError), attempt_timeout=(ACK_TIMEOUT + RESULT_TIMEOUT) / 1000.0)
+
+# A batch is not idempotent, once the controller acknowledged it (or may
+# have, when the wait timed out) it is never sent again
+transaction_policy = RetryPolicy('transaction', attempts=3, budget=8, base_delay=0.25, max_delay=1, give_up_on=(InvalidCommandError, ControllerUnavailableError, ControllerResultError, CommandAcknowledgedError, FutureTimeoutError), attempt_timeout=(ACK_TIMEOUT + RESULT_TIMEOUT) / 1000.0)
+
+BATCH_UNSUPPORTED = object()
+
+sensor_cache = TtlCache(ttl=2)
+sensor_reads = SingleFlight()
+
+controller_seconds = registry.histogram('cultiva_controller_seconds', 'Latency of controller functions', ['function'])
+
+def device_breaker(serial_connection, *arguments):
+    return serial_connection.breaker
 
-@retry
-def reset_connection(serial_connection, logger):
-    with serial_connection.lock:
-        logger.log('Resetting serial connection ...')
-        response = serial_connection.reset()
+@timed(controller_seconds)
+def heartbeat(serial_connection, logger, timeout=1):
+    start = time.monotonic()
+    command_id = str(uuid.uuid4())
+
+    # Any result frame proves the link is alive, firmware without ping
+    # answers with success false and that is neither checked nor logged
+    serial_connection.submit(command_id, make_command(command_id, 'ping', []), timeout).result(timeout)
+
+    return (time.monotonic() - start) * 1000
+
+@timed(controller_seconds)
+def reset_connection(serial_connection, logger, timeout=10):
+    logger.log('Resetting serial connection ...')
+    serial_connection.reset()
 
-@retry
+    if not serial_connection.wait_until_available(timeout):
+        raise Exception('Controller did not come back within ' + str(timeout) + ' seconds, reconnecting in the background')
+
+@timed(controller_seconds)
+@retry(policy=controller_policy, breaker=device_breaker)
 def open_ports(serial_connection, ports, logger):
+    return open_ports_async(serial_connection, ports, logger).result(remaining_budget())
+
+def open_ports_async(serial_connection, ports, logger):
+    return submit_operation(serial_connection, open_ports_operation(ports, logger), logger)
+
+def open_ports_operation(ports, logger):
     ports_string = ', '.join(list(set(map(str, ports))));
 
     logger.log('Opening ports ' + ports_string + ' ...')
-    
-    response = None
-    result = None
-    
-    command_id = str(uuid.uuid4())
-    command = parse_command(command_id, 'open(' + ports_string + ')')
-    
-    try:
-        with serial_connection.lock:
-            response = serial_connection.send(command_id, command)
-    
-        result = json.loads(response)   
 
+    def handle(result):
         if result['success'] == True and result['message'] == 'opened(' + ports_string + ')':
             return
-        else:            
+        else:
             raise Exception('Result from controller does not indicate success')
-    except:
-        error = 'Error opening ports ' + str(ports_string) + ' ... Request: ' + str(command) + ' Response: ' + str(response) + ' Result: ' + str(result)
-        logger.error(traceback.format_exc())
-        logger.error(error)        
-        raise Exception(error)
- 
-@retry
+
+    return Operation('open(' + ports_string + ')', handle, 'Error opening ports ' + str(ports_string) + ' ...')
+
+@timed(controller_seconds)
+@retry(policy=controller_policy, breaker=device_breaker)
 def close_ports(serial_connection, ports, logger):
-    ports_string = ', '.join(list(set(map(str, ports))));
+    return close_ports_async(serial_connection, ports, logger).result(remaining_budget())
 
-    logger.log('Closing ports ' + ports_string + ' ...')
-    
-    response = None
-    result = None
+def close_ports_async(serial_connection, ports, logger):
+    return submit_operation(serial_connection, close_ports_operation(ports, logger), logger)
 
-    command_id = str(uuid.uuid4())
-    command = parse_command(command_id, 'close(' + ports_string + ')')
+def close_ports_operation(ports, logger):
+    ports_string = ', '.join(list(set(map(str, ports))));
 
-    try:
-        with serial_connection.lock:
-            response = serial_connection.send(command_id, command)            
-       
-        result = json.loads(response)
+    logger.log('Closing ports ' + ports_string + ' ...')
 
+    def handle(result):
         if result['success'] == True and result['message'] == 'closed(' + ports_string + ')':
             return
         else:
             raise Exception('Result from controller does not indicate success')
-    except:
-        error = 'Error closing ports ' + str(ports_string) + ' ... Request: ' + str(command) + ' Response: ' + str(response) + ' Result: ' + str(result)
-        logger.error(traceback.format_exc())
-        logger.error(error)
-        raise Exception(error)
 
-@retry
-def read_sensors(serial_connection, read_instructions, logger):  
+    return Operation('close(' + ports_string + ')', handle, 'Error closing ports ' + str(ports_string) + ' ...')
+
+@timed(controller_seconds)
+def read_sensors(serial_connection, read_instructions, logger, max_age=None):
     if len(read_instructions) == 0:
         return []
 
+    key = (serial_connection, tuple(read_instructions))
+    hit, readings = sensor_cache.get(key, max_age)
+
+    if hit:
+        return list(readings)
+
+    def read():
+        readings = read_sensors_uncached(serial_connection, read_instructions, logger)
+        sensor_cache.put(key, readings)
+
+        return readings
+
+    return list(sensor_reads.do(key, read))
+
+@timed(controller_seconds)
+@retry(policy=controller_policy, breaker=device_breaker)
+def read_sensors_uncached(serial_connection, read_instructions, logger):
+    return read_sensors_async(serial_connection, read_instructions, logger).result(remaining_budget())
+
+def read_sensors_async(serial_connection, read_instructions, logger):
+    if len(read_instructions) == 0:
+        return completed([])
+
+    return submit_operation(serial_connection, read_sensors_operation(read_instructions, logger), logger)
+
+def read_sensors_operation(read_instructions, logger):
     logger.log('Reading sensors ...')
-    
-    response = None
-    result = None
-    
-    command_id = str(uuid.uuid4())
-    command = make_command(command_id, 'read', read_instructions)
 
-    try:
-        with serial_connection.lock:
-            response = serial_connection.send(command_id, command)
+    def handle(result):
+        if len(read_instructions) == 0:
+            return []
 
-        result = json.loads(response)
-        
         if result['success'] == True and result['message'].startswith('read('):
             return list(map(int, result['message'].replace('read(', '')[:-1].split(',')))
         else:
             raise Exception('Result from controller does not indicate success')
-    except:
-        error = 'Error reading sensors ... Request: ' + str(command) + ' Response: ' + str(response) + ' Result: ' + str(result)
-        logger.error(traceback.format_exc())
-        logger.error(error)
-        raise Exception(error)
 
-@retry
-def run_command(serial_connection, command_text, logger):  
-    response = None
-    result = None
-    
-    command_id = str(uuid.uuid4())
-    command = parse_command(command_id, command_text)
+    return Operation(None, handle, 'Error reading sensors ...', 'read', read_instructions)
 
-    try:
-        with serial_connection.lock:
-            response = serial_connection.send(command_id, command)
+@timed(controller_seconds)
+@retry(policy=controller_policy, breaker=device_breaker)
+def run_command(serial_connection, command_text, logger):
+    return run_command_async(serial_connection, command_text, logger).result(remaining_budget())
+
+def run_command_async(serial_connection, command_text, logger):
+    return submit_operation(serial_connection, run_command_operation(command_text), logger)
 
-        result = json.loads(response)
-        
+def run_command_operation(command_text):
+    def handle(result):
         if result['success'] == True:
             return result
         else:
             raise Exception('Result from controller does not indicate success')
+
+    return Operation(command_text, handle, 'Error running command ...')
+
+class Operation:
+    def __init__(self, command_text, handle, error_message, type=None, arguments=None):
+        if type is None:
+            type, arguments = split_command(command_text)
+
+        self.type = type
+        self.arguments = arguments
+        self.handle = handle
+        self.error_message = error_message
+
+    def to_dict(self):
+        return { 'command': self.type, 'arguments': self.arguments }
+
+class ControllerTransaction:
+    def __init__(self, serial_connection, logger):
+        self.serial_connection = serial_connection
+        self.logger = logger
+        self.operations = []
+
+    def open_ports(self, ports):
+        self.operations.append(open_ports_operation(ports, self.logger))
+        return self
+
+    def close_ports(self, ports):
+        self.operations.append(close_ports_operation(ports, self.logger))
+        return self
+
+    def read_sensors(self, read_instructions):
+        self.operations.append(read_sensors_operation(read_instructions, self.logger))
+        return self
+
+    def run_command(self, command_text):
+        self.operations.append(run_command_operation(command_text))
+        return self
+
+    def commit(self):
+        return commit_transaction(self)
+
+    def commit_async(self):
+        if len(self.operations) == 0:
+            return completed([])
+
+        operations = list(self.operations)
+
+        if self.serial_connection.supports_batch is False:
+            return self.commit_each(operations)
+
+        command_id = str(uuid.uuid4())
+        command = make_command(command_id, 'batch', [operation.to_dict() for operation in operations])
+        future = Future()
+
+        self.logger.log('Running ' + str(len(operations)) + ' controller operations in one batch ...')
+
+        def handle(result):
+            # Firmware without batches declines the command as a whole
+            # without running any of it
+            if result.get('success') is False and 'results' not in result:
+                return BATCH_UNSUPPORTED
+
+            if 'results' not in result or len(result['results']) != len(operations):
+                raise Exception('Result from controller does not contain a result for every operation')
+
+            return [complete_operation(operation, operation_result, self.logger) for operation, operation_result in zip(operations, result['results'])]
+
+        def batched(sent):
+            try:
+                results = sent.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+
+            if results is not BATCH_UNSUPPORTED:
+                self.serial_connection.supports_batch = True
+                future.set_result(results)
+                return
+
+            self.logger.warning('Controller does not support batches, running ' + str(len(operations)) + ' operations one by one ...')
+            self.serial_connection.supports_batch = False
+            chain(self.commit_each(operations), future)
+
+        submit(self.serial_connection, command_id, command, handle, 'Error running batch ...', self.logger).add_done_callback(batched)
+
+        return future
+
+    def commit_each(self, operations):
+        return gather([submit_operation(self.serial_connection, operation, self.logger) for operation in operations])
+
+@timed(controller_seconds)
+@retry(policy=transaction_policy, breaker=lambda transaction: transaction.serial_connection.breaker)
+def commit_transaction(transaction):
+    return transaction.commit_async().result(remaining_budget())
+
+def complete_operation(operation, result, logger):
+    try:
+        return { 'success': True, 'result': operation.handle(result) }
     except:
-        error = 'Error running command ... Request: ' + str(command) + ' Response: ' + str(response) + ' Result: ' + str(result)
-        logger.error(traceback.format_exc())
+        error = operation.error_message + ' Request: ' + json.dumps(operation.to_dict()) + ' Result: ' + str(result)
         logger.error(error)
-        raise Exception(error)
-        
+
+        return { 'success': False, 'result': error }
+
+def submit_operation(serial_connection, operation, logger, timeout=None):
+    command_id = str(uuid.uuid4())
+    command = make_command(command_id, operation.type, operation.arguments)
+
+    return submit(serial_connection, command_id, command, operation.handle, operation.error_message, logger, timeout)
+
+def submit(serial_connection, command_id, command, handle, error_message, logger, timeout=None):
+    """ Submits command, waiting for the link no longer than timeout or else the remaining retry budget """
+
+    future = Future()
+
+    def complete(sent):
+        response = None
+        result = None
+
+        try:
+            response = sent.result()
+            result = json.loads(response)
+        except (ControllerUnavailableError, ControllerBusyError) as e:
+            future.set_exception(e)
+            return
+        except CommandAcknowledgedError:
+            future.set_exception(CommandAcknowledgedError(failed(error_message, command, response, result, logger)))
+            return
+        except:
+            future.set_exception(Exception(failed(error_message, command, response, result, logger)))
+            return
+
+        # A result that arrived but does not indicate success says nothing
+        # about the link, it is told apart from transport errors
+        try:
+            future.set_result(handle(result))
+        except:
+            future.set_exception(ControllerResultError(failed(error_message, command, response, result, logger)))
+
+    serial_connection.submit(command_id, command, remaining_budget() if timeout is None else timeout).add_done_callback(complete)
+
+    return future
+
+def failed(error_message, command, response, result, logger):
+    error = error_message + ' Request: ' + str(command) + ' Response: ' + str(response) + ' Result: ' + str(result)
+    logger.error(traceback.format_exc())
+    logger.error(error)
+
+    return error
+
+def gather(futures):
+    """ Returns a future of the per operation results of futures, in their order """
+
+    future = Future()
+    results = [None] * len(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(index, operation):
+        error = operation.exception()
+        results[index] = { 'success': True, 'result': operation.result() } if error is None else { 'success': False, 'result': str(error) }
+
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+
+        if finished:
+            future.set_result(results)
+
+    for index, operation in enumerate(futures):
+        operation.add_done_callback(lambda operation, index=index: done(index, operation))
+
+    return future
+
+def chain(source, target):
+    def done(source):
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    source.add_done_callback(done)
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+
+    return future
+
 def parse_command(command_id, command):
+    type, arguments = split_command(command)
+
+    return make_command(command_id, type, arguments)
+
+def split_command(command):
     if command is None:
         raise InvalidCommandError(command)
 
@@ -128,10 +348,10 @@ def parse_command(command_id, command):
         raise InvalidCommandError(command)
 
     type = command[0:command.index('(')]
-    
+
     arguments = list(map(lambda i : i.strip(), command.replace(type, "")[1:-1].split(',')))
-    
-    return make_command(command_id, type, arguments)
+
+    return type, arguments
 
 def make_command(command_id, type, arguments):
     data = {}
@@ -139,4 +359,4 @@ def make_command(command_id, type, arguments):
     data['command'] = type
     data['arguments'] = arguments
 
-    return json.dumps(data)
\ No newline at end of file
+    return json.dumps(data)
@@ -0,0 +1,161 @@
+"""
+Hub client
+
+Delivers alerts to the hub in gzip compressed batches over one pooled
+keep-alive session. Batches go out with bounded parallelism and the hub
+acknowledges alerts by id, only acknowledged alerts count as delivered. Hubs
+without the batch endpoint get one post per alert over the same session, the
+batch endpoint is tried again every reprobe_interval seconds. A hub that
+cannot be reached at all ends the round at the first failed request, nothing
+more is sent and HubUnreachableError tells the caller what was acknowledged
+before it.
+ """
+
+import time
+import gzip
+import json
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.wrappers import RetryPolicy, statistics
+from app.core.metrics import registry
+
+hub_policy = RetryPolicy('hub', attempts=2, budget=30, base_delay=0.5, max_delay=2)
+
+delivered_alerts = registry.counter('cultiva_hub_alerts_total', 'Alerts sent to the hub by outcome', ['outcome'])
+
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+class HubUnreachableError(Exception):
+    def __init__(self, address, acknowledged):
+        super().__init__('Hub ' + str(address) + ' is unreachable')
+        self.acknowledged = acknowledged
+
+class HubClient:
+    def __init__(self, address, node_id, batch_size=100, parallelism=2, timeout=10, verify=False, reprobe_interval=300):
+        self.address = address
+        self.node_id = node_id
+        self.batch_size = batch_size
+        self.parallelism = parallelism
+        self.timeout = timeout
+        self.reprobe_interval = reprobe_interval
+        self.batches_disabled_until = None
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=parallelism))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=parallelism))
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='Hub')
+
+    @property
+    def supports_batches(self):
+        # A 404 from a proxy or a hub in the middle of a deploy is not final
+        return self.batches_disabled_until is None or time.monotonic() >= self.batches_disabled_until
+
+    def notifications_address(self, path=''):
+        return self.address + '/api/notifications' + path + '?nodeId=' + str(self.node_id)
+
+    def send_alerts(self, alerts):
+        """ Sends alerts and returns the set of acknowledged alert ids, raises HubUnreachableError if the hub could not be reached """
+
+        batches = [alerts[i:i + self.batch_size] for i in range(0, len(alerts), self.batch_size)]
+        unreachable = threading.Event()
+        acknowledged = set()
+
+        for batch_acknowledged in self.executor.map(lambda batch: self.send_batch_safely(batch, unreachable), batches):
+            acknowledged.update(batch_acknowledged)
+
+        delivered_alerts.inc('acknowledged', amount=len(acknowledged))
+        delivered_alerts.inc('failed', amount=len(alerts) - len(acknowledged))
+
+        if unreachable.is_set():
+            raise HubUnreachableError(self.address, acknowledged)
+
+        return acknowledged
+
+    def send_batch_safely(self, batch, unreachable):
+        # Batches still queued once the hub turned out unreachable are not sent
+        if unreachable.is_set():
+            return set()
+
+        try:
+            return self.send_batch(batch, unreachable)
+        except TRANSPORT_ERRORS:
+            statistics.increment('hub.failed_batches')
+            unreachable.set()
+            return set()
+        except Exception:
+            statistics.increment('hub.failed_batches')
+            return set()
+
+    def send_batch(self, batch, unreachable):
+        if not self.supports_batches:
+            return self.send_one_by_one(batch, unreachable)
+
+        body = gzip.compress(json.dumps(batch).encode(), 6)
+        response = hub_policy.call(self.post_batch, [body], {})
+
+        if response.status_code in (404, 405):
+            self.batches_disabled_until = time.monotonic() + self.reprobe_interval
+            return self.send_one_by_one(batch, unreachable)
+
+        response.raise_for_status()
+        self.batches_disabled_until = None
+
+        sent = set(alert['id'] for alert in batch)
+
+        return set(alert_id for alert_id in response.json().get('acknowledged', []) if alert_id in sent)
+
+    def post_batch(self, body):
+        response = self.session.post(self.notifications_address('/batch'), data=body, timeout=self.timeout, headers={ 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' })
+
+        # Server errors are retried, anything else is for the caller to read
+        if response.status_code >= 500:
+            response.raise_for_status()
+
+        return response
+
+    def send_one_by_one(self, batch, unreachable):
+        acknowledged = set()
+
+        for alert in batch:
+            if unreachable.is_set():
+                break
+
+            payload = alert.copy()
+            payload.pop('id', None)
+
+            try:
+                response = self.session.post(self.notifications_address(), json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                acknowledged.add(alert['id'])
+            except TRANSPORT_ERRORS:
+                statistics.increment('hub.failed_alerts')
+                unreachable.set()
+            except requests.RequestException:
+                statistics.increment('hub.failed_alerts')
+
+        return acknowledged
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_hub_client(address, node_id, batch_size=100, parallelism=2, timeout=10):
+    """ Returns the process-wide client for the hub at address, keeping its connections alive between runs """
+
+    key = (address, node_id, batch_size, parallelism, timeout)
+
+    with clients_lock:
+        client = clients.get(key)
+
+        if client is None:
+            client = clients[key] = HubClient(address, node_id, batch_size, parallelism, timeout)
+
+        return client
@@ -0,0 +1,165 @@
+import time
+import uuid
+import threading
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.command import run_command
+from app.core.log import Logger
+
+current_job = threading.local()
+
+class JobCancelledError(Exception):
+    def __init__(self, job):
+        self.message = "Job '" + job.id + "' was cancelled"
+        super().__init__(self.message)
+
+class Job:
+    def __init__(self, command, arguments, max_output=200, trace=False, profile=False):
+        self.id = str(uuid.uuid4())
+        self.command = command
+        self.arguments = arguments
+        self.trace = trace
+        self.profile = profile
+        self.breakdown = None
+        self.profile_stats = None
+        self.status = 'queued'
+        self.result = None
+        self.output = deque(maxlen=max_output)
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.subscribers = set()
+        self.future = None
+
+    def done(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def to_dict(self, output=False):
+        data = {
+            'id': self.id,
+            'command': self.command,
+            'status': self.status,
+            'result': self.result,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+        if output:
+            data['output'] = list(self.output)
+
+        if self.breakdown is not None:
+            data['trace'] = self.breakdown
+
+        if self.profile_stats is not None:
+            data['profile'] = self.profile_stats
+
+        return data
+
+class JobRunner:
+    def __init__(self, app, max_workers=4, max_jobs=256, on_output=None, on_finished=None):
+        self.app = app
+        self.max_jobs = max_jobs
+        self.on_output = on_output
+        self.on_finished = on_finished
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Job')
+
+    def submit(self, command, arguments, subscribers=(), trace=False, profile=False):
+        job = Job(command, arguments, trace=trace, profile=profile)
+        job.subscribers.update(subscribers)
+        logger = Logger('Job', self.app, [lambda message: self.output(job, message)])
+
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+
+        job.future = self.executor.submit(self.run, job, logger)
+
+        return job
+
+    def output(self, job, message):
+        job.output.append(message)
+
+        if self.on_output is not None:
+            self.on_output(job, message)
+
+    def run(self, job, logger):
+        # A cancel that came in after a worker took the job but before it
+        # started finds a future that can no longer be cancelled
+        if job.cancel_requested.is_set():
+            self.cancelled(job)
+            return
+
+        job.status = 'running'
+        job.started = time.time()
+        current_job.value = job
+
+        try:
+            result = run_command(self.app, logger, job.command, job.arguments, job.trace, job.profile)
+        finally:
+            current_job.value = None
+
+        job.result = result['result']
+        job.breakdown = result.get('trace')
+        job.profile_stats = result.get('profile')
+        job.finished = time.time()
+
+        if job.cancel_requested.is_set():
+            job.status = 'cancelled'
+        else:
+            job.status = 'succeeded' if result['success'] else 'failed'
+
+        if self.on_finished is not None:
+            self.on_finished(job)
+
+    def cancelled(self, job):
+        job.result = JobCancelledError(job).message
+        job.finished = time.time()
+        job.status = 'cancelled'
+
+        if self.on_finished is not None:
+            self.on_finished(job)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+
+        if job is None or job.done():
+            return job
+
+        job.cancel_requested.set()
+
+        if job.future is not None and job.future.cancel():
+            self.cancelled(job)
+
+        return job
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done()]
+
+        while len(self.jobs) > self.max_jobs and finished:
+            del self.jobs[finished.pop(0)]
+
+    def shutdown(self):
+        for job in self.list():
+            self.cancel(job.id)
+
+        self.executor.shutdown(wait=False)
+
+def check_cancelled():
+    job = getattr(current_job, 'value', None)
+
+    if job is not None and job.cancel_requested.is_set():
+        raise JobCancelledError(job)
@@ -1,35 +1,99 @@
 import sys
+import json
+import queue
+import atexit
 import logging
+import threading
+
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+from app.core import tracing
+
+MESSAGE_FORMAT = '%(asctime)s [%(name)s][%(levelname)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+LEVELS = { 'error': logging.ERROR, 'warning': logging.WARNING, 'info': logging.INFO, 'debug': logging.DEBUG }
+
+log_queue = queue.Queue()
+listener = None
+listener_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+
+        if getattr(record, 'context', None):
+            data['context'] = record.context
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
+
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Formatting is left to the listener thread, only the arguments are
+        # merged so the record no longer references caller state
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+def configure_logging(format='text'):
+    global listener
+
+    with listener_lock:
+        if listener is not None:
+            return
+
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter() if format == 'json' else logging.Formatter(MESSAGE_FORMAT, DATE_FORMAT))
+
+        root = logging.getLogger()
+        root.handlers = [LogQueueHandler(log_queue)]
+        root.setLevel(logging.WARNING)
+
+        logging.getLogger('apscheduler.scheduler').setLevel(logging.ERROR)
+
+        listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+
+        atexit.register(listener.stop)
 
 class Logger:    
     def __init__(self, module, app, loggers = []):         
-        self.message_format = '%(asctime)s [%(name)s][%(levelname)s] %(message)s'
-        self.date_format = '%Y-%m-%d %H:%M:%S'        
-        
         self.module = module
         self.app = app
         self.loggers = loggers
+        self.level = None
 
-        logging.basicConfig(level=logging.WARNING, format=self.message_format, datefmt=self.date_format)
+        configure_logging(app.config.get('LOG_FORMAT', 'text'))
                     
         self.default_logger = logging.getLogger(module)
         
-        self.set_log_level(app.extensions['LOG_LEVEL'])
-        logging.getLogger('apscheduler.scheduler').setLevel(logging.ERROR)
+        self.sync_log_level()
+
+    def sync_log_level(self):
+        level = self.app.extensions['LOG_LEVEL']
+
+        if level != self.level:
+            self.set_log_level(level)
                 
     def set_log_level(self, level):
-        if level == 'error':
-            logging.getLogger('werkzeug').setLevel(logging.ERROR)
-            self.default_logger.setLevel(logging.ERROR)
-        elif level == 'warning':            
-            logging.getLogger('werkzeug').setLevel(logging.WARNING)
-            self.default_logger.setLevel(logging.WARNING)
-        elif level == 'info':
-            logging.getLogger('werkzeug').setLevel(logging.INFO)
-            self.default_logger.setLevel(logging.INFO)
-        elif level == 'debug':
-            logging.getLogger('werkzeug').setLevel(logging.DEBUG)
-            self.default_logger.setLevel(logging.DEBUG)
+        if level not in LEVELS:
+            return
+
+        self.level = level
+
+        logging.getLogger('werkzeug').setLevel(LEVELS[level])
+        self.default_logger.setLevel(LEVELS[level])
 
     def log_h1(self, title, pad_top=False, pad_bottom=False):              
         self.log((' ' + title + ' ').center(100,"*"), pad_top, pad_bottom)
@@ -79,62 +143,155 @@ class Logger:
     def log_new_line(self):
         self.log(' ')
 
-    def error(self, message, pad_top=False, pad_bottom=False): 
-        self.set_log_level(self.app.extensions['LOG_LEVEL'])
+    def error(self, message, pad_top=False, pad_bottom=False, context=None): 
+        self.write(logging.ERROR, message, pad_top, pad_bottom, context)
+                
+    def warning(self, message, pad_top=False, pad_bottom=False, context=None): 
+        self.write(logging.WARNING, message, pad_top, pad_bottom, context)
+    
+    def log(self, message, pad_top=False, pad_bottom=False, context=None): 
+        self.write(logging.INFO, message, pad_top, pad_bottom, context)
 
-        if pad_top:
-            self.default_logger.error(' ')
-            
-            for i in range(len(self.loggers)):                
-                self.loggers[i](' ')
+    def write(self, level, message, pad_top, pad_bottom, context):
+        with tracing.span('log'):
+            self.emit_lines(level, message, pad_top, pad_bottom, context)
 
-        self.default_logger.error(message)
-        
-        for i in range(len(self.loggers)):            
-            self.loggers[i](message)
+    def emit_lines(self, level, message, pad_top, pad_bottom, context):
+        self.sync_log_level()
 
-        if pad_bottom:
-            self.default_logger.error(' ')
-            
-            for i in range(len(self.loggers)):
-                self.loggers[i](' ')
-                
-    def warning(self, message, pad_top=False, pad_bottom=False): 
-        self.set_log_level(self.app.extensions['LOG_LEVEL'])
+        enabled = self.default_logger.isEnabledFor(level)
+        extra = { 'context': context }
 
         if pad_top:
-            self.default_logger.warning(' ')
-            
-            for i in range(len(self.loggers)):                
-                self.loggers[i](' ')
+            self.emit(enabled, level, ' ', extra)
 
-        self.default_logger.warning(message)
-        
-        for i in range(len(self.loggers)):            
-            self.loggers[i](message)
+        self.emit(enabled, level, message, extra)
 
         if pad_bottom:
-            self.default_logger.warning(' ')
-            
-            for i in range(len(self.loggers)):
-                self.loggers[i](' ')
-    
-    def log(self, message, pad_top=False, pad_bottom=False): 
-        self.set_log_level(self.app.extensions['LOG_LEVEL'])
-
-        if pad_top:
-            self.default_logger.info(' ')
-            
-            for i in range(len(self.loggers)):                
-                self.loggers[i](' ')
+            self.emit(enabled, level, ' ', extra)
 
-        self.default_logger.info(message)
+    def emit(self, enabled, level, message, extra):
+        if enabled:
+            self.default_logger.log(level, message, extra=extra)
         
         for i in range(len(self.loggers)):            
             self.loggers[i](message)
 
-        if pad_bottom:
-            self.default_logger.info(' ')
-            
-            for i in range(len(self.loggers)):
-                self.loggers[i](' ')
+class LogStream:
+    def __init__(self, emit, interval=0.1, max_batch=100, max_pending=1000, replay_size=500):
+        self.emit = emit
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.history = deque(maxlen=replay_size)
+        self.pending = {}
+        self.dropped = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def write(self, message, recipients):
+        with self.lock:
+            self.history.append(message)
+
+            for recipient in recipients:
+                self.enqueue(recipient, 'log', message)
+
+        self.start()
+
+    def send(self, event, data, recipients):
+        with self.lock:
+            for recipient in recipients:
+                self.enqueue(recipient, event, data)
+
+        self.start()
+
+    def replay(self, recipient, messages=None):
+        with self.lock:
+            for message in list(self.history if messages is None else messages):
+                self.enqueue(recipient, 'log', message)
+
+        self.start()
+
+    def enqueue(self, recipient, event, data):
+        pending = self.pending.setdefault(recipient, deque())
+
+        if len(pending) >= self.max_pending:
+            pending.popleft()
+            self.dropped[recipient] = self.dropped.get(recipient, 0) + 1
+
+        pending.append((event, data))
+
+    def remove(self, recipient):
+        with self.lock:
+            self.pending.pop(recipient, None)
+            self.dropped.pop(recipient, None)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='LogStream', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        for recipient, events in self.take().items():
+            for event, data in events:
+                try:
+                    self.emit(event, data, recipient)
+                except Exception:
+                    logging.getLogger('LogStream').warning('Could not stream ' + event + ' to ' + str(recipient))
+
+    def take(self):
+        batches = {}
+
+        with self.lock:
+            for recipient, pending in list(self.pending.items()):
+                if not pending:
+                    del self.pending[recipient]
+                    continue
+
+                events = []
+                lines = []
+                count = 0
+                dropped = self.dropped.pop(recipient, 0)
+
+                if dropped > 0:
+                    lines.append('... ' + str(dropped) + ' lines dropped ...')
+
+                while pending and count < self.max_batch:
+                    event, data = pending.popleft()
+
+                    # Only text lines are batched, a structured log event
+                    # such as a job result reaches the client unchanged
+                    if event == 'log' and isinstance(data, str):
+                        lines.append(data)
+                        count += 1
+                        continue
+
+                    if lines:
+                        events.append(('log', '\n'.join(lines)))
+                        lines = []
+
+                    events.append((event, data))
+
+                if lines:
+                    events.append(('log', '\n'.join(lines)))
+
+                batches[recipient] = events
+
+        return batches
+
+    def close(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        self.flush()
@@ -0,0 +1,163 @@
+"""
+Metrics
+
+Counters, gauges and histograms kept in process memory and rendered in the
+Prometheus text format at /metrics. Every metric has its own small lock so
+recording never waits on the serial connection or another metric.
+ """
+
+import time
+import threading
+
+from bisect import bisect_left
+from functools import wraps
+
+from app.core import tracing
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' ' + self.type]
+
+        with self.lock:
+            values = list(self.values.items())
+
+        for label_values, value in values:
+            lines += self.samples(label_values, value)
+
+        return lines
+
+    def samples(self, label_values, value):
+        return [self.name + format_labels(self.labels, label_values) + ' ' + format_value(value)]
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set_total(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.values.get(label_values)
+
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self, label_values, value):
+        counts, total, count = value
+        labels = format_labels(self.labels, label_values)
+        lines = []
+        cumulative = 0
+
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            lines.append(self.name + '_bucket' + format_labels(self.labels + ('le',), label_values + (format_value(bound),)) + ' ' + str(cumulative))
+
+        lines.append(self.name + '_sum' + labels + ' ' + format_value(total))
+        lines.append(self.name + '_count' + labels + ' ' + str(count))
+
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+
+        for collector in collectors:
+            collector()
+
+        lines = []
+
+        for metric in metrics:
+            lines += metric.render()
+
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+def timed(histogram, *label_values):
+    def decorate(func):
+        values = label_values or (func.__name__,)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                with tracing.span(values[0]):
+                    return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *values)
+        return wrapper
+
+    return decorate
+
+def format_labels(names, values):
+    if not names:
+        return ''
+
+    return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for name, value in zip(names, values)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
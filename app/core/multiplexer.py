@@ -0,0 +1,165 @@
+import json
+import time
+import traceback
+
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+class CommandAcknowledgedError(Exception):
+    """ The controller acknowledged a command but no result came back, the command may have run """
+
+class PendingCommand:
+    def __init__(self, command_id, deadline, hard_deadline):
+        self.command_id = command_id
+        self.deadline = deadline
+        self.hard_deadline = hard_deadline
+        self.acknowledged = False
+        self.future = Future()
+
+class SerialMultiplexer:
+    def __init__(self, serial_connection, logger, ack_timeout=250, result_timeout=5000, ack_grace=4):
+        self.serial_connection = serial_connection
+        self.logger = logger
+        self.ack_timeout = ack_timeout
+        self.result_timeout = result_timeout
+        self.ack_grace = ack_grace
+        self.pending = {}
+        self.pending_lock = Lock()
+        self.write_lock = Lock()
+        self.running = False
+        self.thread = None
+        self.last_frame = time.monotonic()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = Thread(target=self.run, name='SerialMultiplexer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.fail_all(Exception('Serial multiplexer stopped'))
+
+    def submit(self, command_id, command):
+        deadline = time.monotonic() + self.ack_timeout / 1000.0
+        pending = PendingCommand(command_id, deadline, deadline + self.ack_grace * self.ack_timeout / 1000.0)
+
+        with self.pending_lock:
+            self.pending[command_id] = pending
+
+        try:
+            with self.write_lock:
+                self.serial_connection.write_frame(command)
+        except Exception as e:
+            self.resolve(command_id, exception=e)
+
+        return pending.future
+
+    def send(self, command_id, command, timeout=None):
+        return self.submit(command_id, command).result(timeout)
+
+    def in_flight(self):
+        with self.pending_lock:
+            return len(self.pending)
+
+    def run(self):
+        while self.running:
+            if not self.serial_connection.available.is_set():
+                self.fail_all(Exception('Controller is unavailable'))
+                self.serial_connection.available.wait(self.serial_connection.poll_interval)
+                continue
+
+            try:
+                with self.serial_connection.lock:
+                    frame = self.serial_connection.read_frame(0)
+
+                if frame is not None:
+                    self.last_frame = time.monotonic()
+                    self.route(frame)
+            except Exception as e:
+                self.logger.warning(traceback.format_exc())
+                self.fail_all(e)
+                self.serial_connection.lost()
+
+            self.expire()
+
+    def route(self, frame):
+        pending = self.find(frame)
+
+        if pending is None:
+            self.logger.warning('Discarding unexpected response from controller: ' + frame)
+            return
+
+        error = CommandAcknowledgedError if pending.acknowledged else Exception
+
+        if not self.serial_connection.is_valid_json(frame):
+            self.resolve(pending.command_id, exception=error('Expected acknowledgement, received invalid response: ' + frame))
+        elif self.serial_connection.is_valid_result(frame, pending.command_id):
+            self.resolve(pending.command_id, result=frame)
+        elif self.serial_connection.is_valid_acknowledgement(frame, pending.command_id):
+            pending.acknowledged = True
+            pending.deadline = time.monotonic() + self.result_timeout / 1000.0
+        else:
+            self.resolve(pending.command_id, exception=error('Expected result, received invalid response: ' + frame))
+
+    def find(self, frame):
+        command_id = None
+
+        try:
+            command_id = json.loads(frame).get('id')
+        except:
+            pass
+
+        with self.pending_lock:
+            if command_id in self.pending:
+                return self.pending[command_id]
+
+            for pending in self.pending.values():
+                if pending.command_id in frame:
+                    return pending
+
+        return None
+
+    def resolve(self, command_id, result=None, exception=None):
+        with self.pending_lock:
+            pending = self.pending.pop(command_id, None)
+
+        if pending is None:
+            return
+
+        if exception is not None:
+            pending.future.set_exception(exception)
+        else:
+            pending.future.set_result(result)
+
+    def expire(self):
+        now = time.monotonic()
+        link_idle = now - self.last_frame > self.ack_timeout / 1000.0
+
+        # While frames keep arriving the link is busy rather than dead, so
+        # commands queued behind them are not failed for a late acknowledgement,
+        # but one whose frame was lost still fails once its hard deadline passes
+        with self.pending_lock:
+            expired = [pending for pending in self.pending.values() if pending.deadline < now and (pending.acknowledged or link_idle or pending.hard_deadline < now)]
+
+        for pending in expired:
+            if pending.acknowledged:
+                error = CommandAcknowledgedError('Expected result, no response within ' + str(self.result_timeout) + ' milliseconds')
+            else:
+                error = Exception('Expected acknowledgement, no response within ' + str(round((now - pending.deadline) * 1000 + self.ack_timeout)) + ' milliseconds')
+
+            self.resolve(pending.command_id, exception=error)
+
+    def fail_all(self, exception):
+        with self.pending_lock:
+            command_ids = list(self.pending.keys())
+
+        for command_id in command_ids:
+            self.resolve(command_id, exception=exception)
@@ -0,0 +1,185 @@
+"""
+Outbox
+
+Drains the sentinel's alerts to the hub on a thread of its own. Alerts stay
+in the sentinel store until the hub acknowledges them, so the backlog
+survives restarts. Every alert carries its attempt count and the time of
+its next attempt, a failed delivery pushes that back exponentially (with
+jitter so a recovering hub is not hit by the whole backlog at once). At most
+max_in_flight alerts are sent at a time and no more than drain_rate alerts
+per second, so emptying a large backlog does not crowd out other work, a
+drain_rate of 0 leaves the rate unlimited. A hub that cannot be reached ends
+the round and pauses the whole outbox, backing off the same way, instead of
+counting an attempt against every alert. notify() lifts the pause and makes
+every pending alert due.
+ """
+
+import time
+import random
+import logging
+import threading
+import traceback
+
+from app.core.hub import HubUnreachableError
+
+OUTBOX_FIELDS = ('attempts', 'next_attempt', 'dispatched_to_phone')
+
+class AlertOutbox:
+    def __init__(self, repository, client, max_in_flight=100, drain_rate=50, base_delay=5, max_delay=600, poll_interval=5):
+        self.repository = repository
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.drain_rate = drain_rate
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.random = random.Random()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.tokens = float(max_in_flight)
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.delivered = 0
+        self.failed = 0
+        self.unreachable_rounds = 0
+        self.paused_until = None
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='Outbox', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.running = False
+        self.wakeup.set()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def notify(self):
+        """ Makes every pending alert due and wakes the outbox up to deliver them without waiting for the next poll """
+
+        self.paused_until = None
+        self.repository.make_alerts_due(time.time())
+        self.wakeup.set()
+
+    def run(self):
+        while self.running:
+            try:
+                sent = self.drain_once()
+            except Exception:
+                logging.getLogger('Outbox').error(traceback.format_exc())
+                sent = 0
+
+            if not sent:
+                self.wakeup.wait(self.wait_time())
+                self.wakeup.clear()
+
+    def wait_time(self):
+        next_attempt = self.repository.get_next_attempt()
+
+        if next_attempt is None:
+            return self.poll_interval
+
+        if self.paused_until is not None:
+            next_attempt = max(next_attempt, self.paused_until)
+
+        return min(self.poll_interval, max(0.05, next_attempt - time.time()))
+
+    def take_tokens(self, wanted):
+        """ Waits until wanted alerts may be sent under the drain rate and returns how many may be """
+
+        if self.drain_rate <= 0:
+            return self.max_in_flight
+
+        while True:
+            now = time.monotonic()
+            self.tokens = min(float(self.max_in_flight), self.tokens + (now - self.refilled) * self.drain_rate)
+            self.refilled = now
+
+            if self.tokens >= wanted:
+                return int(self.tokens)
+
+            time.sleep((wanted - self.tokens) / self.drain_rate)
+
+    def drain_once(self):
+        """ Sends one round of due alerts and returns how many were sent """
+
+        if self.paused_until is not None and time.time() < self.paused_until:
+            return 0
+
+        alerts = self.repository.get_due_alerts(time.time(), self.max_in_flight)
+
+        if not alerts:
+            return 0
+
+        # Rounds are at least a second's worth of alerts, a backlog drained
+        # under the rate limit still goes out in batches
+        round_size = self.max_in_flight if self.drain_rate <= 0 else max(1, int(self.drain_rate))
+        alerts = alerts[:max(1, self.take_tokens(min(len(alerts), round_size)))]
+
+        self.tokens -= len(alerts)
+        self.in_flight = len(alerts)
+
+        unreachable = False
+
+        try:
+            acknowledged = self.client.send_alerts([payload(alert) for alert in alerts])
+        except HubUnreachableError as e:
+            acknowledged = e.acknowledged
+            unreachable = True
+        except Exception as e:
+            acknowledged = set()
+            logging.getLogger('Outbox').warning('Delivering alerts failed: ' + str(e))
+        finally:
+            self.in_flight = 0
+
+        failed = [alert for alert in alerts if alert['id'] not in acknowledged]
+
+        if unreachable:
+            self.pause()
+        else:
+            self.unreachable_rounds = 0
+            self.paused_until = None
+            self.repository.update_alerts([self.reschedule(alert) for alert in failed])
+
+        self.repository.delete_alerts([alert for alert in alerts if alert['id'] in acknowledged])
+
+        self.delivered += len(alerts) - len(failed)
+        self.failed += len(failed)
+
+        return len(alerts)
+
+    def backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (0.5 + self.random.random() / 2)
+
+    def reschedule(self, alert):
+        attempts = alert.get('attempts', 0) + 1
+
+        return { 'id': alert['id'], 'attempts': attempts, 'next_attempt': time.time() + self.backoff(attempts) }
+
+    def pause(self):
+        self.unreachable_rounds += 1
+        self.paused_until = time.time() + self.backoff(self.unreachable_rounds)
+
+        logging.getLogger('Outbox').warning('Hub unreachable, pausing delivery for ' + str(int(self.paused_until - time.time())) + 's')
+
+    def status(self):
+        return {
+            'backlog': self.repository.count_alerts(),
+            'due': len(self.repository.get_due_alerts(time.time())),
+            'inFlight': self.in_flight,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'nextAttempt': self.repository.get_next_attempt(),
+            'pausedUntil': self.paused_until
+        }
+
+def payload(alert):
+    return { key: value for key, value in alert.items() if key not in OUTBOX_FIELDS }
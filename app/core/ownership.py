@@ -0,0 +1,78 @@
+"""
+Ownership
+
+Decides which process drives the controllers and the scheduler. With several
+web workers, only the first one to lock the owner file takes the hardware,
+the others serve requests only. The lock is released by the operating system
+when the owning process exits, so a restarted worker can take over.
+ """
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class ProcessLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        if self.file is not None:
+            return True
+
+        if fcntl is None:
+            return True
+
+        handle = open(self.path, 'a+')
+
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+
+        self.file = handle
+
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+        self.file.close()
+        self.file = None
+
+class Ownership:
+    def __init__(self, mode, lock_file):
+        self.mode = str(mode).lower()
+        self.lock = ProcessLock(lock_file)
+        self.owner = None
+
+    def is_owner(self):
+        if self.owner is None:
+            if self.mode == 'true':
+                self.owner = True
+            elif self.mode == 'false':
+                self.owner = False
+            else:
+                self.owner = self.lock.acquire()
+
+        return self.owner
+
+    def release(self):
+        self.lock.release()
+        self.owner = None
+
+    def to_dict(self):
+        return { 'mode': self.mode, 'owner': self.owner, 'pid': os.getpid() }
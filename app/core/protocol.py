@@ -0,0 +1,317 @@
+"""
+Controller wire protocols
+
+JsonProtocol is the original text framing, <{json}>. BinaryProtocol is the
+compact framing negotiated during warmup:
+
+    0xA5 | length (u8) | payload | fletcher-16 (u16, little endian)
+
+The payload starts with an opcode (u8) and a short command id (u16)
+followed by a fixed layout body per opcode. Responses are decoded back
+into the JSON text the rest of the serial layer already understands.
+ """
+
+import json
+import struct
+
+from collections import OrderedDict
+
+SYNC = 0xA5
+
+OPEN = 0x01
+CLOSE = 0x02
+READ = 0x03
+PING = 0x04
+BATCH = 0x05
+TEXT = 0x7F
+
+ACKNOWLEDGEMENT = 0x80
+RESULT = 0x81
+READY = 0x82
+
+COMMANDS = { 'open': OPEN, 'close': CLOSE, 'read': READ, 'ping': PING, 'batch': BATCH }
+READ_MODES = { 'A': 0, 'D': 1, 'US': 2 }
+NO_PORT = 0xFF
+
+HEADER = struct.Struct('<BH')
+VALUE = struct.Struct('<h')
+
+class JsonProtocol:
+    name = 'json'
+
+    def frame_buffer(self):
+        return FrameBuffer()
+
+    def encode(self, command):
+        return bytes('<' + command + '>', encoding='utf-8')
+
+    def decode(self, frame):
+        return frame
+
+class BinaryProtocol:
+    name = 'binary'
+
+    def __init__(self, max_pending=1024):
+        self.sequence = 0
+        self.max_pending = max_pending
+        self.command_ids = OrderedDict()
+
+    def frame_buffer(self):
+        return BinaryFrameBuffer()
+
+    def encode(self, command):
+        data = json.loads(command)
+
+        self.sequence = self.sequence % 0xFFFF + 1
+        self.command_ids[self.sequence] = data['id']
+
+        while len(self.command_ids) > self.max_pending:
+            self.command_ids.popitem(last=False)
+
+        opcode, body = encode_operation(data['command'], data['arguments'])
+
+        return frame(HEADER.pack(opcode, self.sequence) + body)
+
+    def decode(self, payload):
+        try:
+            return self.decode_payload(payload)
+        except (struct.error, IndexError, KeyError, ValueError):
+            return json.dumps({ 'type': 'invalid', 'payload': payload.hex() })
+
+    def decode_payload(self, payload):
+        opcode, short_id = HEADER.unpack_from(payload)
+
+        if opcode == READY:
+            return '{"type":"ready"}'
+
+        if opcode == ACKNOWLEDGEMENT:
+            return json.dumps({ 'type': 'commandReceived', 'id': self.command_ids.get(short_id) })
+
+        if opcode == RESULT:
+            result = decode_result(payload, HEADER.size)[0]
+            result['type'] = 'result'
+            result['id'] = self.command_ids.pop(short_id, None)
+
+            return json.dumps(result)
+
+        return json.dumps({ 'type': 'unknown', 'opcode': opcode })
+
+class FrameBuffer:
+    def __init__(self, start_marker=b'<', end_marker=b'>'):
+        self.start_marker = start_marker
+        self.end_marker = end_marker
+        self.buffer = bytearray()
+        self.scanned = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_frame(self):
+        start = self.buffer.find(self.start_marker)
+
+        if start < 0:
+            del self.buffer[:]
+            self.scanned = 0
+            return None
+
+        if start > 0:
+            del self.buffer[:start]
+            self.scanned = max(0, self.scanned - start)
+
+        end = self.buffer.find(self.end_marker, max(1, self.scanned))
+
+        if end < 0:
+            self.scanned = len(self.buffer)
+            return None
+
+        frame = self.buffer[1:end].decode('utf-8', errors='replace')
+
+        del self.buffer[:end + 1]
+        self.scanned = 0
+
+        return frame
+
+    def pending(self):
+        return self.buffer[1:].decode('utf-8', errors='replace')
+
+    def clear(self):
+        del self.buffer[:]
+        self.scanned = 0
+
+class BinaryFrameBuffer:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_frame(self):
+        while True:
+            start = self.buffer.find(SYNC)
+
+            if start < 0:
+                del self.buffer[:]
+                return None
+
+            if start > 0:
+                del self.buffer[:start]
+
+            if len(self.buffer) < 2:
+                return None
+
+            end = 2 + self.buffer[1]
+
+            if len(self.buffer) < end + 2:
+                return None
+
+            payload = bytes(self.buffer[2:end])
+
+            if struct.unpack_from('<H', self.buffer, end)[0] == fletcher16(payload):
+                del self.buffer[:end + 2]
+                return payload
+
+            del self.buffer[:1]
+
+    def pending(self):
+        return self.buffer.hex()
+
+    def clear(self):
+        del self.buffer[:]
+
+def frame(payload):
+    if len(payload) > 0xFF:
+        raise Exception('Binary frame payload of ' + str(len(payload)) + ' bytes exceeds 255 bytes')
+
+    return bytes([SYNC, len(payload)]) + payload + struct.pack('<H', fletcher16(payload))
+
+def fletcher16(data):
+    first = 0
+    second = 0
+
+    for byte in data:
+        first = (first + byte) % 255
+        second = (second + first) % 255
+
+    return (second << 8) | first
+
+def encode_operation(command, arguments):
+    try:
+        opcode = COMMANDS[command]
+
+        if opcode == OPEN or opcode == CLOSE:
+            return opcode, encode_ports(arguments)
+
+        if opcode == READ:
+            return opcode, bytes([len(arguments)]) + b''.join(encode_read_instruction(instruction) for instruction in arguments)
+
+        if opcode == PING:
+            return opcode, b''
+
+        body = bytearray([len(arguments)])
+
+        for operation in arguments:
+            sub_opcode, sub_body = encode_operation(operation['command'], operation['arguments'])
+            body += bytes([sub_opcode, len(sub_body)]) + sub_body
+
+        return opcode, bytes(body)
+    except (KeyError, ValueError, OverflowError):
+        return TEXT, json.dumps({ 'command': command, 'arguments': arguments }, separators=(',', ':')).encode('utf-8')
+
+def encode_ports(ports):
+    return bytes([len(ports)]) + bytes(int(port) for port in ports)
+
+def encode_read_instruction(instruction):
+    mode, ports = instruction.split(':')
+    ports = [int(port) for port in ports.split(',')]
+
+    return bytes([READ_MODES[mode], ports[0], ports[1] if len(ports) > 1 else NO_PORT])
+
+def decode_operation(opcode, body):
+    if opcode == OPEN or opcode == CLOSE:
+        return { 'command': 'open' if opcode == OPEN else 'close', 'arguments': [str(port) for port in body[1:1 + body[0]]] }
+
+    if opcode == READ:
+        modes = { value: key for key, value in READ_MODES.items() }
+        arguments = []
+
+        for i in range(body[0]):
+            mode, port, secondary = body[1 + i * 3:4 + i * 3]
+            arguments.append(modes[mode] + ':' + str(port) + ('' if secondary == NO_PORT else ',' + str(secondary)))
+
+        return { 'command': 'read', 'arguments': arguments }
+
+    if opcode == PING:
+        return { 'command': 'ping', 'arguments': [] }
+
+    if opcode == BATCH:
+        operations = []
+        offset = 1
+
+        for i in range(body[0]):
+            sub_opcode, length = body[offset], body[offset + 1]
+            operations.append(decode_operation(sub_opcode, body[offset + 2:offset + 2 + length]))
+            offset += 2 + length
+
+        return { 'command': 'batch', 'arguments': operations }
+
+    return json.loads(bytes(body).decode('utf-8'))
+
+def decode_request(payload):
+    opcode, short_id = HEADER.unpack_from(payload)
+
+    command = decode_operation(opcode, payload[HEADER.size:])
+    command['id'] = short_id
+
+    return opcode, command
+
+def encode_result(opcode, arguments, result):
+    status = 1 if result['success'] else 0
+
+    if opcode == BATCH:
+        body = bytearray([len(result['results'])])
+
+        for operation, operation_result in zip(arguments, result['results']):
+            body += encode_result(COMMANDS.get(operation['command'], TEXT), operation['arguments'], operation_result)
+
+        return bytes([status, BATCH]) + bytes(body)
+
+    if status and (opcode == OPEN or opcode == CLOSE):
+        body = encode_ports(arguments)
+    elif status and opcode == READ:
+        values = result['message'][len('read('):-1].split(',')
+        body = bytes([len(values)]) + b''.join(VALUE.pack(int(value)) for value in values)
+    else:
+        body = result.get('message', '').encode('utf-8')
+        opcode = TEXT
+
+    return bytes([status, opcode, len(body)]) + body
+
+def decode_result(payload, offset):
+    status, opcode = payload[offset], payload[offset + 1]
+    result = { 'success': status == 1 }
+
+    if opcode == BATCH:
+        results = []
+        offset += 3
+
+        for i in range(payload[offset - 1]):
+            operation_result, offset = decode_result(payload, offset)
+            results.append(operation_result)
+
+        result['results'] = results
+
+        return result, offset
+
+    length = payload[offset + 2]
+    body = payload[offset + 3:offset + 3 + length]
+
+    if opcode == OPEN:
+        result['message'] = 'opened(' + ', '.join(str(port) for port in body[1:]) + ')'
+    elif opcode == CLOSE:
+        result['message'] = 'closed(' + ', '.join(str(port) for port in body[1:]) + ')'
+    elif opcode == READ:
+        result['message'] = 'read(' + ','.join(str(VALUE.unpack_from(body, 1 + i * VALUE.size)[0]) for i in range(body[0])) + ')'
+    else:
+        result['message'] = bytes(body).decode('utf-8', errors='replace')
+
+    return result, offset + 3 + length
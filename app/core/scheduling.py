@@ -0,0 +1,131 @@
+import time
+import threading
+
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+from app.core.command import run_command
+from app.core.log import Logger
+
+class ScheduledJob:
+    def __init__(self, name, command, interval, priority=0, jitter=0):
+        self.name = name
+        self.command = command
+        self.interval = interval
+        self.priority = priority
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.overlaps = 0
+        self.yielded = 0
+        self.last_duration = None
+        self.max_duration = 0
+        self.total_duration = 0
+        self.last_lateness = None
+        self.max_lateness = 0
+        self.last_run = None
+
+    def record_run(self, duration, success):
+        self.runs += 1
+        self.failures += 0 if success else 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        self.last_run = time.time()
+
+    def record_lateness(self, lateness):
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'command': self.command,
+            'interval': self.interval,
+            'priority': self.priority,
+            'runs': self.runs,
+            'failures': self.failures,
+            'missed': self.missed,
+            'overlaps': self.overlaps,
+            'yielded': self.yielded,
+            'lastDuration': self.last_duration,
+            'maxDuration': self.max_duration,
+            'averageDuration': self.total_duration / self.runs if self.runs > 0 else None,
+            'lastLateness': self.last_lateness,
+            'maxLateness': self.max_lateness,
+            'lastRun': self.last_run
+        }
+
+class PriorityGate:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+
+    def enter(self, name, priority):
+        with self.lock:
+            if any(running_priority > priority for running_priority in self.running.values()):
+                return False
+
+            self.running[name] = priority
+
+            return True
+
+    def leave(self, name):
+        with self.lock:
+            self.running.pop(name, None)
+
+class ProgrammeScheduler:
+    def __init__(self, scheduler, app, misfire_grace_time=5):
+        self.scheduler = scheduler
+        self.app = app
+        self.misfire_grace_time = misfire_grace_time
+        self.jobs = {}
+        self.gate = PriorityGate()
+
+        scheduler.add_listener(self.scheduler_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
+    def add(self, name, command, interval, priority=0, jitter=0):
+        job = ScheduledJob(name, command, interval, priority, jitter)
+        self.jobs[name] = job
+
+        # One instance per job and coalesced catch-up runs, so a run that
+        # outlasts its interval delays the next one instead of stacking up
+        self.scheduler.add_job(name, func=self.run, args=[name, Logger(name.title(), self.app)], trigger='interval', seconds=interval, jitter=jitter or None, max_instances=1, coalesce=True, misfire_grace_time=self.misfire_grace_time, replace_existing=True)
+
+        return job
+
+    def run(self, name, logger):
+        job = self.jobs[name]
+
+        if not self.gate.enter(name, job.priority):
+            job.yielded += 1
+            logger.log("Skipping '" + name + "', a higher priority programme is running")
+            return
+
+        start = time.monotonic()
+
+        try:
+            result = run_command(self.app, logger, job.command, [])
+        finally:
+            self.gate.leave(name)
+
+        job.record_run(time.monotonic() - start, result['success'])
+
+    def scheduler_event(self, event):
+        job = self.jobs.get(event.job_id)
+
+        if job is None:
+            return
+
+        if event.code == EVENT_JOB_MISSED:
+            job.missed += 1
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            job.overlaps += 1
+        elif event.code == EVENT_JOB_SUBMITTED and event.scheduled_run_times:
+            scheduled = event.scheduled_run_times[-1]
+            job.record_lateness(max(0, (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()))
+
+    def statistics(self):
+        return { name: job.to_dict() for name, job in self.jobs.items() }
@@ -1,16 +1,78 @@
 import os
 import sys
+import time
 import psutil
 import requests
 import traceback
 import socket
+import copy
 import uuid
+import weakref
+import threading
 
 from datetime import datetime
-from tinydb import TinyDB, Query
-from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app, has_app_context
 
 from app.core.wrappers import retry
+from app.core.metrics import registry
+from app.core.store import get_store
+from app.core.timeseries import health
+
+probe_seconds = registry.histogram('cultiva_sentinel_probe_seconds', 'Duration of sentinel probes', ['probe'])
+alert_backlog = registry.gauge('cultiva_sentinel_alert_backlog', 'Alerts waiting to be dispatched to the hub')
+
+class SentinelRunContext:
+    """ State shared by the probe, sync and dispatch phases of one sentinel run """
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.internet_checked = None
+        self.internet_deadline = None
+        self.internet_up = False
+        self.local_ip_address = None
+
+    def is_internet_up(self, url='http://www.google.com/'):
+        with self.lock:
+            checking = self.internet_checked is None
+
+            if checking:
+                self.internet_checked = threading.Event()
+                self.internet_deadline = time.monotonic() + self.timeout + 1
+
+        if checking:
+            internet_up = check_internet(url, self.timeout)
+
+            with self.lock:
+                if not self.internet_checked.is_set():
+                    self.internet_up = internet_up
+                    self.internet_checked.set()
+
+        # Name resolution is not covered by the request timeout, a check
+        # that hangs beyond it counts as no internet for the rest of the run,
+        # every phase waits only for what is left of the one deadline
+        elif not self.internet_checked.wait(None if self.internet_deadline is None else max(0, self.internet_deadline - time.monotonic())):
+            with self.lock:
+                if not self.internet_checked.is_set():
+                    self.internet_up = False
+                    self.internet_checked.set()
+
+        return self.internet_up
+
+    def get_local_ip_address(self):
+        with self.lock:
+            if self.local_ip_address is None:
+                self.local_ip_address = LocalIpAddressProbe().run()
+
+            return self.local_ip_address
+
+def check_internet(url, timeout):
+    try:
+        _ = requests.head(url, timeout=timeout)
+        return True
+    except (requests.ConnectionError, requests.Timeout):
+        return False
 
 class CpuProbe:
     def name(self):
@@ -27,10 +89,16 @@ class MemoryProbe:
         return round(psutil.virtual_memory().available * 100 / psutil.virtual_memory().total, 1)
         
 class LocalIpAddressProbe:
+    def __init__(self, context=None):
+        self.context = context
+
     def name(self):
         return 'Local IP address'
         
     def run(self):
+        if self.context is not None:
+            return self.context.get_local_ip_address()
+
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         
         try:
@@ -43,8 +111,9 @@ class LocalIpAddressProbe:
         return ip
 
 class InternetProbe:
-    def __init__(self, logger):
+    def __init__(self, logger, context=None):
         self.logger = logger
+        self.context = context
         self.repository = SentinelRepository()
         self.alert_factory = AlertFactory()
         
@@ -115,53 +184,219 @@ class InternetProbe:
         return datetime.strptime(previous_state['time'], '%Y-%m-%d %H:%M:%S')
     
     def is_internet_up(self, url='http://www.google.com/', timeout=5):
-        try:
-            _ = requests.head(url, timeout=timeout)
+        if self.context is not None:
+            return self.context.is_internet_up(url)
+
+        return check_internet(url, timeout)
+
+
+class AlertStore:
+    """ The alerts table of a store with hash indexes on key and id and an index on severity """
+
+    def __init__(self, store, table='alerts'):
+        self.store = store
+        self.table = table
+        self.by_key = {}
+        self.by_id = {}
+        self.by_severity = {}
+
+        with store.lock:
+            for doc_id, alert in store.table(table).items():
+                self.index(doc_id, alert)
+
+    def index(self, doc_id, alert):
+        self.by_key[alert['key']] = doc_id
+        self.by_id[alert['id']] = doc_id
+        self.by_severity.setdefault(alert['severity'], {})[doc_id] = None
+
+    def unindex(self, doc_id, alert):
+        self.by_key.pop(alert['key'], None)
+        self.by_id.pop(alert['id'], None)
+        self.by_severity.get(alert['severity'], {}).pop(doc_id, None)
+
+    def insert(self, alert):
+        """ Inserts alert unless one with the same key is stored, returns whether it was inserted """
+
+        with self.store.lock:
+            if alert['key'] in self.by_key:
+                return False
+
+            alert = dict(alert)
+            self.index(self.store.insert(self.table, alert), alert)
+
             return True
-        except requests.ConnectionError:
-            return False
 
+    def get(self, alert_id):
+        with self.store.lock:
+            doc_id = self.by_id.get(alert_id)
+
+            return None if doc_id is None else dict(self.store.table(self.table)[doc_id])
+
+    def all(self, severity=None):
+        with self.store.lock:
+            alerts = self.store.table(self.table)
+            doc_ids = alerts if severity is None else sorted(self.by_severity.get(severity, {}))
+
+            return [dict(alerts[doc_id]) for doc_id in doc_ids]
+
+    def due(self, now, limit=None):
+        """ Returns up to limit alerts whose next attempt is due, oldest first """
+
+        with self.store.lock:
+            due = []
+
+            for alert in self.store.table(self.table).values():
+                if limit is not None and len(due) >= limit:
+                    break
+
+                if alert.get('next_attempt', 0) <= now:
+                    due.append(dict(alert))
+
+            return due
+
+    def make_due(self, now):
+        """ Brings the next attempt of every alert that is backing off forward to now, returns how many were """
+
+        with self.store.lock:
+            waiting = [alert for alert in self.store.table(self.table).values() if alert.get('next_attempt', 0) > now]
+
+            for alert in waiting:
+                alert['next_attempt'] = now
+
+            if waiting:
+                self.store.changed()
+
+            return len(waiting)
+
+    def next_attempt(self):
+        with self.store.lock:
+            return min((alert.get('next_attempt', 0) for alert in self.store.table(self.table).values()), default=None)
+
+    def remove(self, alert_ids):
+        with self.store.lock:
+            alerts = self.store.table(self.table)
+            doc_ids = [self.by_id[alert_id] for alert_id in alert_ids if alert_id in self.by_id]
+
+            for doc_id in doc_ids:
+                self.unindex(doc_id, alerts[doc_id])
+
+            return self.store.remove(self.table, doc_ids)
+
+    def update(self, updates):
+        with self.store.lock:
+            alerts = self.store.table(self.table)
+            updated = []
+
+            for update in updates:
+                doc_id = self.by_id.get(update['id'])
+
+                if doc_id is None:
+                    continue
+
+                self.unindex(doc_id, alerts[doc_id])
+                alerts[doc_id].update(update)
+                self.index(doc_id, alerts[doc_id])
+                updated.append(doc_id)
+
+            if updated:
+                self.store.changed()
+
+            return updated
+
+    def __len__(self):
+        return len(self.by_id)
+
+alert_stores = weakref.WeakKeyDictionary()
+alert_stores_lock = threading.Lock()
+
+def get_alert_store(store):
+    with alert_stores_lock:
+        alerts = alert_stores.get(store)
+
+        if alerts is None:
+            alerts = alert_stores[store] = AlertStore(store)
+
+            # Alerts left over from the last run are backlog from the start
+            alert_backlog.set(len(alerts))
+
+        return alerts
 
 class SentinelRepository:
-    def __init__(self):        
-        self.sentinel_db = TinyDB('app/core/sentinel.json')
-        self.state_table = self.sentinel_db.table('state')
-        self.alerts_table = self.sentinel_db.table('alerts')
+    """ Sentinel state and alerts, served from the process-wide store for sentinel.json """
+
+    def __init__(self, store=None):
+        if store is None:
+            flush_interval = current_app.config.get('SENTINEL_STORE_FLUSH_INTERVAL', 5) if has_app_context() else 5
+
+            # Every process keeps its own copy in memory, only the one that
+            # owns the hardware writes it behind so workers do not overwrite
+            # each other's snapshots
+            writable = current_app.extensions['OWNERSHIP'].is_owner() if has_app_context() else True
+            store = get_store('app/core/sentinel.json', flush_interval, writable)
+
+        self.store = store
+        self.alerts = get_alert_store(store)
         
     def insert_alert(self, alert):
-        a = Query()        
-        if self.alerts_table.get(a.key == alert['key']) is None:        
-            self.alerts_table.insert(alert)
+        self.alerts.insert(alert)
+        alert_backlog.set(len(self.alerts))
         
-    def get_alerts(self):
-        return self.alerts_table.all()
+    def get_alerts(self, severity=None):
+        return self.alerts.all(severity)
+
+    def get_alert(self, alert_id):
+        return self.alerts.get(alert_id)
+
+    def get_due_alerts(self, now, limit=None):
+        return self.alerts.due(now, limit)
+
+    def get_next_attempt(self):
+        return self.alerts.next_attempt()
+
+    def make_alerts_due(self, now):
+        return self.alerts.make_due(now)
+
+    def count_alerts(self):
+        return len(self.alerts)
         
     def delete_alert(self, alert):
-        a = Query()  
-        return self.alerts_table.remove(a.id == alert['id'])
+        return self.delete_alerts([alert])
+
+    def delete_alerts(self, alerts):
+        removed = self.alerts.remove([alert['id'] for alert in alerts])
+        alert_backlog.set(len(self.alerts))
+
+        return removed
         
     def update_alert(self, alert):
-        a = Query()
-        return self.alerts_table.update(alert, a.id == alert['id'])
+        return self.alerts.update([alert])
+
+    def update_alerts(self, alerts):
+        return self.alerts.update(alerts)
         
     def has_alerts(self):
-        return len(self.alerts_table) > 0
+        return len(self.alerts) > 0
         
     def get_state(self):
-        return self.state_table.get(doc_id=len(self.state_table))
+        with self.store.lock:
+            state = self.store.table('state').get(len(self.store.table('state')))
+
+            return copy.deepcopy(state)
 
     def update_state(self, state):
-        if len(self.state_table) == 0:
-            self.state_table.insert({ 'internet': { 'status': 'unknown', 'time': '' } })
-        
-        current_state = self.get_state()
-            
-        if ('internet' in state):
-            current_state['internet']['status'] = state['internet']['status']
-            current_state['internet']['time'] = state['internet']['time']
-            
-        self.state_table.truncate()
-        self.state_table.insert(current_state)
+        with self.store.lock:
+            table = self.store.table('state')
+
+            if len(table) == 0:
+                self.store.insert('state', { 'internet': { 'status': 'unknown', 'time': '' } })
+
+            current_state = table[len(table)]
+
+            if ('internet' in state):
+                current_state['internet']['status'] = state['internet']['status']
+                current_state['internet']['time'] = state['internet']['time']
+
+            self.store.changed()
             
 class AlertFactory:
     def internet_up(self):
@@ -218,25 +453,23 @@ class AlertDispatcher:
     @retry
     def dispatch_to_phone(self, alert):
         print('TODO')
-        
-    @retry
-    def dispatch_to_hub(self, alert):
-        payload = alert.copy()
-        payload.pop('id', None)
-        
-        notification_address = current_app.config['HUB_ADDRESS'] + '/api/notifications?nodeId=' + str(current_app.config['NODE_ID'])    
-        response = requests.post(notification_address, json=payload, verify=False)
-        response.raise_for_status()
      
 class Sentinel:
-    def __init__(self, logger):
+    def __init__(self, logger, probe_timeout=None, outbox=None):
         self.logger = logger
         self.repository = SentinelRepository()
         self.alert_factory = AlertFactory()
         self.alert_dispatcher = AlertDispatcher()
+        self.outbox = outbox
+        self.probe_timeout = probe_timeout if probe_timeout is not None else current_app.config.get('SENTINEL_PROBE_TIMEOUT', 5)
+        self.context = SentinelRunContext(self.probe_timeout)
         
     def run_programme(self):
         self.logger.log_h1('Starting Sentinel Programme', True, True)
+
+        # Connectivity is checked once per run, offline runs pay one timeout
+        # instead of one per phase
+        self.context = SentinelRunContext(self.probe_timeout)
         
         self.run_probes()
         self.sync_with_hub()
@@ -253,28 +486,59 @@ class Sentinel:
             self.logger.log_h2('Starting probes', True, True)
                 
             probes = [
-                InternetProbe(self.logger),
+                InternetProbe(self.logger, self.context),
                 CpuProbe(),
                 MemoryProbe(),
-                LocalIpAddressProbe()
+                LocalIpAddressProbe(self.context)
             ]
-            
-            for probe in probes:
+
+            # Probes run side by side, each gets probe_timeout (plus a small
+            # margin for the connectivity check's own timeout) from the start
+            executor = ThreadPoolExecutor(max_workers=len(probes), thread_name_prefix='Probe')
+            futures = [(probe, executor.submit(self.run_probe, probe)) for probe in probes]
+            deadline = time.monotonic() + self.probe_timeout + 1
+
+            for probe, future in futures:
                 try:
-                    results[probe.name()] = probe.run()
+                    results[probe.name()] = future.result(timeout=max(0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    self.logger.warning("Probe '" + probe.name() + "' timed out")
+                    results[probe.name()] = 'Timed out'
                 except:
                     self.logger.warning("Probe '" + probe.name() + "' failed")
                     results[probe.name()] = 'Failed'
+
+            executor.shutdown(wait=False)
+
+            self.record_health(results)
                     
             self.logger.log_h3_object('Probes', results, True, True)
                     
             self.logger.log_h2('Finished probes')
         except:
             self.logger.error(traceback.format_exc())
+
+    def record_health(self, results, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+
+        for name in ['CPU', 'Memory']:
+            if isinstance(results.get(name), (int, float)):
+                health.record(name, results[name], timestamp)
+
+        if 'Internet access' in results:
+            health.record('Internet access', 1 if results['Internet access'] == 'OK' else 0, timestamp)
+
+    def run_probe(self, probe):
+        start = time.perf_counter()
+
+        try:
+            return probe.run()
+        finally:
+            probe_seconds.observe(time.perf_counter() - start, probe.name())
             
     def sync_with_hub(self):
         try:
-            is_internet_up = InternetProbe(self.logger).is_internet_up()
+            is_internet_up = self.context.is_internet_up()
             
             if is_internet_up:
                 self.logger.log_h2('Syncing started', True, False)
@@ -283,7 +547,7 @@ class Sentinel:
                 
                 payload = {
                     'nodeId': current_app.config['NODE_ID'],
-                    'localIpAddress': LocalIpAddressProbe().run()
+                    'localIpAddress': self.context.get_local_ip_address()
                 }
                 
                 response = requests.post(sync_address, json=payload, verify=False)
@@ -295,28 +559,41 @@ class Sentinel:
         except:
             self.logger.error(traceback.format_exc())
             
+    def get_outbox(self):
+        return self.outbox if self.outbox is not None else current_app.extensions['OUTBOX']
+
     def dispatch_alerts(self): 
         try:
             results = {}
         
             self.logger.log_h2('Starting dispatching alerts', True, False)
                     
-            is_internet_up = InternetProbe(self.logger).is_internet_up()
+            is_internet_up = self.context.is_internet_up()
             
             if self.repository.has_alerts(): 
-                for alert in self.repository.get_alerts():                                
-                    if is_internet_up:
-                        self.alert_dispatcher.dispatch_to_hub(alert)
-                        self.repository.delete_alert(alert) 
-                        results[alert['key']] = 'Dispatched to Hub'
-                    else:
-                        results[alert['key']] = 'Deferred'
-                        
-                    if alert['severity'] == 3 and not 'dispatched_to_phone' in alert:
-                        self.alert_dispatcher.dispatch_to_phone(alert)                
-                        alert['dispatched_to_phone'] = True
-                        self.repository.update_alert(alert)
-                        results[alert['key']] = 'Dispatched to GSM'
+                updated = []
+                now = time.time()
+
+                # Delivery to the hub is left to the outbox, which retries
+                # each alert on its own schedule off this thread
+                try:
+                    for alert in self.repository.get_alerts():                                
+                        if alert.get('next_attempt', 0) > now:
+                            results[alert['key']] = 'Retrying in ' + str(int(alert['next_attempt'] - now)) + 's (attempt ' + str(alert['attempts'] + 1) + ')'
+                        else:
+                            results[alert['key']] = 'Queued for Hub' if is_internet_up else 'Deferred'
+                            
+                        if alert['severity'] == 3 and not 'dispatched_to_phone' in alert:
+                            self.alert_dispatcher.dispatch_to_phone(alert)                
+                            updated.append({ 'id': alert['id'], 'dispatched_to_phone': True })
+                            results[alert['key']] = 'Dispatched to GSM'
+                finally:
+                    # Only the flag is written back, the outbox may have
+                    # rescheduled these alerts in the meantime
+                    self.repository.update_alerts(updated)
+
+                if is_internet_up:
+                    self.get_outbox().notify()
                              
                 self.logger.log_h3_object('Alerts', results, True, True) 
                 
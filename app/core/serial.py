@@ -1,26 +1,135 @@
+import os
 import sys
 import time
+import random
 import serial
 import logging
 import traceback
 import json
+import uuid
 
-from datetime import datetime
-from datetime import timedelta
 from serial.tools import list_ports
 
-from threading import RLock, Thread
+from concurrent.futures import Future
+from threading import RLock, Lock, Thread, Event
+
+from app.core.multiplexer import SerialMultiplexer, CommandAcknowledgedError
+from app.core.wrappers import CircuitBreaker, statistics
+from app.core.metrics import registry
+from app.core import tracing
+from app.core.protocol import FrameBuffer, JsonProtocol, BinaryProtocol
+
+port_cache = {}
+
+ACK_TIMEOUT = 250
+RESULT_TIMEOUT = 5000
+
+serial_seconds = registry.histogram('cultiva_serial_seconds', 'Latency of serial connection sends and receives', ['operation'])
+
+class ControllerUnavailableError(Exception):
+    def __init__(self, connection):
+        self.message = "Controller by vendor id '" + str(connection.vendor_id) + "' and product id '" + str(connection.product_id) + "' is unavailable, reconnecting in the background"
+        super().__init__(self.message)
+
+class ControllerBusyError(Exception):
+    def __init__(self, connection, timeout):
+        self.message = "Controller by vendor id '" + str(connection.vendor_id) + "' and product id '" + str(connection.product_id) + "' is busy, the link did not free up within " + str(round(timeout, 2)) + ' seconds'
+        super().__init__(self.message)
+
+class ControllerResultError(Exception):
+    """ The controller answered with a valid result that does not indicate success, the link itself is fine """
 
 class SerialConnection:
-    def __init__(self, vendor_id, product_id, logger):
+    def __init__(self, vendor_id, product_id, logger, port=None, serial_number=None, protocol='json'):
         self.lock = RLock()
         self.vendor_id = vendor_id
         self.product_id = product_id
+        self.serial_number = serial_number
+        self.port = port
         self.connection = None
         self.logger = logger
-        self.open()        
+        self.poll_interval = 0.05
+        self.preferred_protocol = protocol
+        self.protocol = JsonProtocol()
+        self.frames = self.protocol.frame_buffer()
+        self.multiplexer = None
+        self.supports_batch = None
+        self.device = None
+        self.available = Event()
+        self.closed = False
+        self.reconnecting = False
+        self.reconnect_lock = Lock()
+        self.wakeup = Event()
+        self.warmup_timeout = 5000
+        self.min_backoff = 0.5
+        self.max_backoff = 30
+        self.last_activity = time.monotonic()
+        self.breaker = CircuitBreaker('controller(' + str(port or (vendor_id, product_id)) + ')', on_trip=self.reset, ignore=(ControllerResultError, ControllerBusyError))
+        self.connect()
+
+    def connect(self):
+        try:
+            with self.lock:
+                self.open()
+                self.available.set()
+
+            hotplug_monitor.register(self)
+        except:
+            self.logger.error(traceback.format_exc())
+            self.start_reconnect()
         
     def open(self):
+        port = self.port or self.resolve_port()
+
+        try:
+            self.connection = serial.Serial(port, 9600, timeout=self.poll_interval)
+        except:
+            port_cache.pop(self.cache_key(), None)
+            raise
+
+        self.device = port
+        self.supports_batch = None
+        self.use_protocol(JsonProtocol())
+        
+        self.warmup();
+        self.negotiate()
+
+    def negotiate(self):
+        if self.preferred_protocol == JsonProtocol.name:
+            return
+
+        command_id = str(uuid.uuid4())
+
+        try:
+            response = self.roundtrip(command_id, json.dumps({ 'id': command_id, 'command': 'protocol', 'arguments': [self.preferred_protocol] }))
+
+            if not json.loads(response)['success']:
+                raise Exception('Controller declined protocol: ' + response)
+
+            self.use_protocol(BinaryProtocol())
+            self.logger.log("Using '" + self.protocol.name + "' protocol for controller")
+        except:
+            self.logger.warning("Protocol '" + self.preferred_protocol + "' could not be negotiated, falling back to JSON: " + str(sys.exc_info()[1]))
+
+    def use_protocol(self, protocol):
+        self.protocol = protocol
+        self.frames = protocol.frame_buffer()
+
+    def resolve_port(self):
+        port = port_cache.get(self.cache_key())
+
+        if port is not None and os.path.exists(port):
+            return port
+
+        port = self.find_port()
+        port_cache[self.cache_key()] = port
+
+        return port
+
+    def cache_key(self):
+        return (self.vendor_id, self.product_id, self.serial_number)
+
+    def find_port(self):
         device_list = list_ports.comports()
         
         port = '';
@@ -28,20 +137,25 @@ class SerialConnection:
         for device in device_list:
             if (device.vid != None or device.pid != None):
                 if (device.vid == self.vendor_id and device.pid == self.product_id):
-                    port = device.device
+                    if self.serial_number is None or device.serial_number == self.serial_number:
+                        port = device.device
     
         if port == '':
             raise Exception("Device by vendor id '" + str(self.vendor_id) + "' and product id '" + str(self.product_id) + "' not found")
-            
-        self.connection = serial.Serial(port, 9600, timeout=10)     
-        
-        self.warmup();
+
+        return port
 
     def warmup(self):
         ready = False
+        deadline = time.monotonic() + self.warmup_timeout / 1000.0
         
         while ready is not True:
-            result = self.receive(2000)
+            remaining = (deadline - time.monotonic()) * 1000
+
+            if remaining <= 0:
+                raise Exception('Ready message from controller not received within ' + str(self.warmup_timeout) + ' milliseconds')
+
+            result = self.receive(min(2000, remaining))
             
             if result == '{"type":"ready"}':
                 ready = True
@@ -49,77 +163,230 @@ class SerialConnection:
                 self.logger.warning('Ready message from controller not received. Response: ' + result)
 
     def close(self):
-        self.connection.close()
+        self.closed = True
+        self.available.clear()
+        self.wakeup.set()
+        hotplug_monitor.unregister(self)
+
+        with self.lock:
+            self.disconnect()
+
+    def disconnect(self):
+        try:
+            if self.connection is not None:
+                self.connection.close()
+        except:
+            self.logger.warning(traceback.format_exc())
 
     def reset(self):
-        self.close()
-        self.open()
+        statistics.increment('resets')
+
+        with self.lock:
+            self.available.clear()
+            self.disconnect()
+            self.flush()
+
+        self.start_reconnect()
+
+    def lost(self):
+        if self.available.is_set():
+            self.logger.error('Connection to controller lost. Reconnecting in the background ...')
+            self.reset()
+
+    def start_reconnect(self):
+        with self.reconnect_lock:
+            if self.reconnecting or self.closed:
+                return
+
+            self.reconnecting = True
+
+        self.wakeup.clear()
+        Thread(target=self.reconnect, name='SerialReconnect', daemon=True).start()
+
+    def reconnect(self):
+        attempt = 0
+
+        try:
+            while not self.closed:
+                try:
+                    with self.lock:
+                        self.open()
+                        self.available.set()
+
+                    hotplug_monitor.register(self)
+                    self.logger.log('Connection to controller re-established')
+                    return
+                except:
+                    self.disconnect()
+                    delay = min(self.max_backoff, self.min_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    attempt += 1
+
+                    self.logger.warning('Reconnecting to controller failed, next attempt in ' + str(round(delay, 1)) + ' seconds: ' + str(sys.exc_info()[1]))
+                    self.wakeup.wait(delay)
+                    self.wakeup.clear()
+        finally:
+            with self.reconnect_lock:
+                self.reconnecting = False
+
+    def idle_time(self):
+        return time.monotonic() - self.last_activity
+
+    def wait_until_available(self, timeout=None):
+        return self.available.wait(timeout)
+
+    def check_presence(self, devices):
+        if self.closed:
+            return
+
+        if self.device is None:
+            return
+
+        if self.port is not None:
+            present = os.path.exists(self.port)
+        else:
+            present = any(device.vid == self.vendor_id and device.pid == self.product_id and (self.serial_number is None or device.serial_number == self.serial_number) for device in devices)
+
+        if present and self.reconnecting:
+            self.wakeup.set()
+        elif not present and self.available.is_set():
+            self.logger.error('Controller was unplugged')
+            self.lost()
                 
-    def send(self, command_id, command):
-        payload = bytes("<" + command + ">", encoding='utf-8')
+    def start_multiplexer(self):
+        if self.multiplexer is None:
+            self.multiplexer = SerialMultiplexer(self, self.logger)
+
+        self.multiplexer.start()
+
+    def stop_multiplexer(self):
+        if self.multiplexer is not None:
+            self.multiplexer.stop()
+            self.multiplexer = None
+
+    def submit(self, command_id, command, timeout=None):
+        """ Sends command, without a multiplexer the exchange runs here and waits no longer than timeout seconds in total """
+
+        if not self.available.is_set():
+            future = Future()
+            future.set_exception(ControllerUnavailableError(self))
+            return future
+
+        if self.multiplexer is not None:
+            return self.multiplexer.submit(command_id, command)
+
+        future = Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        try:
+            if not self.lock.acquire(timeout=-1 if timeout is None else max(0, timeout)):
+                raise ControllerBusyError(self, timeout)
+
+            try:
+                future.set_result(self.send(command_id, command, deadline))
+            finally:
+                self.lock.release()
+        except Exception as e:
+            future.set_exception(e)
 
-        for i in range(3): 
-            try:   
-                self.flush()
+        return future
+
+    def write_frame(self, command):
+        self.connection.write(self.protocol.encode(command))
                 
-                self.connection.write(payload)        
-                response = self.receive(250)
+    def send(self, command_id, command, deadline=None):
+        if not self.available.is_set():
+            raise ControllerUnavailableError(self)
+
+        start = time.perf_counter()
+
+        try:
+            with tracing.span('serial.send'):
+                return self.exchange(command_id, command, deadline)
+        finally:
+            serial_seconds.observe(time.perf_counter() - start, 'send')
+
+    def exchange(self, command_id, command, deadline=None):
+        if self.multiplexer is not None:
+            return self.multiplexer.send(command_id, command, None if deadline is None else max(0, deadline - time.monotonic()))
+
+        return self.roundtrip(command_id, command, deadline)
+
+    def roundtrip(self, command_id, command, deadline=None):
+        with self.lock:
+            self.write_frame(command)
+            response = self.receive_for(command_id, wait_time(ACK_TIMEOUT, deadline))
+            
+            if not self.is_valid_json(response):
+                raise Exception('Expected acknowledgement, received invalid response: ' + response)
                 
-                if not self.is_valid_json(response):
-                    raise Exception('Expected acknowledgement, received invalid response: ' + response)
-                    
-                if self.is_valid_result(response, command_id):
-                    return response
+            if self.is_valid_result(response, command_id):
+                return response
         
-                if not self.is_valid_acknowledgement(response, command_id):
-                    raise Exception('Expected acknowledgement, received invalid response: ' + response)
+            if not self.is_valid_acknowledgement(response, command_id):
+                raise Exception('Expected acknowledgement, received invalid response: ' + response)
 
-                response = self.receive(5000)
+            try:
+                response = self.receive_for(command_id, wait_time(RESULT_TIMEOUT, deadline))
+            except Exception as e:
+                raise CommandAcknowledgedError(str(e))
+            
+            if not self.is_valid_result(response, command_id):
+                raise CommandAcknowledgedError('Expected result, received invalid response: ' + response)
                 
-                if not self.is_valid_result(response, command_id):
-                    raise Exception('Expected result, received invalid response: ' + response)
-                    
+            return response
+
+    def receive_for(self, command_id, timeout):
+        deadline = time.monotonic() + timeout / 1000.0
+
+        while True:
+            response = self.receive(max(0, (deadline - time.monotonic()) * 1000))
+
+            if command_id in response or not self.is_valid_json(response):
                 return response
-            except:
-                self.logger.warning(traceback.format_exc())
-                self.logger.warning('Retrying in ' + str(250 * i) + ' milliseconds')
-                time.sleep(0.25 * i)
-                pass      
-             
-        self.logger.error('Communication to controller failed. Resetting controller ...')
-        self.reset()
-
-        raise Exception('Failed to receive response from controller. Connection has been reset ...')
+
+            self.logger.warning('Discarding stale response from controller: ' + response)
                 
     def receive(self, timeout):
-        receive_in_progress = False
+        start = time.perf_counter()
+
+        with tracing.span('serial.receive'):
+            frame = self.read_frame(timeout)
+
+        serial_seconds.observe(time.perf_counter() - start, 'receive')
+
+        if frame is None:
+            raise Exception('Invalid response received from controller: "' + self.frames.pending() + '", timeout: ' + str(timeout) + ' ms')
+
+        return frame
 
-        start_marker = '<'
-        end_marker = '>'
+    def read_frame(self, timeout):
+        frame = self.frames.next_frame()
 
-        line = []
+        if frame is not None:
+            self.last_activity = time.monotonic()
+            return self.protocol.decode(frame)
 
-        start = datetime.now()
+        deadline = time.monotonic() + timeout / 1000.0
 
         while True:
-            if (datetime.now() - start).total_seconds() * 1000 > timeout:
-                raise Exception('Invalid response received from controller: "' + ''.join(str(char) for char in line) + '", start: ' + str(start) + ', end: ' + str(datetime.now()))
-
-            c = self.connection.read().decode()
-
-            if receive_in_progress == True:
-                if str(c) == end_marker:
-                    receive_in_progress = False
-                    return ''.join(str(char) for char in line)
-                else:
-                    line.append(c)
-            elif str(c) == start_marker:
-                receive_in_progress = True
+            chunk = self.connection.read(self.connection.in_waiting or 1)
+
+            if chunk:
+                self.frames.feed(chunk)
+                frame = self.frames.next_frame()
+
+                if frame is not None:
+                    self.last_activity = time.monotonic()
+                    return self.protocol.decode(frame)
+
+            if time.monotonic() >= deadline:
+                return None
                 
     def flush(self):
+        self.frames.clear()
+
         try:
-            for c in self.connection.read():
-                pass
+            self.connection.reset_input_buffer()
         except:
             pass
                 
@@ -139,4 +406,56 @@ class SerialConnection:
             json_object = json.loads(response)
             return True
         except:            
-            return False
\ No newline at end of file
+            return False
+
+def wait_time(timeout, deadline):
+    """ Returns timeout in milliseconds, shortened to what is left until deadline """
+
+    if deadline is None:
+        return timeout
+
+    return min(timeout, max(0, (deadline - time.monotonic()) * 1000))
+
+class HotplugMonitor:
+    def __init__(self, interval=2):
+        self.interval = interval
+        self.connections = []
+        self.lock = Lock()
+        self.thread = None
+
+    def register(self, connection):
+        with self.lock:
+            if connection not in self.connections:
+                self.connections.append(connection)
+
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='HotplugMonitor', daemon=True)
+                self.thread.start()
+
+    def unregister(self, connection):
+        with self.lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            with self.lock:
+                connections = list(self.connections)
+
+            if len(connections) == 0:
+                continue
+
+            try:
+                devices = list_ports.comports()
+            except:
+                devices = []
+
+            for connection in connections:
+                try:
+                    connection.check_presence(devices)
+                except:
+                    connection.logger.warning(traceback.format_exc())
+
+hotplug_monitor = HotplugMonitor()
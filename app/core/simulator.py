@@ -0,0 +1,259 @@
+"""
+Virtual irrigation controller
+
+Speaks the controller protocol on a pseudo-terminal so SerialConnection
+can be exercised without hardware attached:
+
+    python -m app.core.simulator --latency 20 --jitter 5
+ """
+
+import os
+import pty
+import tty
+import json
+import time
+import heapq
+import random
+import select
+import argparse
+
+from threading import Thread, Lock
+
+from app.core import protocol
+
+class VirtualController:
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0, garbage_rate=0.0, baud_rate=None, sensor_value=512, seed=None, supports_binary=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.garbage_rate = garbage_rate
+        self.baud_rate = baud_rate
+        self.sensor_value = sensor_value
+        self.random = random.Random(seed)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.booting = True
+        self.thread = None
+        self.buffer = bytearray()
+        self.outbox = []
+        self.outbox_lock = Lock()
+        self.sequence = 0
+        self.open_ports = set()
+        self.commands_received = 0
+        self.supports_binary = supports_binary
+        self.binary = False
+        self.frames = protocol.BinaryFrameBuffer()
+
+    def start(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = Thread(target=self.run, name='VirtualController', daemon=True)
+        self.thread.start()
+
+        return self.port
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        os.close(self.master)
+        os.close(self.slave)
+
+    def reboot(self):
+        self.binary = False
+        self.booting = True
+
+    def run(self):
+        next_announcement = 0
+
+        while self.running:
+            now = time.monotonic()
+
+            if self.booting and now >= next_announcement:
+                self.write({'type': 'ready'})
+                next_announcement = now + 0.1
+
+            self.flush_due(now)
+
+            readable, _, _ = select.select([self.master], [], [], self.next_timeout(now))
+
+            if readable:
+                data = os.read(self.master, 4096)
+
+                if self.binary:
+                    self.process_binary(data)
+                else:
+                    self.buffer += data
+                    self.process()
+
+    def next_timeout(self, now):
+        timeout = 0.1 if self.booting else 0.5
+
+        with self.outbox_lock:
+            if self.outbox:
+                timeout = min(timeout, max(0, self.outbox[0][0] - now))
+
+        return timeout
+
+    def process(self):
+        while True:
+            start = self.buffer.find(b'<')
+
+            if start < 0:
+                del self.buffer[:]
+                return
+
+            end = self.buffer.find(b'>', start)
+
+            if end < 0:
+                del self.buffer[:start]
+                return
+
+            frame = bytes(self.buffer[start + 1:end])
+            del self.buffer[:end + 1]
+
+            self.receive(frame)
+
+    def process_binary(self, data):
+        self.frames.feed(data)
+
+        while True:
+            payload = self.frames.next_frame()
+
+            if payload is None:
+                return
+
+            try:
+                opcode, command = protocol.decode_request(payload)
+            except Exception:
+                continue
+
+            self.handle(command, opcode)
+
+    def receive(self, frame):
+        try:
+            command = json.loads(frame.decode('utf-8'))
+        except ValueError:
+            self.write({'type': 'error', 'message': 'Invalid command'})
+            return
+
+        if command.get('command') == 'protocol':
+            self.negotiate(command)
+            return
+
+        self.handle(command)
+
+    def negotiate(self, command):
+        self.booting = False
+        accepted = self.supports_binary and command['arguments'] == ['binary']
+
+        self.write({'type': 'commandReceived', 'id': command['id']})
+        self.write({'type': 'result', 'id': command['id'], 'success': accepted, 'message': 'protocol(' + ','.join(command['arguments']) + ')'})
+
+        if accepted:
+            self.binary = True
+            self.frames.clear()
+
+    def handle(self, command, opcode=None):
+        self.booting = False
+        self.commands_received += 1
+
+        if self.random.random() < self.drop_rate:
+            return
+
+        if opcode is None:
+            self.write({'type': 'commandReceived', 'id': command['id']})
+        else:
+            self.write_binary(protocol.HEADER.pack(protocol.ACKNOWLEDGEMENT, command['id']))
+
+        result = self.execute(command)
+
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)) / 1000.0
+
+        with self.outbox_lock:
+            self.sequence += 1
+            heapq.heappush(self.outbox, (time.monotonic() + delay, self.sequence, command, opcode, result))
+
+    def execute(self, command):
+        type = command.get('command')
+        arguments = command.get('arguments') or []
+
+        if type == 'batch':
+            return { 'success': True, 'results': [self.execute(operation) for operation in arguments] }
+        elif type == 'open':
+            self.open_ports.update(arguments)
+            return { 'success': True, 'message': 'opened(' + ', '.join(arguments) + ')' }
+        elif type == 'close':
+            self.open_ports.difference_update(arguments)
+            return { 'success': True, 'message': 'closed(' + ', '.join(arguments) + ')' }
+        elif type == 'read':
+            return { 'success': True, 'message': 'read(' + ','.join(str(self.sensor_value) for _ in arguments) + ')' }
+        elif type == 'ping':
+            return { 'success': True, 'message': 'pong()' }
+        else:
+            return { 'success': False, 'message': "Command '" + str(type) + "' is not supported" }
+
+    def flush_due(self, now):
+        due = []
+
+        with self.outbox_lock:
+            while self.outbox and self.outbox[0][0] <= now:
+                due.append(heapq.heappop(self.outbox)[2:])
+
+        for command, opcode, result in due:
+            if opcode is None:
+                message = { 'type': 'result', 'id': command['id'] }
+                message.update(result)
+                self.write(message)
+            else:
+                self.write_binary(protocol.HEADER.pack(protocol.RESULT, command['id']) + protocol.encode_result(opcode, command['arguments'], result))
+
+    def write(self, message):
+        self.write_bytes(b'<' + json.dumps(message, separators=(',', ':')).encode('utf-8') + b'>')
+
+    def write_binary(self, payload):
+        self.write_bytes(protocol.frame(payload))
+
+    def write_bytes(self, frame):
+        payload = b''
+
+        if self.random.random() < self.garbage_rate:
+            payload += bytes(self.random.choice(b'abcdefxyz{}":,0123456789 \r\n') for _ in range(self.random.randint(1, 16)))
+
+        payload += frame
+
+        if self.baud_rate:
+            time.sleep(len(payload) * 10.0 / self.baud_rate)
+
+        os.write(self.master, payload)
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual irrigation controller on a pseudo-terminal')
+    parser.add_argument('--latency', type=float, default=0.0, help='result latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='result jitter in milliseconds')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='share of commands left unanswered')
+    parser.add_argument('--garbage-rate', type=float, default=0.0, help='share of frames preceded by garbage bytes')
+    parser.add_argument('--baud-rate', type=int, default=None, help='throttle output to this line speed')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json-only', action='store_true', help='decline the binary protocol')
+    arguments = parser.parse_args()
+
+    controller = VirtualController(arguments.latency, arguments.jitter, arguments.drop_rate, arguments.garbage_rate, arguments.baud_rate, seed=arguments.seed, supports_binary=not arguments.json_only)
+
+    print(controller.start(), flush=True)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        controller.stop()
+
+if __name__ == '__main__':
+    main()
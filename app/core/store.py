@@ -0,0 +1,160 @@
+"""
+Store
+
+Tables kept in process memory and written behind to a JSON file in TinyDB's
+layout ({table: {doc_id: document}}), so existing files load unchanged and
+can still be opened with TinyDB. Changes only mark the store dirty, a timer
+coalesces everything changed within flush_interval into one snapshot which
+is written to a temporary file and renamed over the old one. Only one
+process may write a file behind, a store opened with writable False keeps
+its changes in memory and never overwrites the file.
+ """
+
+import os
+import json
+import atexit
+import logging
+import threading
+import traceback
+
+class SnapshotStore:
+    def __init__(self, path, flush_interval=5, writable=True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.writable = writable
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.tables = {}
+        self.next_ids = {}
+        self.dirty = False
+        self.changes = 0
+        self.timer = None
+        self.writes = 0
+
+        self.load()
+
+    def load(self):
+        data = {}
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path) as file:
+                data = json.load(file)
+
+        with self.lock:
+            self.tables = { name: { int(doc_id): document for doc_id, document in table.items() } for name, table in data.items() }
+            self.next_ids = { name: max(table, default=0) + 1 for name, table in self.tables.items() }
+
+    def table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = {}
+                self.next_ids[name] = 1
+
+            return self.tables[name]
+
+    def insert(self, name, document):
+        with self.lock:
+            table = self.table(name)
+            doc_id = self.next_ids[name]
+            self.next_ids[name] = doc_id + 1
+            table[doc_id] = document
+            self.changed()
+
+            return doc_id
+
+    def remove(self, name, doc_ids):
+        with self.lock:
+            table = self.table(name)
+            removed = [doc_id for doc_id in doc_ids if table.pop(doc_id, None) is not None]
+
+            if removed:
+                self.changed()
+
+            return removed
+
+    def truncate(self, name):
+        with self.lock:
+            self.tables[name] = {}
+            self.next_ids[name] = 1
+            self.changed()
+
+    def changed(self):
+        """ Marks the store dirty and schedules a snapshot unless one is pending """
+
+        with self.lock:
+            self.dirty = True
+            self.changes += 1
+
+            if self.timer is None and self.flush_interval is not None and self.writable:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        # Snapshots are written one at a time, in the order they were taken
+        with self.write_lock:
+            with self.lock:
+                self.timer = None
+
+                if not self.dirty or not self.writable:
+                    return False
+
+                snapshot = json.dumps({ name: { str(doc_id): document for doc_id, document in table.items() } for name, table in self.tables.items() })
+                changes = self.changes
+
+            directory = os.path.dirname(os.path.abspath(self.path))
+            temporary = os.path.join(directory, '.' + os.path.basename(self.path) + '.' + str(os.getpid()) + '.tmp')
+
+            try:
+                with open(temporary, 'w') as file:
+                    file.write(snapshot)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                os.replace(temporary, self.path)
+            except Exception:
+                logging.getLogger('Store').error('Writing snapshot of ' + self.path + ' failed, retrying: ' + traceback.format_exc())
+
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+
+                # Still dirty, the next snapshot carries these changes too
+                self.changed()
+
+                return False
+
+            self.writes += 1
+
+            with self.lock:
+                # Changes made while writing are left for the snapshot they scheduled
+                if self.changes == changes:
+                    self.dirty = False
+
+            return True
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        self.flush()
+
+stores = {}
+stores_lock = threading.Lock()
+
+def get_store(path, flush_interval=5, writable=True):
+    """ Returns the process-wide store for path, loading it on first use """
+
+    key = os.path.abspath(path)
+
+    with stores_lock:
+        store = stores.get(key)
+
+        if store is None:
+            store = stores[key] = SnapshotStore(path, flush_interval, writable)
+            atexit.register(store.close)
+
+        return store
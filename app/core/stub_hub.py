@@ -0,0 +1,142 @@
+"""
+Stub hub
+
+A local stand-in for the hub's node endpoints so alert delivery can be tested
+and benchmarked without the real service:
+
+    python -m app.core.stub_hub --port 1000 --latency 50 --failure-rate 0.1
+
+POST /api/notifications/batch takes a (gzip compressed) list of alerts and
+answers with the ids it acknowledged, POST /api/notifications takes a single
+alert and POST /api/node/sync records the sync payload.
+ """
+
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class StubHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(200, None)
+
+    def do_POST(self):
+        hub = self.server.hub
+        path = self.path.split('?')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        payload = json.loads(body.decode()) if body else None
+        hub.record_request(self)
+
+        if hub.latency:
+            time.sleep(hub.latency / 1000.0)
+
+        if path == '/api/notifications/batch' and hub.supports_batches:
+            self.respond(200, { 'acknowledged': hub.receive(payload) })
+        elif path == '/api/notifications':
+            self.respond(200 if hub.receive([payload]) else 500, None)
+        elif path == '/api/node/sync':
+            hub.syncs.append(payload)
+            self.respond(200, None)
+        else:
+            self.respond(404, None)
+
+    def respond(self, status, payload):
+        body = b'' if payload is None else json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubHub:
+    def __init__(self, port=0, latency=0.0, failure_rate=0.0, supports_batches=True, seed=None):
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.supports_batches = supports_batches
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.alerts = {}
+        self.syncs = []
+        self.requests = 0
+        self.connections = set()
+        self.server = None
+        self.thread = None
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+    def start(self):
+        self.server = ThreadingServer(('127.0.0.1', self.port), StubHubHandler)
+        self.server.hub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name='StubHub', daemon=True)
+        self.thread.start()
+
+        return self.address
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def record_request(self, handler):
+        with self.lock:
+            self.requests += 1
+            self.connections.add(handler.client_address)
+
+    def receive(self, alerts):
+        """ Stores the alerts that are not failed at random and returns their ids """
+
+        acknowledged = []
+
+        with self.lock:
+            for alert in alerts:
+                if self.random.random() < self.failure_rate:
+                    continue
+
+                self.alerts[alert.get('id') or alert['key']] = alert
+                acknowledged.append(alert.get('id'))
+
+        return acknowledged
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the hub node endpoints')
+    parser.add_argument('--port', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='response latency in milliseconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of alerts left unacknowledged')
+    parser.add_argument('--no-batches', action='store_true', help='answer the batch endpoint with 404 like an older hub')
+    parser.add_argument('--seed', type=int, default=None)
+    arguments = parser.parse_args()
+
+    hub = StubHub(arguments.port, arguments.latency, arguments.failure_rate, not arguments.no_batches, arguments.seed)
+
+    print(hub.start(), flush=True)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        hub.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Time series
+
+Node health history kept in fixed-size ring buffers. Each resolution stores
+its points in four array('d') columns (time, mean, min, max) so a series
+costs 32 bytes per point no matter how long the node runs. Raw samples are
+rolled up into 1 minute and 1 hour buckets as they arrive:
+
+    raw (every sample) -> 1m (mean/min/max per minute) -> 1h
+ """
+
+import time
+import threading
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+RESOLUTIONS = (('raw', None, 720), ('1m', 60, 1440), ('1h', 3600, 24 * 90))
+
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.means = array('d', [0.0]) * capacity
+        self.minimums = array('d', [0.0]) * capacity
+        self.maximums = array('d', [0.0]) * capacity
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp, mean, minimum, maximum):
+        index = (self.start + self.count) % self.capacity
+
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+
+        self.times[index] = timestamp
+        self.means[index] = mean
+        self.minimums[index] = minimum
+        self.maximums[index] = maximum
+
+    def ordered(self, column):
+        """ Returns column oldest first """
+
+        end = self.start + self.count
+
+        if end <= self.capacity:
+            return column[self.start:end]
+
+        return column[self.start:] + column[:end - self.capacity]
+
+    def window(self, start=None, end=None):
+        times = self.ordered(self.times)
+        first = 0 if start is None else bisect_left(times, start)
+        last = len(times) if end is None else bisect_right(times, end)
+
+        if first >= last:
+            return []
+
+        means = self.ordered(self.means)
+        minimums = self.ordered(self.minimums)
+        maximums = self.ordered(self.maximums)
+
+        return [[times[i], means[i], minimums[i], maximums[i]] for i in range(first, last)]
+
+    def __len__(self):
+        return self.count
+
+class Bucket:
+    __slots__ = ('start', 'total', 'count', 'minimum', 'maximum')
+
+    def __init__(self, start):
+        self.start = start
+        self.total = 0.0
+        self.count = 0
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+
+    def add(self, mean, minimum, maximum, weight=1):
+        self.total += mean * weight
+        self.count += weight
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+class TimeSeries:
+    def __init__(self, name, resolutions=RESOLUTIONS):
+        self.name = name
+        self.lock = threading.Lock()
+        self.resolutions = [(resolution, step, RingBuffer(capacity)) for resolution, step, capacity in resolutions]
+        self.buckets = [None] * len(self.resolutions)
+
+    def record(self, value, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        value = float(value)
+
+        with self.lock:
+            self.add(0, timestamp, value, value, value, 1)
+
+    def add(self, level, timestamp, mean, minimum, maximum, weight):
+        resolution, step, buffer = self.resolutions[level]
+
+        if step is None:
+            buffer.append(timestamp, mean, minimum, maximum)
+        else:
+            start = timestamp - timestamp % step
+            bucket = self.buckets[level]
+
+            if bucket is not None and bucket.start != start:
+                self.close(level, bucket)
+                bucket = None
+
+            if bucket is None:
+                bucket = self.buckets[level] = Bucket(start)
+
+            bucket.add(mean, minimum, maximum, weight)
+
+        if level + 1 < len(self.resolutions):
+            self.add(level + 1, timestamp, mean, minimum, maximum, weight)
+
+    def close(self, level, bucket):
+        self.resolutions[level][2].append(bucket.start, bucket.total / bucket.count, bucket.minimum, bucket.maximum)
+
+    def window(self, resolution='raw', start=None, end=None):
+        """ Returns [time, mean, min, max] points of resolution between start and end, the open bucket included """
+
+        with self.lock:
+            for level, (name, step, buffer) in enumerate(self.resolutions):
+                if name != resolution:
+                    continue
+
+                points = buffer.window(start, end)
+                bucket = self.buckets[level]
+
+                if bucket is not None and (start is None or bucket.start >= start) and (end is None or bucket.start <= end):
+                    points.append([bucket.start, bucket.total / bucket.count, bucket.minimum, bucket.maximum])
+
+                return points
+
+        raise Exception('Unknown resolution ' + str(resolution))
+
+    def to_dict(self, resolution='raw', start=None, end=None):
+        return {
+            'name': self.name,
+            'resolution': resolution,
+            'columns': ['time', 'mean', 'min', 'max'],
+            'points': self.window(resolution, start, end)
+        }
+
+class TimeSeriesRegistry:
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = resolutions
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def get(self, name, create=True):
+        with self.lock:
+            series = self.series.get(name)
+
+            if series is None and create:
+                series = self.series[name] = TimeSeries(name, self.resolutions)
+
+            return series
+
+    def record(self, name, value, timestamp=None):
+        self.get(name).record(value, timestamp)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.series)
+
+health = TimeSeriesRegistry()
@@ -0,0 +1,149 @@
+"""
+Tracing
+
+Lightweight spans along the command path. A trace keeps per span name
+totals rather than every span, so tracing a command that reads hundreds of
+frames stays cheap:
+
+    run_command -> handler -> controller function -> serial send/receive
+ """
+
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import threading
+
+from contextlib import contextmanager
+
+local = threading.local()
+
+class Frame:
+    __slots__ = ('trace', 'name', 'start', 'child_time')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = time.perf_counter()
+        self.child_time = 0.0
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.duration = None
+
+    def record(self, name, duration, own):
+        with self.lock:
+            entry = self.totals.get(name)
+
+            if entry is None:
+                entry = self.totals[name] = [0, 0.0, 0.0]
+
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] += own
+
+    def to_dict(self):
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: item[1][2], reverse=True)
+
+        return {
+            'name': self.name,
+            'duration': milliseconds(self.duration),
+            'spans': [{ 'name': name, 'count': count, 'total': milliseconds(total), 'self': milliseconds(own) } for name, (count, total, own) in totals]
+        }
+
+@contextmanager
+def trace(name):
+    result = Trace(name)
+    root = Frame(result, name)
+    previous = getattr(local, 'stack', None)
+    local.stack = [root]
+
+    try:
+        yield result
+    finally:
+        local.stack = previous
+        result.duration = time.perf_counter() - root.start
+        result.record(name, result.duration, result.duration - root.child_time)
+
+@contextmanager
+def span(name):
+    stack = getattr(local, 'stack', None)
+
+    if not stack:
+        yield
+        return
+
+    parent = stack[-1]
+    frame = Frame(parent.trace, name)
+    stack.append(frame)
+
+    try:
+        yield
+    finally:
+        stack.pop()
+        duration = time.perf_counter() - frame.start
+
+        frame.trace.record(name, duration, duration - frame.child_time)
+        parent.child_time += duration
+
+def current():
+    stack = getattr(local, 'stack', None)
+
+    return stack[-1] if stack else None
+
+@contextmanager
+def attach(frame):
+    previous = getattr(local, 'stack', None)
+
+    # The thread gets a frame of its own under the same trace, child time is
+    # only ever added up by the thread that owns the frame, so work running
+    # in parallel on other threads does not eat into the parent's self time
+    local.stack = None if frame is None else [Frame(frame.trace, frame.name)]
+
+    try:
+        yield
+    finally:
+        local.stack = previous
+
+@contextmanager
+def profile(directory=None, name='command', limit=30):
+    profiler = cProfile.Profile()
+    result = {}
+
+    profiler.enable()
+
+    try:
+        yield result
+    finally:
+        profiler.disable()
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        result['stats'] = output.getvalue()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            path = dump_path(directory, name)
+            profiler.dump_stats(path)
+            result['dump'] = path
+
+def dump_path(directory, name):
+    """ Returns where the profile of name goes, name comes from the request and is never trusted as a path """
+
+    directory = os.path.realpath(directory)
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(name)).lstrip('.') or 'command'
+    path = os.path.realpath(os.path.join(directory, name + '-' + time.strftime('%Y%m%d-%H%M%S') + '.prof'))
+
+    if os.path.dirname(path) != directory:
+        raise Exception('Profile path ' + path + ' is outside of ' + directory)
+
+    return path
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
@@ -1,20 +1,250 @@
 import time
+import random
 import logging
 import traceback
+import threading
 
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from app.core.metrics import registry
+
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        self.message = "Circuit breaker '" + str(name) + "' is open, calls are rejected until it cools down"
+        super().__init__(self.message)
+
+class RetryStatistics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+statistics = RetryStatistics()
+
+resilience_events = registry.counter('cultiva_resilience_events_total', 'Retry attempts, retries, failures, breaker trips and controller resets', ['event'])
+
+def collect_statistics():
+    for name, value in statistics.snapshot().items():
+        resilience_events.set_total(value, name)
+
+registry.add_collector(collect_statistics)
+
+class RetryPolicy:
+    def __init__(self, name='default', attempts=3, budget=None, base_delay=0.5, max_delay=5, jitter=0.5, give_up_on=(), attempt_timeout=0):
+        self.name = name
+        self.attempts = attempts
+        self.budget = budget
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.give_up_on = (CircuitOpenError,) + tuple(give_up_on)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, func, args, kwargs, breaker=None):
+        deadline = None if self.budget is None else time.monotonic() + self.budget
+        outer_deadline = getattr(call_deadline, 'value', None)
+
+        if outer_deadline is not None:
+            deadline = outer_deadline if deadline is None else min(deadline, outer_deadline)
+
+        call_deadline.value = deadline
+
+        try:
+            return self.attempt(func, args, kwargs, breaker, deadline)
+        finally:
+            call_deadline.value = outer_deadline
+
+    def attempt(self, func, args, kwargs, breaker, deadline):
+        for i in range(self.attempts):
+            if breaker is not None:
+                breaker.before_call()
+
+            statistics.increment(self.name + '.attempts')
 
-def retry(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        retExc = None
-        for i in range(3):
             try:
-                return func(*args, **kwargs)
+                result = func(*args, **kwargs)
+
+                if breaker is not None:
+                    breaker.record_success()
+
+                return result
+            except self.give_up_on:
+                statistics.increment(self.name + '.failures')
+                raise
             except Exception as e:
-                retExc = e
                 logging.error(traceback.format_exc())
-                logging.info('Retrying in ' + str(0.5 * i) + ' seconds')
-                time.sleep(0.5 * i)
-        raise retExc
-    return wrapper
\ No newline at end of file
+
+                if breaker is not None:
+                    breaker.record_error(e)
+
+                delay = self.backoff(i)
+                last_attempt = i == self.attempts - 1
+
+                # Another attempt only starts if it can still run to its own
+                # timeout before the budget is spent
+                if not last_attempt and deadline is not None and time.monotonic() + delay + self.attempt_timeout >= deadline:
+                    statistics.increment(self.name + '.budget_exhausted')
+                    last_attempt = True
+
+                if last_attempt:
+                    statistics.increment(self.name + '.failures')
+                    raise
+
+                statistics.increment(self.name + '.retries')
+                logging.info('Retrying in ' + str(round(delay, 2)) + ' seconds')
+                time.sleep(delay)
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, cooldown=30, on_trip=None, ignore=()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_trip = on_trip
+        self.ignore = tuple(ignore)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+
+            return 'halfOpen' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def before_call(self):
+        if self.state() == 'open':
+            raise CircuitOpenError(self.name)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_error(self, error):
+        """ Counts error as a failure unless it is one of the errors the breaker ignores """
+
+        if not isinstance(error, self.ignore):
+            self.record_failure()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            tripped = self.failures >= self.failure_threshold and (self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown)
+
+            if tripped:
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+        if tripped:
+            statistics.increment('breaker_trips')
+            logging.error("Circuit breaker '" + str(self.name) + "' tripped after " + str(self.failures) + ' failures')
+
+            if self.on_trip is not None:
+                self.on_trip()
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = Future()
+                self.calls[key] = future
+
+        if not leader:
+            statistics.increment('single_flight.shared')
+            return future.result()
+
+        try:
+            result = func()
+        except Exception as e:
+            self.forget(key)
+            future.set_exception(e)
+            raise
+
+        self.forget(key)
+        future.set_result(result)
+
+        return result
+
+    def forget(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+
+class TtlCache:
+    def __init__(self, ttl, max_entries=128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, max_age=None):
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or time.monotonic() - entry[0] > max_age:
+                return False, None
+
+            self.entries.move_to_end(key)
+
+            return True, entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+call_deadline = threading.local()
+
+def remaining_budget():
+    deadline = getattr(call_deadline, 'value', None)
+
+    if deadline is None:
+        return None
+
+    return max(0, deadline - time.monotonic())
+
+default_policy = RetryPolicy()
+
+def retry(func=None, policy=None, breaker=None):
+    policy = policy or default_policy
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return policy.call(func, args, kwargs, None if breaker is None else breaker(*args, **kwargs))
+        return wrapper
+
+    if func is not None:
+        return decorate(func)
+
+    return decorate
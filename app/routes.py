@@ -0,0 +1,95 @@
+""" Command, Job and Metrics Routes """
+
+from flask import Blueprint, current_app, request, jsonify, abort
+
+from app.core.command import run_command
+from app.core.log import Logger
+from app.core import metrics
+
+routes_bp = Blueprint('routes', __name__)
+
+@routes_bp.route('/run', methods = ['GET','POST'])
+def run():
+    arguments = request.args.getlist('arguments')
+
+    if request.method == 'POST':
+        arguments = [request.get_json(silent=True)]
+
+    trace = request.args.get('trace') == 'true'
+    profile = request.args.get('profile') == 'true'
+
+    if request.args.get('async') == 'true':
+        job = current_app.extensions['JOBS'].submit(request.args.get('command'), arguments, trace=trace, profile=profile)
+        return jsonify({ 'success': True, 'result': job.to_dict() }), 202
+
+    app = current_app._get_current_object()
+    logger = Logger('CommandRunner', app)
+    result = run_command(app, logger, request.args.get('command'), arguments, trace, profile)
+    return jsonify(result)
+
+@routes_bp.route('/metrics', methods = ['GET'])
+def export_metrics():
+    return metrics.registry.render(), 200, { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8' }
+
+@routes_bp.route('/jobs', methods = ['GET'])
+def list_jobs():
+    return jsonify([job.to_dict() for job in current_app.extensions['JOBS'].list()])
+
+@routes_bp.route('/jobs/<job_id>', methods = ['GET', 'DELETE'])
+def job_status(job_id):
+    jobs = current_app.extensions['JOBS']
+    job = jobs.cancel(job_id) if request.method == 'DELETE' else jobs.get(job_id)
+
+    if job is None:
+        return jsonify({ 'success': False, 'result': "Job '" + job_id + "' not found" }), 404
+
+    return jsonify(job.to_dict(output=True))
+
+@routes_bp.route('/')
+def index_client():
+    return send_asset('index.html')
+
+@routes_bp.route('/favicon.ico')
+def favicon():
+    return send_asset('favicon.ico')
+
+@routes_bp.route('/static/<path:filename>')
+def static(filename):
+    return send_asset('static/' + filename)
+
+def send_asset(filename):
+    response = current_app.extensions['ASSETS'].response(filename, request)
+
+    if response is None:
+        abort(404)
+
+    return response
+
+def register_socket_handlers(socket, app):
+    @socket.on('connect')
+    def handle_connect():
+        app.extensions['LOG_STREAM'].replay(request.sid)
+
+    @socket.on('disconnect')
+    def handle_disconnect():
+        if app.extensions.created('LOG_STREAM'):
+            app.extensions['LOG_STREAM'].remove(request.sid)
+
+    @socket.on('command')
+    def handle_event(command, methods=['GET', 'POST']):
+        arguments = command['input'].replace(command['type'], '').strip().split()
+        job = app.extensions['JOBS'].submit(command['type'], [ arguments[0] if len(arguments) > 0 else None ], [request.sid], command.get('trace', False), command.get('profile', False))
+        socket.emit('job', job.to_dict(), room=request.sid)
+
+    @socket.on('subscribe')
+    def handle_subscribe(job_id):
+        job = app.extensions['JOBS'].get(job_id)
+
+        if job is not None:
+            job.subscribers.add(request.sid)
+            socket.emit('job', job.to_dict(), room=request.sid)
+            app.extensions['LOG_STREAM'].replay(request.sid, job.output)
+
+    @socket.on('cancel')
+    def handle_cancel(job_id):
+        app.extensions['JOBS'].cancel(job_id)
@@ -0,0 +1,157 @@
+"""
+Services
+
+The application's extensions, created the first time they are looked up in
+app.extensions rather than when the app is created. Importing the app and
+serving a request that never touches the controllers, the job runner or the
+scheduler therefore neither opens a port nor starts a thread.
+ """
+
+import copy
+import atexit
+import threading
+
+class Extensions(dict):
+    def __init__(self, app, extensions=None):
+        super().__init__(extensions or {})
+        self.app = app
+        self.lock = threading.RLock()
+
+    def __missing__(self, key):
+        factory = FACTORIES.get(key)
+
+        if factory is None:
+            raise KeyError(key)
+
+        with self.lock:
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+
+            value = factory(self.app)
+            self[key] = value
+
+            return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def created(self, key):
+        return dict.__contains__(self, key)
+
+def create_ownership(app):
+    from app.core.ownership import Ownership
+
+    ownership = Ownership(app.config['HARDWARE_OWNER'], app.config['OWNER_LOCK_FILE'])
+    atexit.register(ownership.release)
+
+    return ownership
+
+def create_irrigation_connection(app):
+    from app.irrigation.module import IrrigationControllerConnectionProvider
+
+    return IrrigationControllerConnectionProvider(app.extensions['OWNERSHIP'].is_owner())
+
+def create_log_stream(app):
+    from app.core.log import LogStream
+
+    socket = app.extensions['socketio']
+    log_stream = LogStream(lambda event, data, sid: socket.emit(event, data, room=sid), app.config['LOG_STREAM_INTERVAL'], app.config['LOG_STREAM_MAX_BATCH'], app.config['LOG_STREAM_MAX_PENDING'], app.config['LOG_STREAM_REPLAY'])
+    atexit.register(log_stream.close)
+
+    return log_stream
+
+def create_jobs(app):
+    from app.core.jobs import JobRunner
+
+    def job_output(job, message):
+        app.extensions['LOG_STREAM'].write(message, list(job.subscribers))
+
+    def job_finished(job):
+        log_stream = app.extensions['LOG_STREAM']
+        log_stream.write(job.result, list(job.subscribers))
+        log_stream.send('result', job.status == 'succeeded', list(job.subscribers))
+
+    jobs = JobRunner(app, app.config['JOB_WORKERS'], app.config['JOB_HISTORY'], job_output, job_finished)
+    atexit.register(jobs.shutdown)
+
+    return jobs
+
+def create_scheduler(app):
+    from flask_apscheduler import APScheduler
+
+    # APScheduler consumes the executor options it is given, so every app
+    # gets its own copy of the class level defaults
+    for key in ['SCHEDULER_EXECUTORS', 'SCHEDULER_JOB_DEFAULTS']:
+        app.config[key] = copy.deepcopy(app.config[key])
+
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+
+    if app.extensions['OWNERSHIP'].is_owner():
+        scheduler.start()
+        atexit.register(lambda: scheduler.shutdown(wait=False) if scheduler.running else None)
+
+    return scheduler
+
+def create_programmes(app):
+    from app.core.scheduling import ProgrammeScheduler
+
+    programmes = ProgrammeScheduler(app.extensions['SCHEDULER'], app)
+
+    if app.config['SCHEDULE_PROGRAMMES'] and app.extensions['OWNERSHIP'].is_owner():
+        programmes.add('irrigation', 'runIrrigationProgramme', app.config['IRRIGATION_INTERVAL'], priority=10, jitter=1)
+        programmes.add('sentinel', 'runSentinel', app.config['SENTINEL_INTERVAL'], priority=0, jitter=5)
+
+    return programmes
+
+def create_assets(app):
+    from app.core.assets import AssetCache
+
+    return AssetCache(app.config['DIST_DIR'], app.config['ASSET_MIN_SIZE'])
+
+def create_outbox(app):
+    from app.core.hub import get_hub_client
+    from app.core.outbox import AlertOutbox
+    from app.core.sentinel import SentinelRepository
+
+    config = app.config
+
+    with app.app_context():
+        repository = SentinelRepository()
+
+    client = get_hub_client(config['HUB_ADDRESS'], config['NODE_ID'], config['HUB_BATCH_SIZE'], config['HUB_PARALLELISM'], config['HUB_TIMEOUT'])
+    outbox = AlertOutbox(repository, client, config['OUTBOX_MAX_IN_FLIGHT'], config['OUTBOX_DRAIN_RATE'], config['OUTBOX_BASE_DELAY'], config['OUTBOX_MAX_DELAY'])
+
+    if app.extensions['OWNERSHIP'].is_owner():
+        outbox.start()
+        atexit.register(outbox.stop)
+
+    return outbox
+
+FACTORIES = {
+    'ASSETS': create_assets,
+    'OWNERSHIP': create_ownership,
+    'IRRIGATION_CONNECTION': create_irrigation_connection,
+    'LOG_STREAM': create_log_stream,
+    'JOBS': create_jobs,
+    'SCHEDULER': create_scheduler,
+    'PROGRAMMES': create_programmes,
+    'OUTBOX': create_outbox
+}
+
+def start_background_services(app):
+    """ Starts the scheduler, its programmes and the alert outbox in the process that owns the hardware """
+
+    if not app.extensions['OWNERSHIP'].is_owner():
+        return False
+
+    app.extensions['PROGRAMMES']
+
+    # Alerts persisted before a restart are delivered right away rather
+    # than when a sentinel run first finds the internet up
+    app.extensions['OUTBOX']
+
+    return True
@@ -0,0 +1,139 @@
+"""
+Serial layer microbenchmarks
+
+Runs every command function in app.core.controller against the virtual
+controller and reports round-trip latency, throughput and CPU time per
+command. reset_connection is left out, it reopens the link rather than
+sending a command:
+
+    python -m benchmarks.controller_benchmark --iterations 200 --latency 5
+ """
+
+import sys
+import time
+import logging
+import argparse
+import subprocess
+
+from app.core.serial import SerialConnection
+from app.core.controller import open_ports, close_ports, read_sensors, run_command, heartbeat, read_sensors_async, ControllerTransaction
+
+class BenchmarkLogger:
+    def __init__(self):
+        self.default_logger = logging.getLogger('Benchmark')
+
+    def log(self, message, pad_top=False, pad_bottom=False):
+        self.default_logger.debug(message)
+
+    def warning(self, message, pad_top=False, pad_bottom=False):
+        self.default_logger.warning(message)
+
+    def error(self, message, pad_top=False, pad_bottom=False):
+        self.default_logger.error(message)
+
+def start_simulator(arguments):
+    process = subprocess.Popen([
+        sys.executable, '-m', 'app.core.simulator',
+        '--latency', str(arguments.latency),
+        '--jitter', str(arguments.jitter),
+        '--drop-rate', str(arguments.drop_rate),
+        '--garbage-rate', str(arguments.garbage_rate),
+        '--baud-rate', str(arguments.baud_rate),
+        '--seed', '1'
+    ], stdout=subprocess.PIPE, universal_newlines=True)
+
+    return process, process.stdout.readline().strip()
+
+def percentile(samples, percentage):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percentage / 100.0 * (len(ordered) - 1))))]
+
+def measure(name, iterations, call, commands_per_call=1):
+    samples = []
+    failures = 0
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    for i in range(iterations):
+        start = time.perf_counter()
+
+        try:
+            call()
+        except Exception:
+            failures += 1
+
+        samples.append((time.perf_counter() - start) * 1000)
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    commands = iterations * commands_per_call
+
+    return {
+        'name': name,
+        'p50': percentile(samples, 50),
+        'p99': percentile(samples, 99),
+        'throughput': commands / wall,
+        'cpu': cpu * 1000 / commands,
+        'failures': failures
+    }
+
+def pipelined(connection, logger, depth):
+    def call():
+        futures = [read_sensors_async(connection, ['A:1', 'A:2', 'A:3'], logger) for i in range(depth)]
+
+        for future in futures:
+            future.result()
+
+    return call
+
+def report(results):
+    print('{:<34}{:>10}{:>10}{:>12}{:>12}{:>10}'.format('function', 'p50 ms', 'p99 ms', 'cmd/s', 'cpu ms/cmd', 'failed'))
+
+    for result in results:
+        print('{:<34}{:>10.2f}{:>10.2f}{:>12.1f}{:>12.3f}{:>10}'.format(result['name'], result['p50'], result['p99'], result['throughput'], result['cpu'], result['failures']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial layer microbenchmarks')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated controller latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='simulated controller jitter in milliseconds')
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--garbage-rate', type=float, default=0.0)
+    parser.add_argument('--baud-rate', type=int, default=9600, help='simulated controller line speed')
+    parser.add_argument('--protocol', default='json', choices=['json', 'binary'], help='wire protocol negotiated with the controller')
+    parser.add_argument('--depth', type=int, default=8, help='commands in flight for the pipelined run')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    process, port = start_simulator(arguments)
+    logger = BenchmarkLogger()
+
+    try:
+        connection = SerialConnection(None, None, logger, port=port, protocol=arguments.protocol)
+        sensors = ['A:1', 'A:2', 'A:3']
+
+        results = [
+            measure('open_ports', arguments.iterations, lambda: open_ports(connection, [3, 4], logger)),
+            measure('close_ports', arguments.iterations, lambda: close_ports(connection, [3, 4], logger)),
+            measure('read_sensors', arguments.iterations, lambda: read_sensors(connection, sensors, logger, max_age=0)),
+            measure('run_command', arguments.iterations, lambda: run_command(connection, 'ping()', logger)),
+            measure('heartbeat', arguments.iterations, lambda: heartbeat(connection, logger)),
+            measure('transaction(open, read, close)', arguments.iterations, lambda: ControllerTransaction(connection, logger).open_ports([3]).read_sensors(sensors).close_ports([3]).commit(), 3)
+        ]
+
+        connection.start_multiplexer()
+
+        results.append(measure('read_sensors_async x' + str(arguments.depth), arguments.iterations, pipelined(connection, logger, arguments.depth), arguments.depth))
+
+        connection.stop_multiplexer()
+        connection.close()
+
+        report(results)
+    finally:
+        process.terminate()
+        process.wait()
+
+if __name__ == '__main__':
+    main()
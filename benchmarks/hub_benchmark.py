@@ -0,0 +1,72 @@
+"""
+Hub delivery benchmark
+
+Drains a backlog of alerts into the stub hub, once with a fresh connection
+and one post per alert (the previous delivery path) and once with batched,
+pooled delivery:
+
+    python -m benchmarks.hub_benchmark --alerts 1000 --latency 20
+ """
+
+import time
+import argparse
+
+import requests
+
+from app.core.hub import HubClient
+from app.core.stub_hub import StubHub
+
+def make_alerts(count):
+    return [{ 'id': str(i), 'key': 'SensorStatusChanged(sensorId: ' + str(i) + ')', 'time': '2021-03-02T11:11:37', 'type': 'SensorStatusChanged', 'severity': 2, 'properties': '{"sensorName":"moisture","status":"overUpperAlertBound","measuredValue":100}' } for i in range(count)]
+
+def one_by_one(address, alerts):
+    acknowledged = 0
+
+    for alert in alerts:
+        payload = alert.copy()
+        payload.pop('id', None)
+
+        response = requests.post(address + '/api/notifications?nodeId=2', json=payload, verify=False, headers={ 'Connection': 'close' })
+        acknowledged += 1 if response.ok else 0
+
+    return acknowledged
+
+def batched(address, alerts, batch_size, parallelism):
+    client = HubClient(address, 2, batch_size, parallelism)
+
+    try:
+        return len(client.send_alerts(alerts))
+    finally:
+        client.close()
+
+def measure(name, hub, call):
+    hub.requests = 0
+    hub.connections = set()
+    start = time.perf_counter()
+    acknowledged = call()
+    elapsed = time.perf_counter() - start
+
+    print('{:<28}{:>10.1f}{:>12.1f}{:>10}{:>13}{:>8}'.format(name, elapsed * 1000, acknowledged / elapsed, hub.requests, len(hub.connections), acknowledged))
+
+def main():
+    parser = argparse.ArgumentParser(description='Hub delivery benchmark')
+    parser.add_argument('--alerts', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=20.0, help='stub hub latency per request in milliseconds')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--parallelism', type=int, default=2)
+    arguments = parser.parse_args()
+
+    hub = StubHub(latency=arguments.latency)
+    address = hub.start()
+    alerts = make_alerts(arguments.alerts)
+
+    print('{:<28}{:>10}{:>12}{:>10}{:>13}{:>8}'.format('delivery', 'ms', 'alerts/s', 'requests', 'connections', 'acked'))
+
+    try:
+        measure('one post per alert', hub, lambda: one_by_one(address, alerts))
+        measure('batched x' + str(arguments.batch_size) + ', ' + str(arguments.parallelism) + ' in flight', hub, lambda: batched(address, alerts, arguments.batch_size, arguments.parallelism))
+    finally:
+        hub.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Startup benchmark
+
+Measures, each in a fresh interpreter, what a web worker pays before it can
+serve: importing the app package, creating the app and serving the first
+request. Also reports the modules loaded and threads running afterwards:
+
+    python -m benchmarks.import_benchmark --iterations 10
+ """
+
+import sys
+import json
+import argparse
+import subprocess
+
+from benchmarks.controller_benchmark import percentile
+
+STAGES = '''
+import sys
+import json
+import time
+import threading
+
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({ 'TESTING': True })
+created = time.perf_counter()
+response = application.test_client().get('/run?command=ping')
+served = time.perf_counter()
+
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'create_app': (created - imported) * 1000,
+    'first_request': (served - created) * 1000,
+    'status': response.status_code,
+    'modules': len(sys.modules),
+    'threads': threading.active_count()
+}))
+'''
+
+IMPORT_ONLY = '''
+import sys
+import json
+import threading
+
+import app
+
+print(json.dumps({ 'modules': len(sys.modules), 'threads': threading.active_count(), 'flask': 'flask' in sys.modules }))
+'''
+
+def run(source):
+    output = subprocess.run([sys.executable, '-c', source], stdout=subprocess.PIPE, check=True).stdout
+
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark')
+    parser.add_argument('--iterations', type=int, default=5)
+    arguments = parser.parse_args()
+
+    samples = [run(STAGES) for i in range(arguments.iterations)]
+
+    print('{:<16}{:>10}{:>10}'.format('stage', 'p50 ms', 'max ms'))
+
+    for stage in ['import', 'create_app', 'first_request']:
+        values = [sample[stage] for sample in samples]
+        print('{:<16}{:>10.1f}{:>10.1f}'.format(stage, percentile(values, 50), max(values)))
+
+    imported = run(IMPORT_ONLY)
+
+    print()
+    print('after import:        ' + str(imported['modules']) + ' modules, ' + str(imported['threads']) + ' threads, flask imported: ' + str(imported['flask']))
+    print('after first request: ' + str(samples[-1]['modules']) + ' modules, ' + str(samples[-1]['threads']) + ' threads')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 import os
-from app import app
+from app import create_app, start_background_services
+
+app = create_app()
+start_background_services(app)
 
 app.run(host= '0.0.0.0', port=8000)
 
@@ -1,11 +1,14 @@
 """ pytests for Flask """
 
 import pytest
-from app import app
+from app import create_app
 
 @pytest.fixture(scope="module")
-def client():
-    app.config['TESTING'] = True
+def app():
+    return create_app({ 'TESTING': True })
+
+@pytest.fixture(scope="module")
+def client(app):
     return app.test_client()
 
 def test_api(client):
@@ -34,7 +37,7 @@ def test_secure_resource_pass(client):
     assert resp.status_code == 200
 
 @pytest.fixture(scope="module")
-def request_context():
+def request_context(app):
     return app.test_request_context('')
 
 def test_session(request_context):
@@ -0,0 +1,67 @@
+""" pytests for the app factory and its lazy services """
+
+import sys
+import json
+import subprocess
+
+from app import create_app, start_background_services
+from app import services
+from app.core.ownership import ProcessLock, Ownership
+
+
+def test_import_has_no_side_effects():
+    source = 'import sys, json, threading, app; print(json.dumps([threading.active_count(), "flask" in sys.modules, "serial" in sys.modules]))'
+    output = subprocess.run([sys.executable, '-c', source], stdout=subprocess.PIPE, check=True).stdout
+
+    assert json.loads(output.decode().strip()) == [1, False, False]
+
+def test_services_are_created_on_first_use(tmp_path):
+    app = create_app({ 'TESTING': True, 'OWNER_LOCK_FILE': str(tmp_path / 'owner.lock') })
+
+    for key in ['OWNERSHIP', 'IRRIGATION_CONNECTION', 'LOG_STREAM', 'JOBS', 'SCHEDULER', 'PROGRAMMES']:
+        assert not app.extensions.created(key)
+
+    assert app.test_client().get('/run?command=ping').get_json()['result'] == 'pong'
+    assert not app.extensions.created('JOBS')
+
+    jobs = app.extensions['JOBS']
+    assert app.extensions['JOBS'] is jobs
+    assert app.extensions.get('MISSING') is None
+
+    jobs.shutdown()
+
+def test_only_one_process_owns_the_hardware(tmp_path):
+    path = str(tmp_path / 'owner.lock')
+    first = Ownership('auto', path)
+    source = 'from app.core.ownership import Ownership; print(Ownership("auto", ' + repr(path) + ').is_owner())'
+
+    assert first.is_owner()
+    assert subprocess.run([sys.executable, '-c', source], stdout=subprocess.PIPE, check=True).stdout.decode().strip() == 'False'
+
+    first.release()
+    assert subprocess.run([sys.executable, '-c', source], stdout=subprocess.PIPE, check=True).stdout.decode().strip() == 'True'
+
+def test_owner_can_be_forced(tmp_path):
+    lock = ProcessLock(str(tmp_path / 'owner.lock'))
+    assert lock.acquire()
+
+    assert Ownership('true', lock.path).is_owner()
+    assert not Ownership('false', lock.path).is_owner()
+
+    lock.release()
+
+def test_scheduler_only_starts_in_the_owner(tmp_path):
+    app = create_app({ 'HARDWARE_OWNER': 'false', 'SCHEDULE_PROGRAMMES': True })
+
+    assert not app.extensions['SCHEDULER'].running
+    assert app.extensions['PROGRAMMES'].jobs == {}
+
+def test_background_services_start_the_outbox(monkeypatch):
+    monkeypatch.setitem(services.FACTORIES, 'OUTBOX', lambda app: 'outbox')
+    app = create_app({ 'HARDWARE_OWNER': 'true', 'SCHEDULE_PROGRAMMES': False })
+
+    try:
+        assert start_background_services(app)
+        assert app.extensions.created('OUTBOX')
+    finally:
+        app.extensions['SCHEDULER'].shutdown(wait=False)
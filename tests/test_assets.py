@@ -0,0 +1,83 @@
+""" pytests for in-memory static asset serving """
+
+import os
+import gzip
+import pytest
+
+from app import create_app
+from app.core.assets import AssetCache, IMMUTABLE, REVALIDATE, compress_gzip
+
+
+SCRIPT = b'function cultiva() { return "node"; }\n' * 100
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'static' / 'js' / 'app.84f0ce1b.js').write_bytes(SCRIPT)
+    (tmp_path / 'static' / 'logo.png').write_bytes(b'\x89PNG' + b'\x00' * 1000)
+    (tmp_path / 'index.html').write_text('<html>' + ' ' * 1000 + '</html>')
+    (tmp_path / 'secret.txt').write_text('secret')
+
+    app = create_app({ 'TESTING': True, 'DIST_DIR': str(tmp_path) })
+
+    return app.test_client()
+
+
+def test_hashed_assets_are_compressed_and_immutable(client):
+    response = client.get('/static/js/app.84f0ce1b.js', headers={ 'Accept-Encoding': 'gzip, deflate' })
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == IMMUTABLE
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert 'javascript' in response.headers['Content-Type']
+    assert gzip.decompress(response.data) == SCRIPT
+
+def test_identity_variant_has_its_own_etag(client):
+    plain = client.get('/static/js/app.84f0ce1b.js')
+    compressed = client.get('/static/js/app.84f0ce1b.js', headers={ 'Accept-Encoding': 'gzip' })
+
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == SCRIPT
+    assert plain.headers['ETag'] != compressed.headers['ETag']
+
+def test_conditional_requests_get_304(client):
+    first = client.get('/')
+    assert first.headers['Cache-Control'] == REVALIDATE
+
+    response = client.get('/', headers={ 'If-None-Match': first.headers['ETag'] })
+
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == first.headers['ETag']
+
+def test_binary_files_are_not_compressed(client):
+    response = client.get('/static/logo.png', headers={ 'Accept-Encoding': 'gzip' })
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Type'] == 'image/png'
+
+def test_missing_and_escaping_paths_are_404(client):
+    assert client.get('/static/js/missing.js').status_code == 404
+    assert client.get('/static/../../etc/passwd').status_code == 404
+
+def test_gzip_variants_are_deterministic():
+    compressed = compress_gzip(SCRIPT)
+
+    assert compressed[4:8] == b'\x00\x00\x00\x00'
+    assert gzip.decompress(compressed) == SCRIPT
+
+def test_prebuilt_variants_are_used(tmp_path):
+    (tmp_path / 'app.js').write_bytes(SCRIPT)
+    (tmp_path / 'app.js.gz').write_bytes(b'prebuilt')
+
+    assert AssetCache(str(tmp_path)).get('app.js').variants['gzip'][0] == b'prebuilt'
+
+def test_changed_files_are_reloaded(tmp_path):
+    (tmp_path / 'index.html').write_text('one')
+    cache = AssetCache(str(tmp_path))
+    assert cache.get('index.html').variants['identity'][0] == b'one'
+
+    (tmp_path / 'index.html').write_text('two')
+    os.utime(str(tmp_path / 'index.html'), (1, 1))
+    assert cache.get('index.html').variants['identity'][0] == b'two'
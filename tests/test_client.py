@@ -1,11 +1,11 @@
 """ pytests for Flask """
 
 import pytest
-from app import app
+from app import create_app
 
 @pytest.fixture(scope="module")
 def client():
-    app.config['TESTING'] = True
+    app = create_app({ 'TESTING': True })
     return app.test_client()
 
 def test_api(client):
@@ -0,0 +1,82 @@
+""" pytests for the command registry """
+
+import os
+import sys
+import time
+import pytest
+
+from app.core.command import CommandRegistry, CommandModule, InvalidCommandError
+
+
+HANDLERS = '''
+import itertools
+
+instances = itertools.count()
+
+def shout(arguments, app, logger):
+    return VERSION
+
+class Handlers:
+    def __init__(self):
+        self.instance = next(instances)
+
+    def get_instance(self, arguments, app, logger):
+        return self.instance
+'''
+
+def write_module(path, version):
+    path.write_text('VERSION = ' + repr(version) + '\n' + HANDLERS)
+
+    # Make sure the new source is seen as changed even on coarse mtime filesystems
+    modified = time.time() + version
+    os.utime(str(path), (modified, modified))
+
+@pytest.fixture
+def registry(tmp_path):
+    write_module(tmp_path / 'registry_commands.py', 1)
+    sys.path.insert(0, str(tmp_path))
+
+    yield CommandRegistry([CommandModule('registry_commands'), CommandModule('registry_commands', 'Handlers')])
+
+    sys.path.remove(str(tmp_path))
+    sys.modules.pop('registry_commands', None)
+
+
+def test_lookup_by_snake_and_camel_case(registry):
+    assert registry.get('shout')(None, None, None) == 1
+    assert registry.get('get_instance') == registry.get('getInstance')
+
+def test_lookup_ignores_case(registry):
+    assert registry.get('SHOUT')(None, None, None) == 1
+    assert registry.get('GetInstance') == registry.get('GET_INSTANCE') == registry.get('get_instance')
+
+def test_invalid_commands(registry):
+    for command in ['missing', 'itertools', 'count', None]:
+        with pytest.raises(InvalidCommandError):
+            registry.get(command)
+
+def test_handler_instance_is_reused(registry):
+    first = registry.get('getInstance')(None, None, None)
+    assert registry.get('getInstance')(None, None, None) == first
+
+def test_handler_instances_are_kept_per_app(registry):
+    class App:
+        pass
+
+    first, second = App(), App()
+    instance = registry.get('getInstance', app=first)(None, None, None)
+
+    assert registry.get('getInstance', app=first)(None, None, None) == instance
+    assert registry.get('getInstance', app=second)(None, None, None) != instance
+
+def test_hot_reload_only_when_file_changes(tmp_path, registry):
+    registry.get('shout')
+    module = sys.modules['registry_commands']
+
+    registry.get('shout', hot_reload=True)
+    assert sys.modules['registry_commands'] is module
+
+    write_module(tmp_path / 'registry_commands.py', 2)
+
+    assert registry.get('shout')(None, None, None) == 1
+    assert registry.get('shout', hot_reload=True)(None, None, None) == 2
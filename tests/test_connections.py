@@ -0,0 +1,137 @@
+""" pytests for the multi-controller connection manager """
+
+import time
+
+import pytest
+
+from app.core.connections import ControllerConnectionManager
+from app.core.simulator import VirtualController
+from tests.test_serial import FakeLogger
+
+
+@pytest.fixture
+def simulators():
+    simulators = [VirtualController(latency=50, sensor_value=100 + i) for i in range(2)]
+
+    for simulator in simulators:
+        simulator.start()
+
+    yield simulators
+
+    for simulator in simulators:
+        simulator.stop()
+
+@pytest.fixture
+def manager(simulators):
+    manager = ControllerConnectionManager()
+    manager.discover([
+        {'id': 1, 'name': 'North', 'vendorId': None, 'productId': None, 'device': simulators[0].port},
+        {'id': 2, 'name': 'South', 'vendorId': None, 'productId': None, 'device': simulators[1].port, 'ports': [7, 8]}
+    ], FakeLogger())
+    yield manager
+    manager.close()
+
+
+def test_routes_ports_by_port_map(manager, simulators):
+    manager.open_ports([3, 7, 8], FakeLogger())
+    assert simulators[0].open_ports == {'3'}
+    assert simulators[1].open_ports == {'7', '8'}
+
+def test_transactions_run_per_controller(manager, simulators):
+    results = manager.transaction([3, 7, 8], lambda transaction, ports: transaction.open_ports(ports).read_sensors(['A:' + str(port) for port in ports]), FakeLogger())
+
+    assert sorted(results) == [[None, [100]], [None, [101, 101]]]
+    assert simulators[0].open_ports == {'3'}
+    assert simulators[1].open_ports == {'7', '8'}
+
+def test_failed_transaction_operations_raise(manager):
+    with pytest.raises(Exception, match='Controller transaction failed'):
+        manager.transaction([3], lambda transaction, ports: transaction.run_command('unknown(1)'), FakeLogger())
+
+def test_reads_keep_instruction_order(manager):
+    assert manager.read_sensors(['A:7', 'A:1', 'US:8,9'], FakeLogger()) == [101, 100, 101]
+
+def test_each_controller_has_its_own_connection(manager):
+    manager.read_sensors(['A:1', 'A:7'], FakeLogger())
+
+    for worker in manager.workers.values():
+        assert worker.connection is not None
+
+def test_rediscovery_releases_removed_controllers(manager, simulators):
+    manager.discover([{'id': 1, 'name': 'North', 'vendorId': None, 'productId': None, 'device': simulators[0].port}], FakeLogger())
+    assert list(manager.workers.keys()) == [1]
+    assert manager.worker_for_port(7) == 1
+
+def wait_for_heartbeat(worker):
+    worker.heartbeat_future.exception(5)
+
+def test_keepalive_opens_links_in_the_background(manager):
+    manager.heartbeat(FakeLogger(), 30)
+
+    for worker in manager.workers.values():
+        wait_for_heartbeat(worker)
+        assert worker.connection is not None
+
+def test_heartbeat_records_health_of_idle_links(manager):
+    manager.read_sensors(['A:1'], FakeLogger())
+    worker = manager.worker(1)
+
+    worker.heartbeat(FakeLogger(), 0, 2)
+    wait_for_heartbeat(worker)
+
+    health = manager.health()['1']
+    assert health['status'] == 'healthy'
+    assert health['latency'] is not None
+
+def test_missed_heartbeats_reset_the_link(manager, simulators):
+    manager.read_sensors(['A:1'], FakeLogger())
+    worker = manager.worker(1)
+    simulators[0].drop_rate = 1.0
+
+    for i in range(2):
+        worker.heartbeat(FakeLogger(), 0, 2)
+        wait_for_heartbeat(worker)
+
+    assert worker.health.resets == 1
+
+    simulators[0].drop_rate = 0.0
+    simulators[0].reboot()
+
+    assert worker.connection.wait_until_available(5)
+    assert manager.read_sensors(['A:1'], FakeLogger()) == [100]
+
+class ErrorRecordingLogger(FakeLogger):
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message, *args):
+        self.errors.append(message)
+
+def test_declined_heartbeats_keep_the_link(manager, simulators):
+    manager.read_sensors(['A:1'], FakeLogger())
+    worker = manager.worker(1)
+    commands = []
+    simulators[0].execute = lambda command: commands.append(command) or { 'success': False, 'message': 'Command is not supported' }
+    logger = ErrorRecordingLogger()
+
+    for i in range(3):
+        worker.heartbeat(logger, 0, 2)
+        wait_for_heartbeat(worker)
+
+    assert worker.health.resets == 0
+    assert worker.health.status == 'healthy'
+    assert logger.errors == []
+    assert commands[0]['command'] == 'ping'
+    assert commands[0]['arguments'] == []
+
+def test_slow_heartbeats_time_out_without_the_multiplexer(manager, simulators):
+    manager.read_sensors(['A:1'], FakeLogger())
+    worker = manager.worker(1)
+    simulators[0].latency = 3000
+
+    start = time.monotonic()
+    worker.heartbeat(FakeLogger(), 0, 2)
+    wait_for_heartbeat(worker)
+
+    assert time.monotonic() - start < 2
+    assert worker.health.consecutive_failures == 1
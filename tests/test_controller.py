@@ -0,0 +1,141 @@
+""" pytests for controller transactions """
+
+import json
+import time
+import threading
+
+import pytest
+
+from app.core.controller import ControllerTransaction, run_command, run_command_operation, submit_operation
+from app.core import serial
+from app.core.serial import ControllerBusyError, ControllerResultError, CommandAcknowledgedError
+from tests.test_multiplexer import ReorderingController, connection
+from tests.test_serial import FakeLogger
+
+
+def test_transaction_is_one_round_trip(connection):
+    connection.connection = controller = ReorderingController(1)
+    writes = []
+    write_frame = connection.write_frame
+    connection.write_frame = lambda command: writes.append(command) or write_frame(command)
+
+    results = ControllerTransaction(connection, FakeLogger()) \
+        .open_ports([4]) \
+        .read_sensors(['A:1', 'A:2']) \
+        .close_ports([4]) \
+        .commit()
+
+    assert len(writes) == 1
+    assert results == [
+        {'success': True, 'result': None},
+        {'success': True, 'result': [0, 1]},
+        {'success': True, 'result': None}
+    ]
+
+def test_transaction_reports_failed_operations(connection):
+    connection.connection = ReorderingController(1)
+
+    results = ControllerTransaction(connection, FakeLogger()) \
+        .run_command('fail()') \
+        .close_ports([4]) \
+        .commit()
+
+    assert results[0]['success'] is False
+    assert results[1] == {'success': True, 'result': None}
+
+class BatchlessController(ReorderingController):
+    """ Firmware that does not know the batch command """
+
+    def result(self, command):
+        if command['command'] == 'batch':
+            return '<' + json.dumps({'type': 'result', 'id': command['id'], 'success': False, 'message': "Command 'batch' is not supported"}) + '>'
+
+        return super().result(command)
+
+def test_transaction_falls_back_to_single_commands(connection):
+    connection.connection = controller = BatchlessController(1)
+    writes = []
+    write_frame = connection.write_frame
+    connection.write_frame = lambda command: writes.append(json.loads(command)['command']) or write_frame(command)
+
+    def commit():
+        return ControllerTransaction(connection, FakeLogger()) \
+            .open_ports([4]) \
+            .read_sensors(['A:1', 'A:2']) \
+            .close_ports([4]) \
+            .commit()
+
+    expected = [
+        {'success': True, 'result': None},
+        {'success': True, 'result': [0, 1]},
+        {'success': True, 'result': None}
+    ]
+
+    assert commit() == expected
+    assert writes == ['batch', 'open', 'read', 'close']
+    assert connection.supports_batch is False
+
+    assert commit() == expected
+    assert writes[4:] == ['open', 'read', 'close']
+
+def test_empty_transaction(connection):
+    assert ControllerTransaction(connection, FakeLogger()).commit() == []
+
+class SilentController(ReorderingController):
+    """ Acknowledges commands but never answers them """
+
+    def result(self, command):
+        return ''
+
+def test_submit_without_multiplexer_keeps_to_its_timeout(connection):
+    connection.connection = SilentController(1)
+    start = time.monotonic()
+
+    with pytest.raises(Exception):
+        connection.submit('1', '{"id":"1","command":"ping","arguments":[]}', 0.3).result()
+
+    assert time.monotonic() - start < 0.6
+
+def test_submit_without_multiplexer_gives_up_waiting_for_the_link(connection):
+    connection.connection = ReorderingController(1)
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with connection.lock:
+            locked.set()
+            release.wait(2)
+
+    threading.Thread(target=hold).start()
+    locked.wait(1)
+
+    try:
+        with pytest.raises(ControllerBusyError):
+            connection.submit('1', '{"id":"1","command":"ping","arguments":[]}', 0.1).result()
+
+        with pytest.raises(ControllerBusyError):
+            submit_operation(connection, run_command_operation('ping()'), FakeLogger(), 0.1).result()
+    finally:
+        release.set()
+
+def test_declined_commands_do_not_count_against_the_link(connection):
+    connection.connection = ReorderingController(1)
+
+    for i in range(2):
+        with pytest.raises(ControllerResultError):
+            run_command(connection, 'fail()', FakeLogger())
+
+    assert connection.breaker.failures == 0
+    assert connection.breaker.state() == 'closed'
+
+def test_acknowledged_transaction_is_not_sent_again(connection, monkeypatch):
+    monkeypatch.setattr(serial, 'RESULT_TIMEOUT', 100)
+    connection.connection = SilentController(1)
+    writes = []
+    write_frame = connection.write_frame
+    connection.write_frame = lambda command: writes.append(command) or write_frame(command)
+
+    with pytest.raises(CommandAcknowledgedError):
+        ControllerTransaction(connection, FakeLogger()).open_ports([4]).close_ports([4]).commit()
+
+    assert len(writes) == 1
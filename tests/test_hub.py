@@ -0,0 +1,85 @@
+""" pytests for batched alert delivery to the hub """
+
+import time
+
+import pytest
+
+from app.core.hub import HubClient, HubUnreachableError
+from app.core.stub_hub import StubHub
+
+
+@pytest.fixture
+def hub():
+    hub = StubHub(seed=1)
+    hub.start()
+    yield hub
+    hub.stop()
+
+def alerts(count):
+    return [{ 'id': str(i), 'key': 'Alert(' + str(i) + ')', 'severity': 0 } for i in range(count)]
+
+
+def test_alerts_are_sent_in_batches_over_pooled_connections(hub):
+    client = HubClient(hub.address, 2, batch_size=50, parallelism=2)
+
+    assert client.send_alerts(alerts(500)) == set(str(i) for i in range(500))
+    assert hub.requests == 10
+    assert len(hub.connections) <= 2
+    assert len(hub.alerts) == 500
+
+    client.close()
+
+def test_only_acknowledged_alerts_are_reported(hub):
+    hub.failure_rate = 0.5
+    client = HubClient(hub.address, 2, batch_size=20)
+    acknowledged = client.send_alerts(alerts(200))
+
+    assert 0 < len(acknowledged) < 200
+    assert acknowledged == set(hub.alerts)
+
+    client.close()
+
+def test_falls_back_to_single_posts(hub):
+    hub.supports_batches = False
+    client = HubClient(hub.address, 2, batch_size=10, parallelism=1)
+
+    assert len(client.send_alerts(alerts(15))) == 15
+    assert not client.supports_batches
+    assert hub.requests == 16
+    assert 'id' not in hub.alerts['Alert(3)']
+
+    client.close()
+
+def test_batch_endpoint_is_probed_again(hub):
+    hub.supports_batches = False
+    client = HubClient(hub.address, 2, batch_size=10, parallelism=1, reprobe_interval=0.2)
+
+    client.send_alerts(alerts(5))
+    assert not client.supports_batches
+
+    hub.supports_batches = True
+    hub.requests = 0
+    time.sleep(0.25)
+
+    assert len(client.send_alerts(alerts(5))) == 5
+    assert hub.requests == 1
+    assert client.supports_batches
+
+    client.close()
+
+def test_unreachable_hub_ends_the_round(hub, monkeypatch):
+    address = hub.address
+    hub.stop()
+
+    client = HubClient(address, 2, batch_size=10, parallelism=1, timeout=0.5)
+    posts = []
+    post = client.post_batch
+    monkeypatch.setattr(client, 'post_batch', lambda body: posts.append(body) or post(body))
+
+    with pytest.raises(HubUnreachableError) as error:
+        client.send_alerts(alerts(50))
+
+    assert error.value.acknowledged == set()
+    assert len(posts) == 2
+
+    client.close()
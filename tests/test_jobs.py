@@ -0,0 +1,100 @@
+""" pytests for asynchronous command jobs """
+
+import time
+import threading
+import pytest
+
+from app import create_app
+from app.core import jobs
+from app.core.jobs import Job, JobRunner, check_cancelled
+
+app = create_app()
+
+
+def wait_until_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not job.done() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return job
+
+@pytest.fixture
+def runner():
+    runner = JobRunner(app, max_workers=1, max_jobs=3)
+    yield runner
+    runner.shutdown()
+
+@pytest.fixture
+def blocking(monkeypatch):
+    release = threading.Event()
+
+    def run_command(app, logger, command, arguments, trace=False, profile=False):
+        logger.log('started ' + command)
+
+        while not release.wait(0.01):
+            try:
+                check_cancelled()
+            except Exception as e:
+                return { 'success': False, 'result': str(e) }
+
+        return { 'success': True, 'result': command }
+
+    monkeypatch.setattr(jobs, 'run_command', run_command)
+    yield release
+    release.set()
+
+
+def test_jobs_run_and_report_results(runner):
+    job = wait_until_done(runner.submit('ping', []))
+    assert job.status == 'succeeded'
+    assert job.result == 'pong'
+
+    job = wait_until_done(runner.submit('doesNotExist', []))
+    assert job.status == 'failed'
+
+def test_output_is_streamed(runner, blocking):
+    messages = []
+    runner.on_output = lambda job, message: messages.append((job.id, message))
+
+    job = runner.submit('first', [])
+    blocking.set()
+    wait_until_done(job)
+
+    assert messages == [(job.id, 'started first')]
+    assert list(job.output) == ['started first']
+
+def test_cancel_queued_and_running_jobs(runner, blocking):
+    running = runner.submit('first', [])
+    queued = runner.submit('second', [])
+
+    assert runner.cancel(queued.id).status == 'cancelled'
+    assert wait_until_done(runner.cancel(running.id)).status == 'cancelled'
+
+def test_history_is_bounded(runner):
+    submitted = [wait_until_done(runner.submit('ping', [])) for i in range(5)]
+    assert [job.id for job in runner.list()] == [job.id for job in submitted[-3:]]
+
+def test_endpoints():
+    client = app.test_client()
+
+    response = client.get('/run?command=ping&async=true')
+    assert response.status_code == 202
+
+    job_id = response.get_json()['result']['id']
+    wait_until_done(app.extensions['JOBS'].get(job_id))
+
+    assert client.get('/jobs/' + job_id).get_json()['result'] == 'pong'
+    assert client.delete('/jobs/unknown').status_code == 404
+
+def test_job_cancelled_before_it_starts_running_finishes(runner):
+    finished = []
+    runner.on_finished = finished.append
+
+    job = Job('ping', [])
+    job.cancel_requested.set()
+    runner.run(job, None)
+
+    assert job.status == 'cancelled'
+    assert job.finished is not None
+    assert finished == [job]
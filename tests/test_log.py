@@ -0,0 +1,114 @@
+""" pytests for logging and the socket log stream """
+
+import json
+import logging
+import pytest
+
+from logging.handlers import QueueHandler
+
+from app.core import log
+from app.core.log import Logger, LogStream, JsonFormatter
+
+
+class FakeApp:
+    def __init__(self, level='info'):
+        self.config = {}
+        self.extensions = { 'LOG_LEVEL': level }
+
+@pytest.fixture
+def emitted():
+    return []
+
+@pytest.fixture
+def stream(emitted):
+    stream = LogStream(lambda event, data, recipient: emitted.append((recipient, event, data)), interval=60, max_batch=3, max_pending=5, replay_size=4)
+    yield stream
+    stream.close()
+
+
+def test_lines_are_batched_per_recipient(stream, emitted):
+    for line in ['a', 'b']:
+        stream.write(line, ['one', 'two'])
+
+    stream.flush()
+    assert sorted(emitted) == [('one', 'log', 'a\nb'), ('two', 'log', 'a\nb')]
+
+def test_batches_are_rate_limited(stream, emitted):
+    for line in 'abcd':
+        stream.write(line, ['one'])
+
+    stream.flush()
+    stream.flush()
+    assert emitted == [('one', 'log', 'a\nb\nc'), ('one', 'log', 'd')]
+
+def test_events_keep_their_order(stream, emitted):
+    stream.write('done', ['one'])
+    stream.send('result', True, ['one'])
+
+    stream.flush()
+    assert emitted == [('one', 'log', 'done'), ('one', 'result', True)]
+
+def test_structured_results_reach_the_client_unchanged(stream, emitted):
+    result = { 'zones': { '1': { 'irrigating': True } }, 'x': None }
+
+    stream.write('line 1', ['one'])
+    stream.write(result, ['one'])
+    stream.send('result', True, ['one'])
+
+    stream.flush()
+    assert emitted == [('one', 'log', 'line 1'), ('one', 'log', result), ('one', 'result', True)]
+
+def test_slow_recipients_drop_oldest_lines(stream, emitted):
+    for line in 'abcdefg':
+        stream.write(line, ['one'])
+
+    stream.flush()
+    assert emitted == [('one', 'log', '... 2 lines dropped ...\nc\nd\ne')]
+
+def test_late_recipients_replay_recent_history(stream, emitted):
+    for line in 'abcde':
+        stream.write(line, [])
+
+    stream.replay('late')
+    stream.flush()
+    stream.flush()
+    assert emitted == [('late', 'log', 'b\nc\nd'), ('late', 'log', 'e')]
+
+def test_records_go_through_the_queue():
+    Logger('Queued', FakeApp())
+
+    assert log.listener is not None
+    assert any(isinstance(handler, QueueHandler) for handler in logging.getLogger().handlers)
+
+def test_levels_are_applied_only_when_changed(monkeypatch):
+    app = FakeApp()
+    logger = Logger('Levels', app)
+    applied = []
+
+    monkeypatch.setattr(logger, 'set_log_level', lambda level: applied.append(level) or setattr(logger, 'level', level))
+
+    logger.log('one')
+    logger.log('two')
+    app.extensions['LOG_LEVEL'] = 'error'
+    logger.log('three')
+    logger.log('four')
+
+    assert applied == ['error']
+
+def test_callbacks_receive_lines_below_the_log_level():
+    lines = []
+    logger = Logger('Callbacks', FakeApp('error'), [lines.append])
+
+    logger.log('hidden', True)
+    assert lines == [' ', 'hidden']
+    assert not logger.default_logger.isEnabledFor(logging.INFO)
+
+def test_json_formatter_writes_structured_records():
+    record = logging.LogRecord('Structured', logging.WARNING, __file__, 1, 'Port %s', ('3',), None)
+    record.context = { 'controller': 1 }
+
+    data = json.loads(JsonFormatter().format(record))
+    assert data['logger'] == 'Structured'
+    assert data['level'] == 'WARNING'
+    assert data['message'] == 'Port 3'
+    assert data['context'] == { 'controller': 1 }
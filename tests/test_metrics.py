@@ -0,0 +1,62 @@
+""" pytests for metrics """
+
+from app import create_app
+from app.core.metrics import MetricsRegistry, timed
+
+app = create_app()
+
+
+def test_counters_and_gauges_render():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_events_total', 'Events', ['kind'])
+    gauge = registry.gauge('test_backlog', 'Backlog')
+
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    gauge.set(4)
+
+    text = registry.render()
+    assert '# TYPE test_events_total counter' in text
+    assert 'test_events_total{kind="a"} 3' in text
+    assert 'test_backlog 4' in text
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Latency', ['operation'], buckets=(0.1, 1))
+
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, 'send')
+
+    text = registry.render()
+    assert 'test_seconds_bucket{operation="send",le="0.1"} 2' in text
+    assert 'test_seconds_bucket{operation="send",le="1"} 3' in text
+    assert 'test_seconds_bucket{operation="send",le="+Inf"} 4' in text
+    assert 'test_seconds_count{operation="send"} 4' in text
+    assert 'test_seconds_sum{operation="send"} 2.65' in text
+
+def test_timed_labels_by_function_name():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_function_seconds', 'Latency', ['function'])
+
+    @timed(histogram)
+    def open_ports():
+        return 'opened'
+
+    assert open_ports() == 'opened'
+    assert 'test_function_seconds_count{function="open_ports"} 1' in registry.render()
+
+def test_collectors_run_before_rendering():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_collected_total', 'Collected', ['event'])
+    registry.add_collector(lambda: counter.set_total(7, 'resets'))
+
+    assert 'test_collected_total{event="resets"} 7' in registry.render()
+
+def test_metrics_endpoint():
+    client = app.test_client()
+    client.get('/run?command=ping')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'cultiva_command_seconds_count{command="ping",success="true"}' in response.get_data(as_text=True)
@@ -0,0 +1,123 @@
+""" pytests for the serial multiplexer """
+
+import json
+import time
+import threading
+
+import pytest
+
+from app.core.serial import SerialConnection
+from app.core.controller import read_sensors_async, open_ports
+from tests.test_serial import FakeLogger
+
+
+class ReorderingController:
+    """ Acknowledges every command and answers them in reverse order """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.output = bytearray()
+        self.received = []
+
+    @property
+    def in_waiting(self):
+        return len(self.output)
+
+    def read(self, size=1):
+        with self.lock:
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+    def write(self, payload):
+        command = json.loads(payload.decode()[1:-1])
+
+        with self.lock:
+            self.output += b'<{"type":"commandReceived","id":"' + command['id'].encode() + b'"}>'
+            self.received.append(command)
+
+            if len(self.received) == self.batch_size:
+                for received in reversed(self.received):
+                    self.output += self.result(received).encode()
+
+                self.received = []
+
+    def result(self, command):
+        result = {'type': 'result', 'id': command['id']}
+
+        if command['command'] == 'batch':
+            result['success'] = True
+            result['results'] = [self.operation_result(operation) for operation in command['arguments']]
+        else:
+            result.update(self.operation_result(command))
+
+        return '<' + json.dumps(result) + '>'
+
+    def operation_result(self, operation):
+        if operation['command'] == 'read':
+            message = 'read(' + ','.join(str(i) for i in range(len(operation['arguments']))) + ')'
+        elif operation['command'] == 'fail':
+            return {'success': False, 'message': 'fail()'}
+        else:
+            message = operation['command'].rstrip('e') + 'ed(' + ', '.join(operation['arguments']) + ')'
+
+        return {'success': True, 'message': message}
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(SerialConnection, 'open', lambda self: None)
+    connection = SerialConnection(0, 0, FakeLogger())
+    connection.poll_interval = 0.001
+    yield connection
+    connection.stop_multiplexer()
+
+
+def test_results_out_of_order(connection):
+    connection.connection = ReorderingController(2)
+    connection.start_multiplexer()
+
+    first = read_sensors_async(connection, ['A:1'], FakeLogger())
+    second = read_sensors_async(connection, ['A:1', 'A:2'], FakeLogger())
+
+    assert second.result(1) == [0, 1]
+    assert first.result(1) == [0]
+
+def test_synchronous_wrapper(connection):
+    connection.connection = ReorderingController(1)
+    connection.start_multiplexer()
+
+    assert open_ports(connection, [3], FakeLogger()) is None
+    assert connection.multiplexer.in_flight() == 0
+
+def test_without_multiplexer(connection):
+    connection.connection = ReorderingController(1)
+
+    assert read_sensors_async(connection, ['A:1'], FakeLogger()).result() == [0]
+
+class DroppingController(ReorderingController):
+    """ Loses every command whose id starts with 'lost' """
+
+    def write(self, payload):
+        if json.loads(payload.decode()[1:-1])['id'].startswith('lost'):
+            return
+
+        super().write(payload)
+
+def test_lost_command_expires_under_steady_traffic(connection):
+    connection.connection = DroppingController(1)
+    connection.start_multiplexer()
+    connection.multiplexer.ack_timeout = 50
+
+    lost = connection.multiplexer.submit('lost', '{"id":"lost","command":"ping","arguments":[]}')
+    start = time.monotonic()
+
+    # Other commands keep the link busy the whole time
+    while not lost.done() and time.monotonic() - start < 2:
+        command_id = str(time.monotonic())
+        connection.multiplexer.send(command_id, '{"id":"' + command_id + '","command":"ping","arguments":[]}', 1)
+
+    assert lost.done()
+    assert time.monotonic() - start < 1
+    assert 'acknowledgement' in str(lost.exception())
@@ -0,0 +1,114 @@
+""" pytests for the alert outbox """
+
+import time
+import pytest
+
+from app.core.hub import HubClient
+from app.core.outbox import AlertOutbox
+from app.core.sentinel import SentinelRepository
+from app.core.store import SnapshotStore
+from app.core.stub_hub import StubHub
+
+
+@pytest.fixture
+def hub():
+    hub = StubHub(seed=1)
+    hub.start()
+    yield hub
+    hub.stop()
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = SentinelRepository(SnapshotStore(str(tmp_path / 'sentinel.json'), flush_interval=None))
+
+    for i in range(300):
+        repository.insert_alert({ 'id': str(i), 'key': 'Alert(' + str(i) + ')', 'severity': 0 })
+
+    return repository
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    return condition()
+
+
+def test_failed_alerts_back_off(hub, repository):
+    hub.failure_rate = 0.5
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2, batch_size=50), max_in_flight=300, drain_rate=1000, base_delay=60)
+
+    assert outbox.drain_once() == 300
+    assert 0 < outbox.failed < 300
+
+    failed = repository.get_alerts()
+    assert len(failed) == outbox.failed
+    assert all(alert['attempts'] == 1 and alert['next_attempt'] > time.time() + 20 for alert in failed)
+    assert outbox.drain_once() == 0
+
+    assert outbox.reschedule(dict(failed[0], attempts=20))['next_attempt'] <= time.time() + outbox.max_delay
+
+def test_delivered_alerts_are_removed_without_outbox_fields(hub, repository):
+    repository.update_alerts([{ 'id': '0', 'attempts': 3, 'next_attempt': 0, 'dispatched_to_phone': True }])
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2), max_in_flight=300, drain_rate=1000)
+
+    outbox.drain_once()
+
+    assert repository.count_alerts() == 0
+    assert set(hub.alerts['0']) == { 'id', 'key', 'severity' }
+
+def test_in_flight_and_drain_rate_are_limited(hub, repository):
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2), max_in_flight=50, drain_rate=500)
+
+    assert outbox.drain_once() == 50
+
+    start = time.monotonic()
+    sent = sum(outbox.drain_once() for i in range(5))
+    elapsed = time.monotonic() - start
+
+    assert sent <= 250
+    assert elapsed >= (sent - 50) / 500.0 * 0.9
+
+def test_drains_in_the_background(hub, repository):
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2), max_in_flight=100, drain_rate=1000, poll_interval=0.1)
+    outbox.start()
+
+    assert wait_for(lambda: repository.count_alerts() == 0)
+    assert outbox.status()['delivered'] == 300
+
+    outbox.stop()
+
+def test_notify_makes_pending_alerts_due(hub, repository):
+    repository.update_alerts([{ 'id': str(i), 'attempts': 4, 'next_attempt': time.time() + 600 } for i in range(300)])
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2), max_in_flight=300, drain_rate=1000)
+
+    assert outbox.drain_once() == 0
+
+    outbox.notify()
+
+    assert outbox.drain_once() == 300
+    assert repository.count_alerts() == 0
+
+def test_unreachable_hub_pauses_the_outbox(hub, repository):
+    address = hub.address
+    hub.stop()
+
+    outbox = AlertOutbox(repository, HubClient(address, 2, batch_size=50, parallelism=1, timeout=0.5), max_in_flight=300, drain_rate=1000, base_delay=60)
+
+    assert outbox.drain_once() == 300
+    assert outbox.paused_until > time.time() + 20
+    assert outbox.drain_once() == 0
+    assert outbox.wait_time() == outbox.poll_interval
+
+    # The alerts themselves are not charged with the outage
+    assert all('attempts' not in alert and alert.get('next_attempt', 0) == 0 for alert in repository.get_alerts())
+
+    outbox.notify()
+    assert outbox.paused_until is None
+
+def test_zero_drain_rate_is_unlimited(hub, repository):
+    outbox = AlertOutbox(repository, HubClient(hub.address, 2), max_in_flight=300, drain_rate=0)
+
+    assert outbox.drain_once() == 300
+    assert repository.count_alerts() == 0
@@ -0,0 +1,106 @@
+""" pytests for the controller wire protocols """
+
+import json
+import pytest
+
+from app.core import protocol
+from app.core.serial import SerialConnection
+from app.core.simulator import VirtualController
+from app.core.controller import open_ports, read_sensors, read_sensors_async, ControllerTransaction
+from tests.test_serial import FakeLogger
+
+
+def roundtrip(command):
+    binary = protocol.BinaryProtocol()
+    frames = protocol.BinaryFrameBuffer()
+    frames.feed(binary.encode(json.dumps(command)))
+
+    return binary, protocol.decode_request(frames.next_frame())
+
+def test_commands_round_trip():
+    _, (opcode, command) = roundtrip({ 'id': 'a', 'command': 'read', 'arguments': ['A:1', 'US:2,3', 'D:4'] })
+    assert opcode == protocol.READ
+    assert command == { 'id': 1, 'command': 'read', 'arguments': ['A:1', 'US:2,3', 'D:4'] }
+
+    _, (opcode, command) = roundtrip({ 'id': 'b', 'command': 'batch', 'arguments': [{ 'command': 'open', 'arguments': ['3'] }, { 'command': 'ping', 'arguments': [] }] })
+    assert opcode == protocol.BATCH
+    assert command['arguments'] == [{ 'command': 'open', 'arguments': ['3'] }, { 'command': 'ping', 'arguments': [] }]
+
+def test_unknown_commands_fall_back_to_text():
+    _, (opcode, command) = roundtrip({ 'id': 'c', 'command': 'blink', 'arguments': ['fast'] })
+    assert opcode == protocol.TEXT
+    assert command == { 'id': 1, 'command': 'blink', 'arguments': ['fast'] }
+
+def test_results_decode_to_json_with_original_id():
+    binary, (opcode, command) = roundtrip({ 'id': 'abc', 'command': 'read', 'arguments': ['A:1', 'A:2'] })
+
+    ack = binary.decode(protocol.HEADER.pack(protocol.ACKNOWLEDGEMENT, command['id']))
+    assert json.loads(ack) == { 'type': 'commandReceived', 'id': 'abc' }
+
+    result = protocol.encode_result(opcode, command['arguments'], { 'success': True, 'message': 'read(512,-7)' })
+    decoded = json.loads(binary.decode(protocol.HEADER.pack(protocol.RESULT, command['id']) + result))
+    assert decoded == { 'type': 'result', 'id': 'abc', 'success': True, 'message': 'read(512,-7)' }
+
+def test_frame_buffer_rejects_bad_checksum_and_resyncs():
+    frames = protocol.BinaryFrameBuffer()
+    good = protocol.frame(b'\x04\x01\x00')
+    corrupt = bytearray(protocol.frame(b'\x04\x02\x00'))
+    corrupt[-1] ^= 0xFF
+
+    frames.feed(b'\x00garbage' + bytes(corrupt) + good[:3])
+    assert frames.next_frame() is None
+
+    frames.feed(good[3:])
+    assert frames.next_frame() == b'\x04\x01\x00'
+    assert frames.next_frame() is None
+
+def test_frame_rejects_oversized_payload():
+    with pytest.raises(Exception):
+        protocol.frame(bytes(256))
+
+
+@pytest.fixture
+def simulator():
+    simulator = VirtualController(garbage_rate=0.5, seed=1)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+@pytest.fixture
+def connection(simulator):
+    connection = SerialConnection(None, None, FakeLogger(), port=simulator.port, protocol='binary')
+    yield connection
+    connection.stop_multiplexer()
+    connection.close()
+
+
+def test_binary_protocol_is_negotiated(connection, simulator):
+    open_ports(connection, [3], FakeLogger())
+
+    assert connection.protocol.name == 'binary'
+    assert simulator.binary
+    assert simulator.open_ports == {'3'}
+    assert read_sensors(connection, ['A:1', 'US:2,3'], FakeLogger(), max_age=0) == [512, 512]
+
+def test_binary_transaction_and_pipelining(connection):
+    results = ControllerTransaction(connection, FakeLogger()).open_ports([5]).read_sensors(['A:1']).commit()
+    assert results[1] == {'success': True, 'result': [512]}
+
+    connection.start_multiplexer()
+    futures = [read_sensors_async(connection, ['A:1'], FakeLogger()) for i in range(10)]
+    assert [future.result(5) for future in futures] == [[512]] * 10
+
+def test_falls_back_to_json_when_declined():
+    simulator = VirtualController(supports_binary=False)
+    simulator.start()
+
+    try:
+        connection = SerialConnection(None, None, FakeLogger(), port=simulator.port, protocol='binary')
+        open_ports(connection, [4], FakeLogger())
+
+        assert connection.protocol.name == 'json'
+        assert simulator.open_ports == {'4'}
+
+        connection.close()
+    finally:
+        simulator.stop()
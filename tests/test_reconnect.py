@@ -0,0 +1,70 @@
+""" pytests for background reconnection and port resolution """
+
+import time
+
+import pytest
+
+from app.core import serial as serial_module
+from app.core.serial import SerialConnection, ControllerUnavailableError
+from app.core.simulator import VirtualController
+from app.core.controller import read_sensors
+from tests.test_serial import FakeLogger
+
+
+@pytest.fixture
+def simulator():
+    simulator = VirtualController()
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+def test_missing_controller_fails_fast():
+    connection = SerialConnection(None, None, FakeLogger(), port='/dev/does-not-exist')
+
+    try:
+        start = time.monotonic()
+        with pytest.raises(ControllerUnavailableError):
+            connection.submit('1', '{}').result()
+        assert time.monotonic() - start < 0.1
+    finally:
+        connection.close()
+
+def test_reset_reconnects_in_background(simulator):
+    connection = SerialConnection(None, None, FakeLogger(), port=simulator.port)
+
+    try:
+        simulator.reboot()
+        connection.reset()
+
+        assert connection.wait_until_available(5)
+        assert read_sensors(connection, ['A:1'], FakeLogger()) == [512]
+    finally:
+        connection.close()
+
+def test_warmup_is_bounded():
+    simulator = VirtualController()
+    simulator.booting = False
+    simulator.start()
+
+    start = time.monotonic()
+    connection = SerialConnection(None, None, FakeLogger(), port=simulator.port)
+
+    try:
+        assert time.monotonic() - start < 6
+        assert not connection.available.is_set()
+    finally:
+        connection.close()
+        simulator.stop()
+
+def test_resolved_port_is_cached(monkeypatch):
+    calls = []
+    monkeypatch.setattr(serial_module, 'port_cache', {})
+    monkeypatch.setattr(SerialConnection, 'connect', lambda self: None)
+    monkeypatch.setattr(SerialConnection, 'find_port', lambda self: calls.append(1) or '/dev/null')
+
+    connection = SerialConnection(1, 2, FakeLogger())
+
+    assert connection.resolve_port() == '/dev/null'
+    assert connection.resolve_port() == '/dev/null'
+    assert len(calls) == 1
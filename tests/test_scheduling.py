@@ -0,0 +1,59 @@
+""" pytests for the programme scheduler """
+
+import time
+import pytest
+
+from app import create_app
+from app.core.scheduling import ProgrammeScheduler, PriorityGate
+from tests.test_serial import FakeLogger
+
+app = create_app({ 'HARDWARE_OWNER': 'true' })
+
+
+@pytest.fixture
+def programmes():
+    scheduler = app.extensions['SCHEDULER']
+    programmes = ProgrammeScheduler(scheduler, app)
+    yield programmes
+
+    for name in programmes.jobs:
+        scheduler.remove_job(name)
+
+
+def test_gate_lets_higher_priorities_skip_ahead():
+    gate = PriorityGate()
+
+    assert gate.enter('irrigation', 10)
+    assert not gate.enter('sentinel', 0)
+    assert gate.enter('backup', 10)
+
+    gate.leave('irrigation')
+    gate.leave('backup')
+    assert gate.enter('sentinel', 0)
+    assert gate.enter('irrigation', 10)
+
+def test_lower_priority_runs_yield(programmes):
+    programmes.add('test-high', 'ping', 3600, priority=10)
+    sentinel = programmes.add('test-low', 'ping', 3600, priority=0)
+
+    programmes.gate.enter('test-high', 10)
+    programmes.run('test-low', FakeLogger())
+    programmes.gate.leave('test-high')
+    programmes.run('test-low', FakeLogger())
+
+    assert sentinel.yielded == 1
+    assert sentinel.runs == 1
+    assert sentinel.failures == 0
+
+def test_scheduled_runs_record_statistics(programmes):
+    programmes.add('test-ping', 'ping', 1)
+
+    deadline = time.monotonic() + 5
+
+    while programmes.jobs['test-ping'].runs == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    statistics = programmes.statistics()['test-ping']
+    assert statistics['runs'] >= 1
+    assert statistics['lastLateness'] is not None
+    assert statistics['averageDuration'] is not None
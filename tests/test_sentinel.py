@@ -0,0 +1,199 @@
+""" pytests for the sentinel probes, run context and repository """
+
+import time
+import threading
+import pytest
+
+from app.core import sentinel
+from app.core.sentinel import Sentinel, SentinelRunContext, SentinelRepository, AlertFactory, InternetProbe, CpuProbe, MemoryProbe, LocalIpAddressProbe
+from app.core.store import SnapshotStore
+from app.core.timeseries import TimeSeriesRegistry
+from tests.test_serial import FakeLogger
+
+
+class ProbeLogger(FakeLogger):
+    def __init__(self):
+        self.objects = {}
+
+    def log_h2(self, title, *args):
+        pass
+
+    def log_h3_object(self, title, data={}, *args):
+        self.objects[title] = data
+
+@pytest.fixture
+def checks(monkeypatch):
+    checks = []
+
+    def check_internet(url, timeout):
+        checks.append(url)
+        time.sleep(0.2)
+        return False
+
+    monkeypatch.setattr(sentinel, 'check_internet', check_internet)
+
+    return checks
+
+
+def test_connectivity_is_checked_once_per_context(checks):
+    context = SentinelRunContext()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(context.is_internet_up())) for i in range(3)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results == [False, False, False]
+    assert len(checks) == 1
+
+    assert not SentinelRunContext().is_internet_up()
+    assert len(checks) == 2
+
+def test_a_hanging_check_counts_as_down(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(sentinel, 'check_internet', lambda url, timeout: release.wait(5))
+
+    context = SentinelRunContext(timeout=0.1)
+    checker = threading.Thread(target=context.is_internet_up)
+    checker.start()
+    time.sleep(0.05)
+
+    # The phases share one deadline rather than each waiting it out
+    start = time.monotonic()
+    assert [context.is_internet_up() for i in range(3)] == [False, False, False]
+    assert time.monotonic() - start < 1.3
+
+    release.set()
+    checker.join()
+    assert not context.is_internet_up()
+
+def test_probes_run_concurrently_with_timeouts(monkeypatch, checks):
+    monkeypatch.setattr(InternetProbe, 'run', lambda self: 'OK' if self.is_internet_up() else 'Down')
+    monkeypatch.setattr(MemoryProbe, 'run', lambda self: time.sleep(0.2) or 50)
+    monkeypatch.setattr(CpuProbe, 'run', lambda self: time.sleep(3) or 1)
+    monkeypatch.setattr(LocalIpAddressProbe, 'run', lambda self: '10.0.0.2')
+
+    logger = ProbeLogger()
+    runner = Sentinel(logger, probe_timeout=0.3)
+
+    start = time.monotonic()
+    runner.run_probes()
+    elapsed = time.monotonic() - start
+
+    assert logger.objects['Probes'] == { 'Internet access': 'Down', 'CPU': 'Timed out', 'Memory': 50, 'Local IP address': '10.0.0.2' }
+    assert elapsed < 2
+
+    assert not runner.context.is_internet_up()
+    assert len(checks) == 1
+
+def test_repository_serves_state_and_alerts_from_memory(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'sentinel.json'), flush_interval=None)
+    repository = SentinelRepository(store)
+    alert = AlertFactory().internet_down()
+
+    repository.insert_alert(alert)
+    repository.insert_alert(dict(alert, id='duplicate'))
+    assert [item['id'] for item in repository.get_alerts()] == [alert['id']]
+
+    repository.update_alert(dict(alert, dispatched_to_phone=True))
+    assert repository.get_alerts()[0]['dispatched_to_phone']
+
+    repository.update_state({ 'internet': { 'status': 'down', 'time': '2021-03-02 11:11:37' } })
+    repository.get_state()['internet']['status'] = 'changed by caller'
+    assert repository.get_state()['internet']['status'] == 'down'
+
+    assert repository.delete_alert(alert) == [1]
+    assert not repository.has_alerts()
+    assert store.dirty
+
+def test_alert_indexes_follow_inserts_updates_and_removals(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'sentinel.json'), flush_interval=None)
+    store.insert('alerts', { 'id': 'stored', 'key': 'Stored', 'severity': 3 })
+    repository = SentinelRepository(store)
+
+    for i in range(1000):
+        repository.insert_alert({ 'id': str(i), 'key': 'Alert(' + str(i % 500) + ')', 'severity': i % 3 })
+
+    assert len(repository.get_alerts()) == 501
+    assert [alert['id'] for alert in repository.get_alerts(3)] == ['stored']
+    assert len(repository.get_alerts(2)) == 166
+
+    repository.update_alerts([{ 'id': '2', 'severity': 3 }, { 'id': 'unknown', 'severity': 3 }])
+    assert [alert['id'] for alert in repository.get_alerts(3)] == ['stored', '2']
+    assert repository.get_alert('2')['severity'] == 3
+
+    assert len(repository.delete_alerts(repository.get_alerts(3) + [{ 'id': 'unknown' }])) == 2
+    assert repository.get_alert('2') is None
+    assert repository.get_alerts(3) == []
+
+    repository.insert_alert({ 'id': 'again', 'key': 'Alert(2)', 'severity': 0 })
+    assert repository.get_alert('again') is not None
+
+def test_backlog_gauge_counts_stored_alerts_on_startup(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'sentinel.json'), flush_interval=None)
+
+    for i in range(3):
+        store.insert('alerts', { 'id': str(i), 'key': 'Alert(' + str(i) + ')', 'severity': 0 })
+
+    sentinel.alert_backlog.set(0)
+    SentinelRepository(store)
+
+    assert sentinel.alert_backlog.values[()] == 3
+
+class FakeOutbox:
+    def __init__(self):
+        self.notified = 0
+
+    def notify(self):
+        self.notified += 1
+
+def test_dispatch_hands_alerts_to_the_outbox(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'sentinel.json'), flush_interval=None)
+    outbox = FakeOutbox()
+    logger = ProbeLogger()
+    runner = Sentinel(logger, probe_timeout=0.1, outbox=outbox)
+    runner.repository = SentinelRepository(store)
+    runner.context.internet_checked = threading.Event()
+    runner.context.internet_checked.set()
+    runner.context.internet_up = True
+
+    for i in range(5000):
+        runner.repository.insert_alert({ 'id': str(i), 'key': 'Alert(' + str(i) + ')', 'severity': 3 if i == 1 else 0 })
+
+    runner.repository.update_alerts([{ 'id': '1', 'attempts': 1, 'next_attempt': 0 }, { 'id': '2', 'attempts': 2, 'next_attempt': time.time() + 60 }])
+
+    phoned = []
+
+    # The outbox reschedules the alert while it is being phoned
+    def dispatch_to_phone(alert):
+        phoned.append(alert)
+        runner.repository.update_alerts([{ 'id': alert['id'], 'attempts': 4, 'next_attempt': 1234 }])
+
+    runner.alert_dispatcher.dispatch_to_phone = dispatch_to_phone
+
+    start = time.monotonic()
+    runner.dispatch_alerts()
+
+    assert time.monotonic() - start < 1
+    assert outbox.notified == 1
+    assert [alert['id'] for alert in phoned] == ['1']
+    assert runner.repository.get_alert('1')['dispatched_to_phone']
+    assert runner.repository.get_alert('1')['attempts'] == 4
+    assert logger.objects['Alerts']['Alert(0)'] == 'Queued for Hub'
+    assert logger.objects['Alerts']['Alert(2)'].endswith('(attempt 3)')
+    assert runner.repository.count_alerts() == 5000
+
+def test_probe_results_are_recorded_as_health_series(monkeypatch):
+    health = TimeSeriesRegistry()
+    monkeypatch.setattr(sentinel, 'health', health)
+
+    runner = Sentinel(ProbeLogger(), probe_timeout=0.1)
+    runner.record_health({ 'Internet access': 'OK', 'CPU': 12.5, 'Memory': 'Timed out', 'Local IP address': '10.0.0.2' }, 5000)
+    runner.record_health({ 'Internet access': 'Failed', 'CPU': 20 }, 5030)
+
+    assert health.get('Internet access').window('raw', 5000, 5030) == [[5000.0, 1.0, 1.0, 1.0], [5030.0, 0.0, 0.0, 0.0]]
+    assert [point[1] for point in health.get('CPU').window('raw', 5000, 5030)] == [12.5, 20.0]
+    assert health.get('Local IP address', create=False) is None
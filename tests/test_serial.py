@@ -0,0 +1,67 @@
+""" pytests for the serial frame reader """
+
+import pytest
+
+from app.core.serial import FrameBuffer, SerialConnection
+
+
+class FakeLogger:
+    def log(self, message, *args):
+        pass
+
+    def warning(self, message, *args):
+        pass
+
+    def error(self, message, *args):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        self.reads += 1
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(SerialConnection, 'open', lambda self: None)
+    return SerialConnection(0, 0, FakeLogger())
+
+
+def test_frame_buffer_skips_garbage():
+    frames = FrameBuffer()
+    frames.feed(b'noise<{"a":1}>tail')
+    assert frames.next_frame() == '{"a":1}'
+    assert frames.next_frame() is None
+
+def test_frame_buffer_handles_split_frames():
+    frames = FrameBuffer()
+    frames.feed(b'<{"type"')
+    assert frames.next_frame() is None
+    frames.feed(b':"ready"}><next')
+    assert frames.next_frame() == '{"type":"ready"}'
+    assert frames.pending() == 'next'
+
+def test_receive_reads_in_bulk(connection):
+    connection.connection = FakeConnection([b'<{"type":"ready"}>'])
+    assert connection.receive(100) == '{"type":"ready"}'
+    assert connection.connection.reads == 1
+
+def test_receive_carries_leftover_bytes(connection):
+    connection.connection = FakeConnection([b'<first><sec', b'ond>'])
+    assert connection.receive(100) == 'first'
+    assert connection.receive(100) == 'second'
+
+def test_receive_times_out(connection):
+    connection.connection = FakeConnection([b'<partial'])
+    with pytest.raises(Exception) as error:
+        connection.receive(10)
+    assert 'partial' in str(error.value)
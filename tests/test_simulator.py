@@ -0,0 +1,49 @@
+""" pytests for SerialConnection against the virtual controller """
+
+import pytest
+
+from app.core.serial import SerialConnection
+from app.core.simulator import VirtualController
+from app.core.controller import open_ports, read_sensors, read_sensors_async, ControllerTransaction
+from tests.test_serial import FakeLogger
+
+
+@pytest.fixture
+def simulator():
+    simulator = VirtualController(garbage_rate=0.5, seed=1)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+@pytest.fixture
+def connection(simulator):
+    connection = SerialConnection(None, None, FakeLogger(), port=simulator.port)
+    yield connection
+    connection.stop_multiplexer()
+    connection.close()
+
+
+def test_warmup_and_send(connection, simulator):
+    open_ports(connection, [3], FakeLogger())
+    assert simulator.open_ports == {'3'}
+    assert read_sensors(connection, ['A:1', 'A:2'], FakeLogger()) == [512, 512]
+
+def test_transaction(connection, simulator):
+    results = ControllerTransaction(connection, FakeLogger()).open_ports([5]).read_sensors(['A:1']).commit()
+    assert results[1] == {'success': True, 'result': [512]}
+    assert simulator.open_ports == {'5'}
+
+def test_pipelined_reads(connection):
+    connection.start_multiplexer()
+    futures = [read_sensors_async(connection, ['A:1'], FakeLogger()) for i in range(10)]
+    assert [future.result(5) for future in futures] == [[512]] * 10
+
+def test_sensor_reads_are_cached(connection, simulator):
+    read_sensors(connection, ['A:3'], FakeLogger())
+    received = simulator.commands_received
+
+    assert read_sensors(connection, ['A:3'], FakeLogger()) == [512]
+    assert simulator.commands_received == received
+
+    read_sensors(connection, ['A:3'], FakeLogger(), max_age=0)
+    assert simulator.commands_received == received + 1
@@ -0,0 +1,98 @@
+""" pytests for the write-behind snapshot store """
+
+import os
+import json
+import time
+
+from tinydb import TinyDB
+
+from app.core.store import SnapshotStore
+
+
+def test_loads_and_writes_tinydb_files(tmp_path):
+    path = str(tmp_path / 'store.json')
+    database = TinyDB(path)
+    database.table('alerts').insert({ 'key': 'a' })
+    database.table('alerts').insert({ 'key': 'b' })
+    database.close()
+
+    store = SnapshotStore(path, flush_interval=None)
+    assert store.table('alerts') == { 1: { 'key': 'a' }, 2: { 'key': 'b' } }
+
+    store.remove('alerts', [1])
+    assert store.insert('alerts', { 'key': 'c' }) == 3
+    assert store.flush()
+
+    database = TinyDB(path)
+    assert [document['key'] for document in database.table('alerts').all()] == ['b', 'c']
+    assert [document.doc_id for document in database.table('alerts').all()] == [2, 3]
+    database.close()
+
+def test_changes_are_coalesced_into_one_snapshot(tmp_path):
+    path = tmp_path / 'store.json'
+    store = SnapshotStore(str(path), flush_interval=0.2)
+
+    for i in range(100):
+        store.insert('alerts', { 'key': str(i) })
+
+    assert not path.exists()
+
+    deadline = time.monotonic() + 5
+
+    while store.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    time.sleep(0.3)
+
+    assert store.writes == 1
+    assert len(json.loads(path.read_text())['alerts']) == 100
+    assert [item.name for item in tmp_path.iterdir()] == ['store.json']
+
+def test_close_writes_pending_changes(tmp_path):
+    path = tmp_path / 'store.json'
+    store = SnapshotStore(str(path), flush_interval=60)
+    store.insert('state', { 'internet': { 'status': 'up' } })
+    store.close()
+
+    assert json.loads(path.read_text()) == { 'state': { '1': { 'internet': { 'status': 'up' } } } }
+    assert not store.flush()
+
+def test_failed_snapshots_are_retried(tmp_path, monkeypatch):
+    path = tmp_path / 'store.json'
+    store = SnapshotStore(str(path), flush_interval=0.1)
+    replace = os.replace
+    failures = []
+
+    def failing_replace(source, destination):
+        if not failures:
+            failures.append(source)
+            raise OSError(28, 'No space left on device')
+
+        replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    store.insert('alerts', { 'key': 'a' })
+
+    deadline = time.monotonic() + 5
+
+    while store.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert len(failures) == 1
+    assert not store.dirty
+    assert json.loads(path.read_text()) == { 'alerts': { '1': { 'key': 'a' } } }
+    assert [item.name for item in tmp_path.iterdir()] == ['store.json']
+
+def test_read_only_stores_never_write(tmp_path):
+    path = tmp_path / 'store.json'
+    owner = SnapshotStore(str(path), flush_interval=0.01)
+    owner.insert('alerts', { 'key': 'owner' })
+    owner.close()
+
+    worker = SnapshotStore(str(path), flush_interval=0.01, writable=False)
+    worker.insert('alerts', { 'key': 'worker' })
+    time.sleep(0.05)
+    worker.close()
+
+    assert worker.timer is None and worker.dirty
+    assert [document['key'] for document in json.loads(path.read_text())['alerts'].values()] == ['owner']
@@ -0,0 +1,57 @@
+""" pytests for the node health time series """
+
+import pytest
+
+from app import create_app
+from app.core.timeseries import RingBuffer, TimeSeries, health
+
+
+def test_ring_buffer_keeps_the_latest_points_in_order():
+    buffer = RingBuffer(4)
+
+    for i in range(10):
+        buffer.append(float(i), i * 10, i * 10, i * 10)
+
+    assert len(buffer) == 4
+    assert [point[0] for point in buffer.window()] == [6.0, 7.0, 8.0, 9.0]
+    assert buffer.window(7, 8) == [[7.0, 70.0, 70.0, 70.0], [8.0, 80.0, 80.0, 80.0]]
+    assert buffer.window(20) == []
+    assert buffer.times.itemsize == 8 and len(buffer.times) == 4
+
+def test_samples_are_rolled_up_per_minute_and_hour():
+    series = TimeSeries('CPU', (('raw', None, 5), ('1m', 60, 40), ('1h', 3600, 10)))
+
+    for i in range(180):
+        series.record(i % 60, 3600 + i * 10)
+
+    assert len(series.window('raw')) == 5
+
+    minutes = series.window('1m')
+    assert len(minutes) == 30
+    assert minutes[0] == [3600.0, 2.5, 0.0, 5.0]
+    assert minutes[-1][0] == 3600 + 29 * 60
+
+    hours = series.window('1h')
+    assert len(hours) == 1
+    assert hours[0][0] == 3600.0
+    assert hours[0][2:] == [0.0, 59.0]
+
+    assert series.window('1m', 3600 + 28 * 60) == minutes[-2:]
+
+    with pytest.raises(Exception):
+        series.window('1d')
+
+def test_health_endpoint_returns_a_window():
+    client = create_app({ 'TESTING': True }).test_client()
+    health.record('Test memory', 42.5, 1000)
+    health.record('Test memory', 40, 1010)
+
+    assert 'Test memory' in client.get('/api/health').get_json()['series']
+
+    response = client.get('/api/health/Test%20memory?start=1005').get_json()
+    assert response['columns'] == ['time', 'mean', 'min', 'max']
+    assert response['points'] == [[1010.0, 40.0, 40.0, 40.0]]
+
+    assert client.get('/api/health/Test%20memory?resolution=1m').get_json()['points'][0][1] == 41.25
+    assert client.get('/api/health/Test%20memory?resolution=1d').status_code == 400
+    assert client.get('/api/health/Unknown').status_code == 404
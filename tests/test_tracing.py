@@ -0,0 +1,104 @@
+""" pytests for tracing and profiling """
+
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.core import tracing
+from app.core.serial import SerialConnection
+from app.core.simulator import VirtualController
+from app.core.controller import open_ports
+from tests.test_serial import FakeLogger
+
+app = create_app()
+
+
+def spans(trace):
+    return { span['name']: span for span in trace.to_dict()['spans'] }
+
+def test_spans_record_total_and_self_time():
+    with tracing.trace('root') as trace:
+        with tracing.span('outer'):
+            time.sleep(0.02)
+
+            for i in range(2):
+                with tracing.span('inner'):
+                    time.sleep(0.01)
+
+    recorded = spans(trace)
+    assert recorded['inner']['count'] == 2
+    assert recorded['outer']['total'] >= recorded['inner']['total'] + 15
+    assert recorded['outer']['self'] < recorded['outer']['total']
+    assert trace.to_dict()['duration'] >= recorded['outer']['total']
+
+def test_spans_outside_a_trace_are_ignored():
+    with tracing.span('orphan'):
+        assert tracing.current() is None
+
+def test_spans_follow_work_to_other_threads():
+    with tracing.trace('root') as trace:
+        parent = tracing.current()
+
+        def work():
+            with tracing.attach(parent):
+                with tracing.span('worker'):
+                    pass
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(work).result()
+
+    assert spans(trace)['worker']['count'] == 1
+
+def test_parallel_workers_keep_their_own_child_time():
+    with tracing.trace('root') as trace:
+        parent = tracing.current()
+
+        def work():
+            with tracing.attach(parent):
+                with tracing.span('worker'):
+                    time.sleep(0.05)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(work) for i in range(4)]:
+                future.result()
+
+    recorded = spans(trace)
+    assert recorded['worker']['count'] == 4
+    assert recorded['root']['self'] == recorded['root']['total']
+
+def test_controller_calls_are_broken_down():
+    simulator = VirtualController()
+    simulator.start()
+
+    try:
+        connection = SerialConnection(None, None, FakeLogger(), port=simulator.port)
+
+        with tracing.trace('root') as trace:
+            open_ports(connection, [3], FakeLogger())
+
+        connection.close()
+    finally:
+        simulator.stop()
+
+    recorded = spans(trace)
+    assert recorded['open_ports']['count'] == 1
+    assert recorded['serial.send']['count'] == 1
+    assert recorded['serial.receive']['count'] == 2
+
+def test_run_returns_trace_and_profile():
+    response = app.test_client().get('/run?command=ping&trace=true&profile=true').get_json()
+
+    assert response['result'] == 'pong'
+    assert [span['name'] for span in response['trace']['spans']].count('handler:ping') == 1
+    assert 'function calls' in response['profile']['stats']
+
+def test_profile_dumps_stay_in_their_directory(tmp_path):
+    directory = tmp_path / 'profiles'
+
+    with tracing.profile(str(directory), '../../etc/cron.d/x') as result:
+        pass
+
+    assert os.path.dirname(result['dump']) == os.path.realpath(str(directory))
+    assert os.path.basename(result['dump']).startswith('_.._etc_cron.d_x-')
@@ -0,0 +1,141 @@
+""" pytests for the retry policy and circuit breaker """
+
+import time
+import threading
+
+import pytest
+
+from app.core.wrappers import retry, RetryPolicy, CircuitBreaker, CircuitOpenError, SingleFlight, TtlCache, statistics, remaining_budget
+
+
+def failing(calls):
+    def call():
+        calls.append(time.monotonic())
+        raise Exception('failed')
+    return call
+
+def test_retries_until_attempts_run_out():
+    calls = []
+    wrapped = retry(policy=RetryPolicy('test.attempts', attempts=3, base_delay=0.01))(failing(calls))
+
+    with pytest.raises(Exception):
+        wrapped()
+
+    assert len(calls) == 3
+    assert statistics.snapshot()['test.attempts.retries'] == 2
+
+def test_budget_is_never_exceeded():
+    calls = []
+    wrapped = retry(policy=RetryPolicy('test.budget', attempts=10, budget=0.3, base_delay=0.1, jitter=0))(failing(calls))
+
+    start = time.monotonic()
+
+    with pytest.raises(Exception):
+        wrapped()
+
+    assert time.monotonic() - start < 0.3
+    assert statistics.snapshot()['test.budget.budget_exhausted'] == 1
+
+def test_no_attempt_starts_without_time_for_it():
+    calls = []
+    wrapped = retry(policy=RetryPolicy('test.attempt_timeout', attempts=3, budget=1, base_delay=0.01, attempt_timeout=1))(failing(calls))
+
+    with pytest.raises(Exception):
+        wrapped()
+
+    assert len(calls) == 1
+    assert statistics.snapshot()['test.attempt_timeout.budget_exhausted'] == 1
+
+def test_budget_is_visible_to_the_call():
+    budgets = []
+    wrapped = retry(policy=RetryPolicy('test.visible', budget=2))(lambda: budgets.append(remaining_budget()))
+    wrapped()
+
+    assert 0 < budgets[0] <= 2
+    assert remaining_budget() is None
+
+def test_give_up_on_skips_retries():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise KeyError('fatal')
+
+    with pytest.raises(KeyError):
+        retry(policy=RetryPolicy('test.give_up', give_up_on=(KeyError,)))(call)()
+
+    assert len(calls) == 1
+
+def test_breaker_trips_and_rejects():
+    trips = []
+    breaker = CircuitBreaker('device', failure_threshold=2, cooldown=60, on_trip=lambda: trips.append(1))
+    calls = []
+    wrapped = retry(policy=RetryPolicy('test.breaker', attempts=5, base_delay=0.01), breaker=lambda: breaker)(failing(calls))
+
+    with pytest.raises(CircuitOpenError):
+        wrapped()
+
+    assert len(calls) == 2
+    assert trips == [1]
+    assert breaker.state() == 'open'
+
+def test_breaker_ignores_errors_it_is_told_to():
+    breaker = CircuitBreaker('device', failure_threshold=1, ignore=(KeyError,))
+    breaker.record_error(KeyError('declined'))
+    assert breaker.state() == 'closed'
+
+    breaker.record_error(Exception('timed out'))
+    assert breaker.state() == 'open'
+
+def test_breaker_closes_after_success():
+    breaker = CircuitBreaker('device', failure_threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.state() == 'halfOpen'
+    breaker.record_success()
+    assert breaker.state() == 'closed'
+
+def test_plain_decorator_still_works():
+    @retry
+    def ok():
+        return 'ok'
+
+    assert ok() == 'ok'
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return 'value'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    started.wait(1)
+
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+
+    leader.join()
+    follower.join()
+
+    assert results == ['value', 'value']
+    assert len(calls) == 1
+
+def test_ttl_cache_expires():
+    cache = TtlCache(ttl=0.05)
+    cache.put('key', 1)
+
+    assert cache.get('key') == (True, 1)
+    assert cache.get('key', max_age=0) == (False, None)
+
+    time.sleep(0.06)
+
+    assert cache.get('key') == (False, None)
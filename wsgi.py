@@ -0,0 +1,6 @@
+""" WSGI entry point, gunicorn wsgi:app """
+
+from app import create_app, start_background_services
+
+app = create_app()
+start_background_services(app)